@@ -2,7 +2,7 @@ MAX_VALUE = 254 # arcgis seems to have problems with 255 (makes holes where one
 BLACK_RGB = [0] * 3
 WHITE_RGB = [MAX_VALUE] * 3
 
-import operator
+import operator, heapq, numpy
 
 ## COLORING and color objects
 class ColorCodeError(Exception):
@@ -18,6 +18,7 @@ class ColorZone:
     self.neighColors = set()
     self.color = None
     self.neighs = []
+    self.rank = None # coloring order tie breaker, renewed with every urgency change, None once colored
   
   def addNeigh(self, neigh):
     self.neighs.append(neigh)
@@ -27,13 +28,16 @@ class ColorZone:
   
   def colorWithFirst(self, colors, shuffle=True):
     '''Colors itself with the first color in the provided list that none of its neighbours has.
-    If configured with shuffle property on, shuffles the list randomly before choosing.'''
+    If configured with shuffle property on, chooses randomly among those colors instead.'''
     if shuffle:
-      random.shuffle(colors)
-    for col in colors:
-      if col not in self.neighColors:
-        self.colorWith(col)
-        break
+      allowed = [col for col in colors if col not in self.neighColors]
+      if allowed:
+        self.colorWith(random.choice(allowed))
+    else:
+      for col in colors:
+        if col not in self.neighColors:
+          self.colorWith(col)
+          break
   
   def colorWith(self, color):
     '''Colors itself with the given color and notifies its neighbours of it.'''
@@ -56,6 +60,10 @@ class ColorZone:
     The urgency increases with the number of neighbours colored and secondarily with the total number of neighbours.'''
     return self.colN + (len(self.neighs) - self.colN) * 1e-6
   
+  def getHeapKey(self):
+    '''Returns the urgency as a min-heap key: the most urgent zone has the smallest key.'''
+    return (-self.colN, self.colN - len(self.neighs))
+  
   
 class ColorChooser:
   sortFx = operator.methodcaller('getSorter')
@@ -80,11 +88,32 @@ class ColorChooser:
     if shuffle:
       global random
       import random
-    uncolored = list(self.zones.values())
-    while uncolored:
-      uncolored.sort(key=self.sortFx)
-      now = uncolored.pop()
+    # urgency heap with lazy updates: coloring a zone pushes fresh entries for its neighbours
+    # ties are broken as by the former stable re-sort: the zone whose urgency changed earlier goes first,
+    # so every change hands out a rank above all previous ones; neighbours changed in the same step
+    # (more times first if listed repeatedly) keep their mutual order
+    heap = []
+    for i, zone in enumerate(self.zones.itervalues()):
+      zone.rank = -i
+      heap.append(zone.getHeapKey() + (zone.rank, zone))
+    heapq.heapify(heap)
+    rank = 0
+    while heap:
+      entry = heapq.heappop(heap)
+      now = entry[-1]
+      if entry[-2] != now.rank: # already colored or outdated urgency
+        continue
+      now.rank = None
       now.colorWithFirst(self.colors, shuffle=shuffle)
+      if now.color is not None:
+        changes = {}
+        for neigh in now.neighs:
+          if neigh.rank is not None:
+            changes[neigh] = changes.get(neigh, 0) + 1
+        for times, oldRank, neigh in sorted((times, neigh.rank, neigh) for neigh, times in changes.iteritems()):
+          rank += 1
+          neigh.rank = rank
+          heapq.heappush(heap, neigh.getHeapKey() + (rank, neigh))
     for zone in self.zones.itervalues():
       zone.colorIfNot(self.WHITE)
     return self.zones
@@ -99,6 +128,17 @@ class ColorChooser:
           colorList.append(col)
     return colorList
 
+def colorRegions(zoneGraph, labels, colorFileName, shuffle=True):
+  '''Colors regions given by zone labels on a graph.ZoneGraph so that no neighbouring regions
+  have the same color. The region neighbourhood is contracted from the zone neighbourhood.
+  Returns a dict of labels and hex color codes.'''
+  regions, firsts, seconds = zoneGraph.contract(labels)
+  neighbourhood = {region : [] for region in regions.tolist()}
+  for first, second in zip(firsts.tolist(), seconds.tolist()):
+    neighbourhood[first].append(second)
+  chooser = ColorChooser(neighbourhood, colorFileName)
+  return {region : zone.getColor() for region, zone in chooser.colorHeuristically(shuffle=shuffle).iteritems()}
+
 def rgbToHex(color):
   return ''.join('{:02x}'.format(int(num) if num < MAX_VALUE else MAX_VALUE) for num in color)
 
@@ -121,6 +161,10 @@ def rgbToHSV(rgb):
     if rgb[2] == maxcomp: pseudohue = ((rgb[0] - rgb[1]) / chroma) + 4
     return [pseudohue * MAX_VALUE / 6, chroma / maxcomp * MAX_VALUE, maxcomp]
 
+# RGB component indexes with the largest and second largest value by hue sextant
+LARGEST_COMPONENT = (0, 1, 1, 2, 2, 0)
+SECOND_COMPONENT = (1, 0, 2, 1, 0, 2)
+
 def hsvToRGB(hsv):
   chroma = hsv[1] * float(hsv[2]) / MAX_VALUE
   pseudohue = hsv[0] * 6.0 / MAX_VALUE
@@ -128,10 +172,38 @@ def hsvToRGB(hsv):
   seclargest = chroma * (1 - abs(pseudohue % 2 - 1))
   smallest = hsv[2] - chroma
   lowgray = [smallest] * 3
-  lowgray[{0 : 0, 1 : 1, 2 : 1, 3 : 2, 4 : 2, 5 : 0}[pseudohueint]] += chroma
-  lowgray[{0 : 1, 1 : 0, 2 : 2, 3 : 1, 4 : 0, 5 : 2}[pseudohueint]] += seclargest
+  lowgray[LARGEST_COMPONENT[pseudohueint]] += chroma
+  lowgray[SECOND_COMPONENT[pseudohueint]] += seclargest
   return lowgray
 
+## VECTORIZED VERSIONS operating on (n, 3) color arrays
+def rgbToHSVArray(rgb):
+  rgb = numpy.asarray(rgb, dtype=float).reshape(-1, 3)
+  red, green, blue = rgb[:,0], rgb[:,1], rgb[:,2]
+  maxcomp = rgb.max(axis=1)
+  chroma = maxcomp - rgb.min(axis=1)
+  gray = (chroma == 0)
+  safeChroma = numpy.where(gray, 1, chroma)
+  # later component rules take precedence as in rgbToHSV
+  pseudohue = numpy.where(blue == maxcomp, (red - green) / safeChroma + 4,
+    numpy.where(green == maxcomp, (blue - red) / safeChroma + 2, ((green - blue) / safeChroma) % 6))
+  hsv = numpy.empty_like(rgb)
+  hsv[:,0] = numpy.where(gray, 0, pseudohue * MAX_VALUE / 6)
+  hsv[:,1] = numpy.where(gray, 0, chroma / numpy.where(gray, 1, maxcomp) * MAX_VALUE)
+  hsv[:,2] = maxcomp
+  return hsv
+
+def hsvToRGBArray(hsv):
+  hsv = numpy.asarray(hsv, dtype=float).reshape(-1, 3)
+  chroma = hsv[:,1] * hsv[:,2] / MAX_VALUE
+  pseudohue = hsv[:,0] * 6.0 / MAX_VALUE
+  sextants = (pseudohue % 6).astype(int)
+  rows = numpy.arange(len(hsv))
+  rgb = numpy.repeat((hsv[:,2] - chroma)[:,numpy.newaxis], 3, axis=1)
+  rgb[rows, numpy.take(LARGEST_COMPONENT, sextants)] += chroma
+  rgb[rows, numpy.take(SECOND_COMPONENT, sextants)] += chroma * (1 - abs(pseudohue % 2 - 1))
+  return rgb
+
 # def rgbToHSL(rgb):
   # maxcomp = max(rgb)
   # mincomp = min(rgb)
@@ -224,6 +296,61 @@ def mixMaxHue(rgbitems):
   else:
     return [0, 0, 0]
 
+def checkDegrees(degrees):
+  sumdeg = degrees.sum(axis=1)
+  if ((sumdeg - 1) > 1e-5).any():
+    raise ValueError, 'cannot mix over 1, got %g' % sumdeg.max()
+  return sumdeg
+
+def mixDirectArray(colors, degrees):
+  '''Mixes an (k, 3) array of colors by an (n, k) matrix of degrees into n colors.'''
+  checkDegrees(degrees)
+  return degrees.dot(colors)
+
+def mixInvertedArray(colors, degrees):
+  return MAX_VALUE - mixDirectArray(MAX_VALUE - colors, degrees)
+
+def mixHueArray(hues, degrees):
+  '''Returns HSV colors of the given hues with saturation by the superiority of the largest degree
+  and value by the degree sum. Rows with all degrees zero get the minimum value, as mixHue gives them.'''
+  sumdeg = checkDegrees(degrees)
+  maxdeg = degrees.max(axis=1) if degrees.shape[1] else numpy.zeros(len(degrees))
+  hsv = numpy.empty((len(degrees), 3))
+  hsv[:,0] = hues
+  hsv[:,1] = maxdeg / numpy.where(sumdeg == 0, 1, sumdeg) * MAX_VALUE
+  hsv[:,2] = (MIN_MIXHUE_GRAYLEVEL + (1 - MIN_MIXHUE_GRAYLEVEL) * sumdeg) * MAX_VALUE
+  hsv[maxdeg < 1e-5] = MIN_MIXHUE_VALUE
+  return hsv
+
+def mixAvgHueArray(colors, degrees):
+  rgb = hsvToRGBArray(mixHueArray(rgbToHSVArray(mixDirectArray(colors, degrees))[:,0], degrees))
+  if not len(colors): # no items to mix are black
+    rgb[:] = 0
+  return rgb
+
+def mixMaxHueArray(colors, degrees):
+  hues = rgbToHSVArray(colors)[:,0]
+  rgb = hsvToRGBArray(mixHueArray(hues[degrees.argmax(axis=1)] if len(hues) else numpy.zeros(len(degrees)), degrees))
+  if not len(colors): # no items to mix are black
+    rgb[:] = 0
+  return rgb
+
+class ColorMixer:
+  '''A color mixing function with its vectorized counterpart.
+
+  Called with a list of (color, degree) items, mixes them into a single color.
+  Called with an (k, 3) array of colors and an (n, k) matrix of degrees, returns an (n, 3) array of mixed colors.'''
+  def __init__(self, itemMixer, arrayMixer):
+    self.itemMixer = itemMixer
+    self.arrayMixer = arrayMixer
+  
+  def __call__(self, items, degrees=None):
+    if degrees is None:
+      return self.itemMixer(items)
+    else:
+      colors = numpy.asarray(items, dtype=float).reshape(-1, 3)
+      return self.arrayMixer(colors, numpy.asarray(degrees, dtype=float).reshape(-1, len(colors)))
+
 def mixHSVMax(hsvitems):
   if hsvitems:
     maxitem = max(hsvitems, key=(lambda x: x[1]))
@@ -236,7 +363,8 @@ def mixHSVMax(hsvitems):
     # init[2] += col[2] * deg
   # return init
 
-COLOR_MIXERS = {'additive' : mixDirect, 'subtractive' : mixInverted, 'maxhue' : mixMaxHue, 'avghue' : mixAvgHue}
+COLOR_MIXERS = {'additive' : ColorMixer(mixDirect, mixDirectArray), 'subtractive' : ColorMixer(mixInverted, mixInvertedArray),
+  'maxhue' : ColorMixer(mixMaxHue, mixMaxHueArray), 'avghue' : ColorMixer(mixAvgHue, mixAvgHueArray)}
   
 if __name__ == '__main__':
   import sys
@@ -1,6 +1,6 @@
 # COMMON.PY
 # A common module for all scripts in the Interactions toolbox.
-import sys, os, arcpy, operator, traceback, numpy, random
+import sys, os, arcpy, operator, traceback, numpy, random, zlib
 
 
 # constants defining neighbour table field names
@@ -173,6 +173,12 @@ def count(layer):
   '''Counts the number of features (rows) in the layer.'''
   return int(arcpy.GetCount_management(layer).getOutput(0))
 
+def fingerprint(layer, fields):
+  '''Returns a cheap description of the layer contents to detect changed data:
+  its row count and a checksum of the given fields.'''
+  data = arcpy.da.TableToNumPyArray(layer, fields, skip_nulls=True)
+  return [count(layer), zlib.crc32(data.tostring())]
+
 def fieldTypeList(layer, type=None):
   '''Returns a dict of field names : types of the specified layer attributes.'''
   if type is None:
@@ -325,6 +331,11 @@ def isInDatabase(location):
   '''Returns True if the location is inside a file or personal geodatabase, False otherwise.'''
   return ('.gdb' in location or'.mdb' in location)
 
+def isRemote(location):
+  '''Returns True if the location is in an enterprise geodatabase (through a connection file) or a web service.'''
+  location = location.lower()
+  return ('.sde' in location or location.startswith(('http://', 'https://')))
+
 def folder(location):
   '''Returns a system folder in which the specified file is located.'''
   while isInDatabase(location):
@@ -372,6 +383,14 @@ def maxKey(dictionary):
   '''Returns a key from the dictionary that corresponds to the highest value.'''
   return max(dictionary.iteritems(), key=operator.itemgetter(1))[0]
 
+def processPool(workers):
+  '''Returns a multiprocessing pool of the given number of worker processes.
+  On Windows, the workers run the windowless interpreter so that no more ArcGIS instances are spawned.'''
+  import multiprocessing
+  if sys.platform == 'win32':
+    multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+  return multiprocessing.Pool(workers)
+
 def constantLambda(value):
   return (lambda whatever: value)
 
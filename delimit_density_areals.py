@@ -1,7 +1,11 @@
 import common
 import loaders
 import regional
+import graph
+import colors
 import operator
+import heapq
+import numpy
 
 DENSITY_COEF = 1000000
 DENS_CALLER = operator.itemgetter('dens')
@@ -122,6 +126,220 @@ def resolveEnclaves(areals, thrDens, minMass=0):
         areals.extend(areal.densify(thrDens, minMass))
   return newAreals
 
+class GraphAreals:
+  '''Density areal delimitation over a (memory-mapped) ZoneGraph with mass and area columns.
+
+  Follows regionalize() but addresses zones by their graph index. Zone assignments
+  are kept in the labels array (index of the seed zone of the areal, -1 if unassigned),
+  only the areal aggregates, frontiers and densest-neighbour heaps are held in memory.'''
+
+  def __init__(self, zoneGraph, labels, thrDens, doMergeEnclaves=True):
+    self.graph = zoneGraph
+    self.indptr = zoneGraph.neighIndptr
+    self.indices = zoneGraph.neighIndices
+    self.mass = zoneGraph.columns['mass']
+    self.area = zoneGraph.columns['area']
+    self.labels = labels
+    self.thrDens = thrDens
+    self.doMergeEnclaves = doMergeEnclaves
+    self.parent = {} # areal union-find: seed index : seed index of the absorbing areal
+    self.arealMass = {}
+    self.arealArea = {}
+    self.frontiers = {} # zones adjacent to the areal not belonging to it
+    self.heaps = {} # (-density, zone) entries of frontier zones, lazily deleted
+    self.fullScan = set() # areals not searched for enclaves since creation or absorbing another one
+
+  def neighbours(self, zone):
+    return self.indices[self.indptr[zone]:self.indptr[zone+1]].tolist()
+
+  def density(self, zone):
+    return self.mass[zone] / float(self.area[zone]) * DENSITY_COEF
+
+  def find(self, areal):
+    root = areal
+    while self.parent[root] != root:
+      root = self.parent[root]
+    while self.parent[areal] != root:
+      self.parent[areal], areal = root, self.parent[areal]
+    return root
+
+  def arealOf(self, zone):
+    label = int(self.labels[zone])
+    return self.find(label) if label >= 0 else None
+
+  def run(self, minPop):
+    seeds = self.createAreals()
+    for seed in seeds:
+      if self.parent[seed] == seed:
+        self.grow(seed)
+    self.frontiers = self.heaps = None
+    self.mergeAdjacent()
+    self.relabel(minPop)
+
+  def createAreals(self):
+    common.progress('creating areals')
+    seeds = []
+    for start in xrange(0, len(self.graph), graph.EDGE_CHUNK):
+      end = min(start + graph.EDGE_CHUNK, len(self.graph))
+      with numpy.errstate(divide='ignore', invalid='ignore'):
+        dens = self.mass[start:end] / numpy.asarray(self.area[start:end], dtype=float) * DENSITY_COEF
+      seeds.extend((numpy.flatnonzero(dens >= self.thrDens) + start).tolist())
+    for seed in seeds:
+      self.parent[seed] = seed
+      self.arealMass[seed] = 0
+      self.arealArea[seed] = 0
+      self.frontiers[seed] = set()
+      self.heaps[seed] = []
+    for seed in seeds:
+      self.bind(seed, seed)
+    if self.doMergeEnclaves:
+      self.fullScan.update(seeds)
+    return seeds
+
+  def grow(self, areal):
+    while True:
+      nextZone = self.getNextZone(areal)
+      if nextZone is None:
+        break
+      other = self.arealOf(nextZone)
+      if other is not None: # two areals connected, merge them
+        self.merge(areal, other)
+      elif self.isAccepted(areal, nextZone):
+        self.bind(areal, nextZone)
+        if self.doMergeEnclaves:
+          self.includeEnclaves(areal, nextZone)
+      else:
+        break
+
+  def isAccepted(self, areal, zone):
+    return ((self.arealMass[areal] + self.mass[zone]) / float(self.arealArea[areal] + self.area[zone])
+      * DENSITY_COEF >= self.thrDens)
+
+  def bind(self, areal, zone):
+    self.labels[zone] = areal
+    self.arealMass[areal] += self.mass[zone]
+    self.arealArea[areal] += self.area[zone]
+    frontier = self.frontiers[areal]
+    frontier.discard(zone)
+    heap = self.heaps[areal]
+    for neigh in self.neighbours(zone):
+      if neigh != graph.EXTERIOR and neigh not in frontier and self.arealOf(neigh) != areal:
+        frontier.add(neigh)
+        heapq.heappush(heap, (-self.density(neigh), neigh))
+
+  def merge(self, areal, other):
+    self.join(areal, other)
+    frontier = self.frontiers.pop(other)
+    frontier.update(self.frontiers[areal])
+    self.frontiers[areal] = set(zone for zone in frontier if self.arealOf(zone) != areal)
+    heap = self.heaps.pop(other)
+    heap.extend(self.heaps[areal])
+    heapq.heapify(heap)
+    self.heaps[areal] = heap
+    if self.doMergeEnclaves:
+      self.fullScan.add(areal)
+
+  def join(self, areal, other):
+    self.parent[other] = areal
+    self.arealMass[areal] += self.arealMass.pop(other)
+    self.arealArea[areal] += self.arealArea.pop(other)
+
+  def getNextZone(self, areal):
+    '''Returns the densest frontier zone. The enclave check of DensityAreal.getNextZone
+    always ends up returning the densest zone as well (the density is compared to a zone), so it is omitted.'''
+    frontier = self.frontiers[areal]
+    heap = self.heaps[areal]
+    while heap:
+      zone = heap[0][1]
+      if zone in frontier:
+        return zone
+      heapq.heappop(heap) # stale entry
+    return None
+
+  def includeEnclaves(self, areal, zone):
+    '''Binds unassigned pockets enclosed by the areal. Only pockets touching the newly bound zone
+    may have appeared since the last search, if there was one since the areal absorbed another.'''
+    if areal in self.fullScan:
+      self.fullScan.discard(areal)
+      starts = [neigh for neigh in self.frontiers[areal] if self.labels[neigh] < 0]
+    else:
+      starts = [neigh for neigh in self.neighbours(zone) if neigh != graph.EXTERIOR and self.labels[neigh] < 0]
+    for enclZone in self.enclaveSearch(areal, starts):
+      self.bind(areal, enclZone)
+
+  def enclaveSearch(self, areal, starts, block=frozenset()):
+    starts = set(starts)
+    encl = set()
+    while starts:
+      found, tree = self.searchTree(areal, starts.pop(), block)
+      if not found:
+        encl.update(tree)
+      starts.difference_update(tree)
+    return encl
+
+  def searchTree(self, areal, start, block):
+    stack = [start]
+    tree = set(stack)
+    while stack:
+      current = stack.pop()
+      for neigh in self.neighbours(current):
+        if neigh in block or neigh in tree:
+          continue
+        if neigh == graph.EXTERIOR:
+          return True, tree
+        other = self.arealOf(neigh)
+        if other is None: # not assigned, see through it
+          stack.append(neigh)
+          tree.add(neigh)
+        elif other != areal:
+          return True, tree
+    return False, tree
+
+  def mergeAdjacent(self):
+    for sources, targets in self.graph.edges():
+      inner = targets != graph.EXTERIOR
+      sourceLabels = numpy.asarray(self.labels[sources[inner]])
+      targetLabels = numpy.asarray(self.labels[targets[inner]])
+      touch = (sourceLabels >= 0) & (targetLabels >= 0) & (sourceLabels != targetLabels)
+      for first, second in zip(sourceLabels[touch].tolist(), targetLabels[touch].tolist()):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+          self.join(first, second)
+
+  def relabel(self, minPop):
+    '''Erases areals below minPop and labels the rest by their most populated zone.'''
+    best = {} # root : (mass, -index) of the most populated zone
+    for start, roots in self.chunkRoots():
+      labelled = numpy.flatnonzero(roots >= 0)
+      order = numpy.lexsort((-labelled, self.mass[labelled + start], roots[labelled]))
+      lasts = order[numpy.append(roots[labelled][order][1:] != roots[labelled][order][:-1], True)]
+      for root, index in zip(roots[labelled][lasts].tolist(), (labelled[lasts] + start).tolist()):
+        key = (self.mass[index], -index)
+        if root not in best or key > best[root]:
+          best[root] = key
+    final = {root : (-key[1] if self.arealMass[root] >= minPop else -1) for root, key in best.iteritems()}
+    for start, roots in self.chunkRoots():
+      labelled = roots >= 0
+      roots[labelled] = [final[root] for root in roots[labelled].tolist()]
+      self.labels[start:start+len(roots)] = roots
+
+  def chunkRoots(self):
+    for start in xrange(0, len(self.graph), graph.EDGE_CHUNK):
+      labels = numpy.array(self.labels[start:start+graph.EDGE_CHUNK])
+      cache = {}
+      for label in numpy.unique(labels[labels >= 0]).tolist():
+        cache[label] = self.find(label)
+      labelled = labels >= 0
+      labels[labelled] = [cache[label] for label in labels[labelled].tolist()]
+      yield start, labels
+
+
+def regionalizeGraph(zoneGraph, labels, thrDens, minPop, doMergeEnclaves=True):
+  '''Delimits density areals on a zone graph, writing indices of areal label zones to labels.'''
+  labels[:] = -1
+  GraphAreals(zoneGraph, labels, thrDens, doMergeEnclaves).run(minPop)
+  return labels
+
 def groupDensity(zonelist):
   mass = 0.0
   area = 0.0
@@ -130,12 +348,23 @@ def groupDensity(zonelist):
     area += zone.get('area')
   return mass / area
       
-def delimitDensityAreals(zones, idFld, popFld, thrDens, minPop, targetFld, neighTable=None, doMergeEnclaves=True):
+def delimitDensityAreals(zones, idFld, popFld, thrDens, minPop, targetFld, neighTable=None, doMergeEnclaves=True, graphPath=None, colorFld=None, colorFile=None):
   common.progress('loading areal data')
-  loader = loaders.RegionalLoader()
   # common.progress('calculating zone densities')
   areaFld = common.ensureShapeAreaField(zones)
   inSlots = {'id' : idFld, 'mass' : popFld, 'area' : areaFld}
+  if graphPath: # out-of-core mode
+    zoneGraph = loaders.readZoneGraph(zones, inSlots, neighTable, graphPath)
+    common.progress('delimiting areals')
+    labels = regionalizeGraph(zoneGraph, zoneGraph.outputArray('assign'), thrDens, minPop, doMergeEnclaves)
+    regionColors = {}
+    if colorFld:
+      common.progress('coloring areals')
+      regionColors = colors.colorRegions(zoneGraph, labels, colorFile)
+    common.progress('saving data')
+    loaders.writeZoneGraphLabels(zones, idFld, targetFld, zoneGraph, labels, colorFld, regionColors)
+    return
+  loader = loaders.RegionalLoader()
   loader.sourceOfZones(zones, inSlots, targetClass=DensityZone)
   loader.possibleNeighbourhood(neighTable, exterior=True)
   loader.load()
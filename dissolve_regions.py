@@ -1,110 +1,226 @@
-import arcpy, common, loaders
+import arcpy, common, loaders, topology, numpy, os, collections, itertools, operator
 
 ASSIGNED = 'tmp_z057'
 
-with common.runtool(11) as parameters:
-  zones, idFld, regionFld, coopFld, regTransFldsStr, nameFldsStr, sumCoreFldsStr, countCoresStr, sumAllFldsStr, countAllStr, outPath = parameters
-  # parse field lists
-  nameFlds = common.parseFields(nameFldsStr)
-  regTransFlds = common.parseFields(regTransFldsStr)
-  if regionFld in regTransFlds: regTransFlds.remove(regionFld)
-  sumCoreFlds = common.parseFields(sumCoreFldsStr)
-  sumAllFlds = common.parseFields(sumAllFldsStr)
-  coreTrans = {fld : 'CORE_' + fld for fld in sumCoreFlds}
-  allTrans = {fld : 'ALL_' + fld for fld in sumAllFlds}
-  outSumFlds = coreTrans.values() + allTrans.values()
-  coreTransItems = coreTrans.items()
-  allTransItems = allTrans.items()
-  countCores = common.toBool(countCoresStr, 'core count switch')
-  countAll = common.toBool(countAllStr, 'zone count switch')
-
-  zoneSlots = {'id' : idFld, 'assign' : regionFld}
-  if coopFld:
-    zoneSlots['core'] = coopFld
-  for fld in set(nameFlds + regTransFlds + sumCoreFlds + sumAllFlds):
-    zoneSlots[fld] = fld
-    
+def readColumns(layer, fields, where=None):
+  '''Reads the given fields of the layer into a dict of value lists.'''
+  cursor = arcpy.da.SearchCursor(layer, fields, where)
+  columns = zip(*cursor)
+  del cursor
+  if not columns:
+    columns = [()] * len(fields)
+  return {fld : list(column) for fld, column in zip(fields, columns)}
+
+def toNumbers(column):
+  '''Converts a list of numbers to an array, treating missing values as zero.'''
+  return numpy.array([0 if val is None else val for val in column])
+
+def toUnicode(name):
+  if isinstance(name, unicode):
+    return name
+  elif isinstance(name, str):
+    return unicode(name, 'utf8')
+  else:
+    return unicode(str(name), 'utf8')
+
+def regionStatistics(zones, idFld, regionFld, coopFld, regTransFlds, nameFlds, sumCoreFlds, countCores, sumAllFlds, countAll):
+  '''Computes region attributes, names and core and zone sums and counts.
+
+  Regions are factorised into integer codes; sums are reduced over zones sorted by
+  the code, counts are bincounts of the codes.'''
   common.progress('reading zone data')
-  zoneData = loaders.DictReader(zones, zoneSlots).read()
-  print zoneData
-  
+  fields = [idFld, regionFld] + ([coopFld] if coopFld else [])
+  for fld in nameFlds + regTransFlds + sumCoreFlds + sumAllFlds:
+    if fld not in fields:
+      fields.append(fld)
+  data = readColumns(zones, fields, '{} IS NOT NULL'.format(regionFld)) # unassigned zones fall out
+  if not data[regionFld]:
+    return {}
   common.progress('computing region statistics')
-  regionData = {} # TODO: pattern dict to be copied, will fasten
-  for zoneDict in zoneData.itervalues():
-    id = zoneDict['id']
-    regID = zoneDict['assign']
-    if regID is None: # no assignment -> will fall out of the result
-      continue
-    if regID not in regionData: # new region detected, create initial values
-      regionData[regID] = {'id' : regID, 'coreids' : []}
-      for outFld in outSumFlds:
-        regionData[regID][outFld] = 0
-      for fld in regTransFlds:
-        regionData[regID][fld] = None
-      if countCores:
-        regionData[regID]['CORE_COUNT'] = 0
-      if countAll:
-        regionData[regID]['ALL_COUNT'] = 0
-    myreg = regionData[regID]
-    if id == regID: # main core zone detected
-      for mainFld in regTransFlds: # direct transfer field
-        myreg[mainFld] = zoneDict[mainFld]
-    if id == regID or (coopFld and zoneDict['core'] == regID): # core zone detected
-      myreg['coreids'].append(id)
-      for coreFld, outCoreFld in coreTransItems:
-        myreg[outCoreFld] += zoneDict[coreFld]
-      if countCores:
-        myreg['CORE_COUNT'] += 1
-    for allFld, outAllFld in allTransItems: # and anyway
-      myreg[outAllFld] += zoneDict[allFld]
-    if countAll:
-      myreg['ALL_COUNT'] += 1
-  print regionData
-  
-  # assemble the names
-  common.progress('assembling region names')
+  ids = numpy.array(data[idFld], dtype=object)
+  regIDs, codes = numpy.unique(numpy.array(data[regionFld]), return_inverse=True)
+  regions = numpy.array(data[regionFld], dtype=object)
+  isMain = (ids == regions)
+  isCore = isMain | (numpy.array(data[coopFld], dtype=object) == regions) if coopFld else isMain
+  order = numpy.argsort(codes, kind='mergesort')
+  starts = numpy.flatnonzero(numpy.r_[True, codes[order][1:] != codes[order][:-1]])
+  regionData = {regID : {'id' : regID} for regID in regIDs.tolist()}
+  regIDList = regIDs.tolist()
+  def setColumn(outFld, values):
+    for regID, value in zip(regIDList, values.tolist()):
+      regionData[regID][outFld] = value
+  for fld in sumCoreFlds:
+    values = toNumbers(data[fld])
+    setColumn('CORE_' + fld, numpy.add.reduceat(numpy.where(isCore, values, 0)[order], starts))
+  for fld in sumAllFlds:
+    setColumn('ALL_' + fld, numpy.add.reduceat(toNumbers(data[fld])[order], starts))
+  if countCores:
+    setColumn('CORE_COUNT', numpy.bincount(codes[isCore], minlength=len(regIDs)))
+  if countAll:
+    setColumn('ALL_COUNT', numpy.bincount(codes, minlength=len(regIDs)))
+  # direct transfer fields from the main core zone
   for regDict in regionData.itervalues():
-    coreIDs = regDict['coreids']
-    if len(coreIDs) == 1:
-      for nameFld in nameFlds:
-        name = zoneData[coreIDs[0]][nameFld]
-        # common.debug(name, type(name))
-        if isinstance(name, unicode):
-          regDict[nameFld] = name
-        elif isinstance(name, str):
-          regDict[nameFld] = unicode(name, 'utf8')
-        else:
-          regDict[nameFld] = unicode(str(name), 'utf8')
-    else: # sort so that the main core is first (provisional)
-      if regDict['id'] in coreIDs:
-        coreIDs.remove(regDict['id'])
-        coreIDs.insert(0, regDict['id'])
-      for nameFld in nameFlds:
-        regDict[nameFld] = []
-        for regid in coreIDs:
-          regDict[nameFld].append(zoneData[regid][nameFld])
-        regDict[nameFld] = u'-'.join(unicode(name if isinstance(name, str) else str(name), 'utf8') for name in regDict[nameFld])
-    del regDict['coreids']
-  print regionData
+    for fld in regTransFlds:
+      regDict[fld] = None
+  for i in numpy.flatnonzero(isMain).tolist():
+    for fld in regTransFlds:
+      regionData[data[regionFld][i]][fld] = data[fld][i]
+  # assemble the names, main core first
+  common.progress('assembling region names')
+  coreIndices = {regID : [] for regID in regIDList}
+  for i in order[isCore[order]].tolist():
+    if isMain[i]:
+      coreIndices[data[regionFld][i]].insert(0, i)
+    else:
+      coreIndices[data[regionFld][i]].append(i)
+  for regID, indices in coreIndices.iteritems():
+    for nameFld in nameFlds:
+      regionData[regID][nameFld] = u'-'.join(toUnicode(data[nameFld][i]) for i in indices)
+  return regionData
+
+def topologicalDissolve(zones, idFld, regionFld, outPath, neighTable=None, workers=None):
+  '''Dissolves zones into regions by cancelling their shared polygon edges
+  (see topology.dissolve), region by region in a process pool. If a neighbour table
+  is given, regions whose zones do not border each other are only merged.'''
+  common.progress('reading zone geometry')
+  regionPolygons = collections.defaultdict(list)
+  regionOf = {}
+  cursor = arcpy.da.SearchCursor(zones, [idFld, regionFld, loaders.SHAPE_FIELD_DA], '{} IS NOT NULL'.format(regionFld))
+  for id, regID, shape in cursor:
+    regionOf[id] = regID
+    if shape is not None:
+      regionPolygons[regID].append(loaders.arcpyToPolygon(shape))
+  del cursor
+  touching = regionsWithInnerBorders(neighTable, regionOf) if neighTable else None
+  crs = arcpy.Describe(zones).spatialReference
+  createRegionLayer(outPath, regionFld, common.pyTypeOfField(zones, regionFld), crs)
+  common.progress('dissolving')
+  inserter = arcpy.da.InsertCursor(outPath, [loaders.SHAPE_FIELD_DA, regionFld])
+  for regID, multipolygon in topology.dissolveAll(regionPolygons, touching, workers=workers):
+    inserter.insertRow((loaders.polygonToArcPy(multipolygon, crs), regID))
+  del inserter
+
+def regionsWithInnerBorders(neighTable, regionOf):
+  '''Returns IDs of regions with at least one pair of neighbouring zones according to the neighbour table.'''
+  common.progress('reading neighbourhood')
+  touching = set()
+  for id, neighIDs in loaders.NeighbourTableReader(neighTable).read().iteritems():
+    regID = regionOf.get(id)
+    if regID is not None and regID not in touching:
+      for neighID in neighIDs:
+        if regionOf.get(neighID) == regID and neighID != id:
+          touching.add(regID)
+          break
+  return touching
+
+def createRegionLayer(outPath, regionFld, regionType, crs):
+  arcpy.CreateFeatureclass_management(os.path.dirname(outPath), os.path.basename(outPath), 'POLYGON', spatial_reference=crs)
+  return common.addField(outPath, regionFld, regionType)
+
+def streamingDissolve(zones, idFld, regionFld, coopFld, regTransFlds, nameFlds, sumCoreFlds, countCores, sumAllFlds, countAll, outPath, topological=False):
+  '''Dissolves zones and computes region statistics one region at a time.
+
+  Zones are read sorted by the region field; every finished region is written to the
+  output right away, so peak memory is bounded by the largest region.'''
+  fields = [idFld, regionFld] + ([coopFld] if coopFld else [])
+  for fld in nameFlds + regTransFlds + sumCoreFlds + sumAllFlds:
+    if fld not in fields:
+      fields.append(fld)
+  index = {fld : i for i, fld in enumerate(fields)}
+  shapeI = len(fields)
+  outFields = [(fld, common.pyTypeOfField(zones, fld)) for fld in regTransFlds]
+  outFields += [(fld, unicode) for fld in nameFlds]
+  outFields += [('CORE_' + fld, common.pyTypeOfField(zones, fld)) for fld in sumCoreFlds]
+  outFields += [('ALL_' + fld, common.pyTypeOfField(zones, fld)) for fld in sumAllFlds]
+  if countCores: outFields.append(('CORE_COUNT', int))
+  if countAll: outFields.append(('ALL_COUNT', int))
+  crs = arcpy.Describe(zones).spatialReference
+  outRegionFld = createRegionLayer(outPath, regionFld, common.pyTypeOfField(zones, regionFld), crs)
+  common.addFields(outPath, [name for name, fldType in outFields], [fldType for name, fldType in outFields])
+  with common.PathManager(outPath) as pathman:
+    common.progress('dissolving regions')
+    inserter = arcpy.da.InsertCursor(outPath, [loaders.SHAPE_FIELD_DA, outRegionFld] + [name for name, fldType in outFields])
+    for regID, rows in itertools.groupby(readSorted(zones, fields + [loaders.SHAPE_FIELD_DA], regionFld, pathman), operator.itemgetter(1)):
+      rows = list(rows)
+      stats = regionRecord(regID, rows, index, idFld, coopFld, regTransFlds, nameFlds, sumCoreFlds, countCores, sumAllFlds, countAll)
+      shapes = [row[shapeI] for row in rows if row[shapeI] is not None]
+      inserter.insertRow([dissolveShapes(shapes, crs, topological), regID] + [stats[name] for name, fldType in outFields])
+    del inserter
+
+def readSorted(layer, fields, sortFld, pathman):
+  '''Yields rows of the layer with a non-null sortFld, ordered by it.'''
+  where = '{} IS NOT NULL'.format(sortFld)
+  if common.isShapefile(layer): # no ORDER BY support
+    sortedLayer = pathman.tmpFC()
+    arcpy.Sort_management(layer, sortedLayer, [[sortFld, 'ASCENDING']])
+    cursor = arcpy.da.SearchCursor(sortedLayer, fields, where)
+  else:
+    cursor = arcpy.da.SearchCursor(layer, fields, where, sql_clause=(None, 'ORDER BY ' + sortFld))
+  for row in cursor:
+    yield row
+  del cursor
+
+def regionRecord(regID, rows, index, idFld, coopFld, regTransFlds, nameFlds, sumCoreFlds, countCores, sumAllFlds, countAll):
+  '''Computes the statistics of a single region from the rows of its zones.'''
+  idI = index[idFld]
+  record = {fld : None for fld in regTransFlds}
+  cores = []
+  for row in rows:
+    if row[idI] == regID: # main core zone
+      cores.insert(0, row)
+      for fld in regTransFlds:
+        record[fld] = row[index[fld]]
+    elif coopFld and row[index[coopFld]] == regID:
+      cores.append(row)
+  for fld in nameFlds:
+    record[fld] = u'-'.join(toUnicode(row[index[fld]]) for row in cores)
+  for fld in sumCoreFlds:
+    record['CORE_' + fld] = sum(row[index[fld]] or 0 for row in cores)
+  for fld in sumAllFlds:
+    record['ALL_' + fld] = sum(row[index[fld]] or 0 for row in rows)
+  if countCores: record['CORE_COUNT'] = len(cores)
+  if countAll: record['ALL_COUNT'] = len(rows)
+  return record
+
+def dissolveShapes(shapes, crs, topological=False):
+  if not shapes:
+    return None
+  elif len(shapes) == 1:
+    return shapes[0]
+  elif topological:
+    return loaders.polygonToArcPy(topology.dissolve([loaders.arcpyToPolygon(shape) for shape in shapes]), crs)
+  else:
+    dissolved = shapes[0]
+    for shape in shapes[1:]:
+      dissolved = dissolved.union(shape)
+    return dissolved
+
+def dissolveRegions(zones, idFld, regionFld, coopFld, regTransFlds, nameFlds, sumCoreFlds, countCores, sumAllFlds, countAll, outPath, topological=False, neighTable=None, workers=None, streaming=False):
+  if regionFld in regTransFlds: regTransFlds.remove(regionFld)
+  if streaming:
+    return streamingDissolve(zones, idFld, regionFld, coopFld, regTransFlds, nameFlds, sumCoreFlds, countCores, sumAllFlds, countAll, outPath, topological)
+  regionData = regionStatistics(zones, idFld, regionFld, coopFld, regTransFlds, nameFlds, sumCoreFlds, countCores, sumAllFlds, countAll)
+  outSumFlds = ['CORE_' + fld for fld in sumCoreFlds] + ['ALL_' + fld for fld in sumAllFlds]
     
   ## DISSOLVE
   # whole region statstics
   # allStats = createStats(sumAllFlds, idFld, [], common.toBool(countAll, 'zone count switch'))
-  common.progress('selecting regions')
-  common.selection(zones, ASSIGNED, '{} IS NOT NULL'.format(regionFld)) # exclude unassigned
-  common.progress('dissolving')
-  arcpy.Dissolve_management(ASSIGNED, outPath, [regionFld])
+  if topological:
+    topologicalDissolve(zones, idFld, regionFld, outPath, neighTable, workers)
+  else:
+    common.progress('selecting regions')
+    common.selection(zones, ASSIGNED, '{} IS NOT NULL'.format(regionFld)) # exclude unassigned
+    common.progress('dissolving')
+    arcpy.Dissolve_management(ASSIGNED, outPath, [regionFld])
   
   # and update
   # create slots
   outSlots = {fld : fld for fld in regTransFlds + nameFlds + outSumFlds}
   if countCores: outSlots['CORE_COUNT'] = 'CORE_COUNT'
   if countAll: outSlots['ALL_COUNT'] = 'ALL_COUNT'
-  # outSlots.update(coreTrans)
-  # outSlots.update(allTrans)
-  # common.debug(outSlots, coreTrans, allTrans, regTransFlds, nameFlds)
   
   loaders.ObjectMarker(outPath, {'id' : regionFld}, outSlots, outTypes=loaders.inferFieldTypes(regionData.values(), outSlots)).mark(regionData, 'writing names and statistics')
+
     
    
   # cores = bool(coopFld)
@@ -202,5 +318,16 @@ with common.runtool(11) as parameters:
   # for fld in transferFlds:
     # stats.append([fld, 'FIRST'])
   # return stats
-    
 
+
+if __name__ == '__main__':
+  with common.runtool(11) as parameters:
+    zones, idFld, regionFld, coopFld, regTransFldsStr, nameFldsStr, sumCoreFldsStr, countCoresStr, sumAllFldsStr, countAllStr, outPath = parameters
+    # parse field lists
+    nameFlds = common.parseFields(nameFldsStr)
+    regTransFlds = common.parseFields(regTransFldsStr)
+    sumCoreFlds = common.parseFields(sumCoreFldsStr)
+    sumAllFlds = common.parseFields(sumAllFldsStr)
+    countCores = common.toBool(countCoresStr, 'core count switch')
+    countAll = common.toBool(countAllStr, 'zone count switch')
+    dissolveRegions(zones, idFld, regionFld, coopFld, regTransFlds, nameFlds, sumCoreFlds, countCores, sumAllFlds, countAll, outPath)
@@ -0,0 +1,316 @@
+import os, json, numpy
+import common
+
+EXTERIOR = -1 # neighbour index of the exterior pseudozone
+
+STR_TO_PY_TYPE = {'unicode' : unicode, 'str' : str, 'int' : int, 'float' : float, 'bool' : bool}
+DEFAULT_VALUES = {'unicode' : u'', 'str' : '', 'int' : 0, 'float' : 0.0, 'bool' : False}
+DTYPE_KINDS_TO_STR = {'U' : 'unicode', 'S' : 'str', 'i' : 'int', 'u' : 'int', 'f' : 'float', 'b' : 'bool'}
+EDGE_CHUNK = 1000000 # zones per chunk in vectorized passes over the graph
+TIE_TOLERANCE = 1e-12 # relative difference of residual variances considered equal
+
+class ZoneGraph:
+  '''An array representation of a matched zone set.
+
+  Zones are referenced by their position in the attribute columns. Neighbourhood
+  is stored as a CSR structure (neighIndptr, neighIndices) with the exterior
+  as EXTERIOR, interactions as a CSR matrix of outflows (interIndptr,
+  interIndices, interValues) plus raw (unmatched) outflow and inflow sums.
+  Saved as a folder of .npy files that may be memory-mapped read-only on load.'''
+
+  META_FILE = 'graph.json'
+  VERSION = 1
+  ARRAYS = ('neighIndptr', 'neighIndices', 'interIndptr', 'interIndices', 'interValues', 'rawOutflows', 'rawInflows')
+
+  def __init__(self, columns, types, masks={}, signature=None):
+    self.columns = columns # slot : array
+    self.types = types # slot : python type name
+    self.masks = masks # slot : boolean array of missing (None) values
+    self.signature = signature
+    self.valueType = None
+    self.path = None
+    self._idOrder = None
+    for name in self.ARRAYS:
+      setattr(self, name, None)
+
+  def __len__(self):
+    return len(self.columns['id'])
+
+  @classmethod
+  def fromRows(cls, rows, signature=None):
+    '''Creates the graph attribute columns from a list of zone row dicts.'''
+    columns = {}
+    types = {}
+    masks = {}
+    slots = set()
+    for row in rows:
+      slots.update(row)
+    for slot in slots:
+      values = [row.get(slot) for row in rows]
+      columns[slot], types[slot], mask = cls.toColumn(values)
+      if mask is not None:
+        masks[slot] = mask
+    return cls(columns, types, masks, signature)
+
+  @classmethod
+  def fromArrays(cls, columns, signature=None):
+    '''Creates the graph from a dict of attribute column arrays (such as fields of a structured array).'''
+    columns = {slot : numpy.asarray(column) for slot, column in columns.iteritems()}
+    types = {slot : DTYPE_KINDS_TO_STR[column.dtype.kind] for slot, column in columns.iteritems()}
+    return cls(columns, types, {}, signature)
+
+  @staticmethod
+  def toColumn(values):
+    '''Converts a list of values to an array, its python type name and a mask of None values (if any).'''
+    present = [val for val in values if val is not None]
+    pyTypes = set(type(val) for val in present)
+    if not pyTypes:
+      typeName = 'int'
+    elif pyTypes <= set([int, long, bool]) and len(pyTypes) > 1:
+      typeName = 'int'
+    elif pyTypes <= set([int, long, float, numpy.float64]):
+      typeName = 'float' if (float in pyTypes or numpy.float64 in pyTypes) else 'int'
+    elif pyTypes <= set([str, unicode]):
+      typeName = 'unicode' if unicode in pyTypes else 'str'
+    else:
+      typeName = common.pyStrOfType(pyTypes.pop())
+    if len(present) < len(values):
+      default = DEFAULT_VALUES[typeName]
+      mask = numpy.array([val is None for val in values], dtype=bool)
+      values = [default if val is None else val for val in values]
+    else:
+      mask = None
+    return numpy.array(values), typeName, mask
+
+  def rows(self):
+    '''Yields zone row dicts with values converted back to python types.'''
+    converters = [(slot, self.columns[slot], STR_TO_PY_TYPE[self.types[slot]], self.masks.get(slot)) for slot in self.columns]
+    for i in xrange(len(self)):
+      row = {}
+      for slot, column, pyType, mask in converters:
+        row[slot] = None if (mask is not None and mask[i]) else pyType(column[i])
+      yield row
+
+  def readRelations(self, zones, neighbourhood=True, interactions=True):
+    '''Stores the matched neighbourhood and interactions of the zones (ordered as the rows).'''
+    index = {zone : i for i, zone in enumerate(zones)}
+    if neighbourhood:
+      neighLists = [[index.get(neigh, EXTERIOR) for neigh in zone.getNeighbours()] for zone in zones]
+      self.neighIndptr, self.neighIndices = self.toCSR(neighLists)
+    if interactions:
+      targetLists = []
+      valueLists = []
+      rawOut = []
+      rawIn = []
+      for zone in zones:
+        outflows = zone.getOutflows()
+        targets = [index[target] for target in outflows]
+        targetLists.append(targets)
+        valueLists.extend(outflows[target] for target in outflows)
+        rawOut.append(outflows.getRaw())
+        rawIn.append(zone.getInflows().getRaw())
+      self.interIndptr, self.interIndices = self.toCSR(targetLists)
+      self.interValues = numpy.array(valueLists)
+      self.valueType = 'float' if self.interValues.dtype.kind == 'f' else 'int'
+      self.rawOutflows = numpy.array(rawOut)
+      self.rawInflows = numpy.array(rawIn)
+
+  @staticmethod
+  def toCSR(lists):
+    indptr = numpy.zeros(len(lists) + 1, dtype=numpy.int64)
+    indptr[1:] = numpy.cumsum([len(lst) for lst in lists])
+    indices = numpy.fromiter((i for lst in lists for i in lst), dtype=numpy.int64, count=indptr[-1])
+    return indptr, indices
+
+  def setNeighbourhood(self, fromIDs, toIDs, exteriorID=EXTERIOR):
+    '''Builds the CSR neighbourhood from arrays of zone ID pairs; exteriorID marks the exterior.
+    Returns the numbers of pairs dropped because of unknown zone IDs and because they relate a zone to itself.'''
+    toIDs = numpy.asarray(toIDs)
+    froms = self.indexOf(fromIDs)
+    tos = self.indexOf(toIDs)
+    tos[toIDs == exteriorID] = EXTERIOR
+    known = (froms >= 0) & (tos >= EXTERIOR)
+    selfPairs = known & (froms == tos)
+    valid = known & ~selfPairs
+    froms, tos = froms[valid], tos[valid]
+    pairs = numpy.unique(froms * (len(self) + 1) + (tos + 1)) # sorted by source, deduplicated
+    froms, tos = pairs // (len(self) + 1), pairs % (len(self) + 1) - 1
+    self.neighIndptr = numpy.zeros(len(self) + 1, dtype=numpy.int64)
+    self.neighIndptr[1:] = numpy.cumsum(numpy.bincount(froms, minlength=len(self)))
+    self.neighIndices = tos.astype(numpy.int64)
+    return int((~known).sum()), int(selfPairs.sum())
+
+  def indexOf(self, ids):
+    '''Returns graph indices of the given zone IDs, -2 for unknown ones.'''
+    ids = numpy.asarray(ids)
+    if self._idOrder is None:
+      self._idOrder = numpy.argsort(self.columns['id'], kind='mergesort')
+    sortedIDs = self.columns['id'][self._idOrder]
+    if not len(sortedIDs):
+      return numpy.zeros(len(ids), dtype=numpy.int64) - 2
+    pos = numpy.minimum(numpy.searchsorted(sortedIDs, ids), len(sortedIDs) - 1)
+    return numpy.where(sortedIDs[pos] == ids, self._idOrder[pos], -2)
+
+  def edges(self, chunk=EDGE_CHUNK):
+    '''Yields the neighbourhood as (source, target) index array pairs, chunk zones at a time.'''
+    for start in xrange(0, len(self), chunk):
+      end = min(start + chunk, len(self))
+      lo, hi = self.neighIndptr[start], self.neighIndptr[end]
+      counts = numpy.diff(self.neighIndptr[start:end+1])
+      yield numpy.repeat(numpy.arange(start, end), counts), numpy.asarray(self.neighIndices[lo:hi])
+
+  def contract(self, labels):
+    '''Contracts the neighbourhood by zone labels (negative meaning none).
+    Returns an array of used labels and two arrays of labels of neighbouring zones
+    with different labels, each pair present in both directions.'''
+    base = len(self) + 1
+    codes = []
+    used = []
+    for sources, targets in self.edges():
+      sourceLabels = numpy.asarray(labels[sources])
+      used.append(numpy.unique(sourceLabels[sourceLabels >= 0]))
+      inner = targets != EXTERIOR
+      sourceLabels = sourceLabels[inner]
+      targetLabels = numpy.asarray(labels[targets[inner]])
+      touch = (sourceLabels >= 0) & (targetLabels >= 0) & (sourceLabels != targetLabels)
+      sourceLabels, targetLabels = sourceLabels[touch], targetLabels[touch]
+      codes.append(numpy.unique(numpy.concatenate((sourceLabels * base + targetLabels, targetLabels * base + sourceLabels))))
+    codes = numpy.unique(numpy.concatenate(codes)) if codes else numpy.zeros(0, dtype=numpy.int64)
+    used = numpy.unique(numpy.concatenate(used)) if used else numpy.zeros(0, dtype=numpy.int64)
+    return used, codes // base, codes % base
+
+  def outputArray(self, name, dtype=numpy.int64, fill=-1):
+    '''Creates a writable memory-mapped array of values per zone in the snapshot folder.'''
+    if self.path is None:
+      raise ValueError, 'zone graph must be saved before creating output arrays'
+    array = numpy.lib.format.open_memmap(self.arrayPath(self.path, 'out', name), mode='w+', dtype=dtype, shape=(len(self), ))
+    array[:] = fill
+    return array
+
+  def significantOutflows(self):
+    '''Returns positions of the significant outflows of all zones in interValues and their strengths
+    relative to the strongest outflow of the zone.'''
+    if self.interValues.ndim != 1:
+      raise ValueError, 'significant flows need single strength interactions'
+    return significantFlows(self.interIndptr, self.interValues)
+
+  def hasNeighbourhood(self):
+    return self.neighIndptr is not None
+
+  def hasInteractions(self):
+    return self.interIndptr is not None
+
+  def neighbours(self, i):
+    return self.neighIndices[self.neighIndptr[i]:self.neighIndptr[i+1]]
+
+  def applyRelations(self, zones, exterior, neighbourhood=True, interactions=True):
+    '''Sets the stored neighbourhood and interactions to the zones (ordered as the rows).'''
+    if neighbourhood and self.hasNeighbourhood():
+      for i, zone in enumerate(zones):
+        zone.setNeighbours([(zones[j] if j != EXTERIOR else exterior) for j in self.neighbours(i)])
+    if interactions and self.hasInteractions():
+      converter = STR_TO_PY_TYPE[self.valueType] if self.interValues.ndim == 1 else numpy.array
+      sources = numpy.repeat(numpy.arange(len(zones)), numpy.diff(self.interIndptr))
+      byTarget = numpy.argsort(self.interIndices, kind='mergesort')
+      inIndptr = numpy.searchsorted(self.interIndices[byTarget], numpy.arange(len(zones) + 1))
+      for i, zone in enumerate(zones):
+        outflows = zone.interactionClass()
+        for k in xrange(self.interIndptr[i], self.interIndptr[i+1]):
+          outflows[zones[self.interIndices[k]]] = converter(self.interValues[k])
+        outflows.addRaw(converter(self.rawOutflows[i]))
+        inflows = zone.interactionClass()
+        for k in byTarget[inIndptr[i]:inIndptr[i+1]]:
+          inflows[zones[sources[k]]] = converter(self.interValues[k])
+        inflows.addRaw(converter(self.rawInflows[i]))
+        zone.setOutflows(outflows)
+        zone.setInflows(inflows)
+
+  def save(self, path):
+    '''Saves the graph as a folder of .npy files.'''
+    if not os.path.isdir(path):
+      os.makedirs(path)
+    meta = {'version' : self.VERSION, 'signature' : self.signature, 'types' : self.types,
+        'masked' : sorted(self.masks), 'valueType' : self.valueType, 'arrays' : []}
+    for slot, column in self.columns.iteritems():
+      numpy.save(self.arrayPath(path, 'col', slot), column, allow_pickle=False)
+    for slot, mask in self.masks.iteritems():
+      numpy.save(self.arrayPath(path, 'mask', slot), mask, allow_pickle=False)
+    for name in self.ARRAYS:
+      array = getattr(self, name)
+      if array is not None:
+        numpy.save(self.arrayPath(path, 'rel', name), array, allow_pickle=False)
+        meta['arrays'].append(name)
+    with open(os.path.join(path, self.META_FILE), 'w') as metaFile:
+      json.dump(meta, metaFile)
+    self.path = path
+
+  @classmethod
+  def load(cls, path, mmap=True):
+    '''Loads the graph saved to path, memory-mapping the arrays read-only if mmap is set.'''
+    meta = cls.readMeta(path)
+    if meta is None or meta['version'] != cls.VERSION:
+      raise IOError, 'no valid zone graph snapshot found in {}'.format(path)
+    mode = 'r' if mmap else None
+    types = {str(slot) : typeName for slot, typeName in meta['types'].iteritems()}
+    columns = {slot : numpy.load(cls.arrayPath(path, 'col', slot), mmap_mode=mode) for slot in types}
+    masks = {str(slot) : numpy.load(cls.arrayPath(path, 'mask', slot), mmap_mode=mode) for slot in meta['masked']}
+    graph = cls(columns, types, masks, meta['signature'])
+    graph.valueType = meta['valueType']
+    for name in meta['arrays']:
+      setattr(graph, name, numpy.load(cls.arrayPath(path, 'rel', name), mmap_mode=mode))
+    graph.path = path
+    return graph
+
+  @classmethod
+  def exists(cls, path, signature=None):
+    '''Returns True if a snapshot created from the sources described by signature exists at path.'''
+    meta = cls.readMeta(path)
+    return bool(meta is not None and meta['version'] == cls.VERSION and
+      (signature is None or meta['signature'] == signature))
+
+  @classmethod
+  def readMeta(cls, path):
+    metaPath = os.path.join(path, cls.META_FILE)
+    if not os.path.isfile(metaPath):
+      return None
+    with open(metaPath) as metaFile:
+      return json.load(metaFile)
+
+  @staticmethod
+  def arrayPath(path, kind, name):
+    return os.path.join(path, '{}_{}.npy'.format(kind, name))
+
+def significantFlows(indptr, values):
+  '''Selects the significant flows of every row of a CSR interaction matrix by Van Nuffel's algorithm
+  (see objects.Interactions.significant).
+
+  The residual variance for n significant flows of a row is computed from the sum of squares
+  and the prefix sum of its relative strengths sorted descending, so that all candidates of all rows
+  are evaluated at once. Returns positions of the significant flows in values and their strengths
+  relative to the strongest flow of the row, by row and by strength descending.'''
+  indptr = numpy.asarray(indptr)
+  values = numpy.asarray(values)
+  if not len(values):
+    return numpy.zeros(0, dtype=numpy.int64), values
+  counts = numpy.diff(indptr)
+  starts = indptr[:-1][counts > 0]
+  segments = counts[counts > 0]
+  order = numpy.lexsort((-values, numpy.repeat(numpy.arange(len(counts)), counts))) # stable, by row, strongest first
+  maxima = numpy.maximum.reduceat(values[order], starts)
+  maxima[maxima == 0] = 1
+  relative = values[order] / maxima.repeat(segments) # integer flows stay integer as in the scalar version
+  ranks = numpy.arange(1, len(values) + 1) - starts.repeat(segments)
+  lengths = segments.repeat(segments)
+  prefix = relative.cumsum()
+  prefix -= (prefix[starts] - relative[starts]).repeat(segments)
+  resVar = numpy.add.reduceat(relative ** 2, starts).repeat(segments) - (2.0 * prefix - 1) / ranks
+  prevResVar = numpy.empty_like(resVar)
+  prevResVar[1:] = resVar[:-1]
+  prevResVar[starts] = lengths[starts] + 1
+  # the first n not reducing the residual variance is excluded with all following ones
+  # (exact ties, such as for strengths 1, 5/6 and 4/6, must not depend on rounding)
+  # if all reduce it, the last one is excluded as well
+  stops = resVar >= prevResVar * (1 - TIE_TOLERANCE)
+  nums = numpy.minimum.reduceat(numpy.where(stops, ranks, lengths), starts).repeat(segments)
+  selected = ranks < nums
+  return order[selected], relative[selected]
@@ -1,7 +1,7 @@
 from __future__ import absolute_import
 
 import os, collections, operator, arcpy, objects, common, math# , geojson
-import regional
+import regional, graph, json
 from xml.etree import cElementTree as eltree
 
 # TODOS
@@ -117,6 +117,10 @@ class RegionalLoader:
   ZONE_CALLERS = {'assign' : 'getRegionID', 'core' : 'getLesserCoreID', 'exclave' : 'getExclaveFlag', 'color' : 'getColorHex'}
   requiredZoneSlots = ['id']
   requiredInteractionSlots = ['from', 'to']
+  concurrentLoad = None # None reads the sources concurrently only if some of them are remote
+  snapshotPath = None
+  snapshotRefresh = False
+  interactionRegistry = None
 
   def __init__(self, regionalizer=None):
     self.regionalizer = regionalizer
@@ -144,6 +148,7 @@ class RegionalLoader:
     self.zoneOutputSlots = {}
     self.zoneOutputCallers = {}
     self.zoneOutputTypes = {}
+    self.zoneMeasureSlots = [] # output slots computed by ZoneMeasurer
   
   def sourceOfPresets(self, slots):
     slots = self.checkSlots(slots, {})
@@ -151,8 +156,17 @@ class RegionalLoader:
       self.makePresets = True
       self.zoneSlots.update(slots)
     
-  def sourceOfInteractions(self, layer, slots, where=None):
+  def sourceOfInteractions(self, layer, slots, where=None, sparse=False):
     self.interLoader = InteractionReader(layer, self.checkSlots(slots, self.requiredInteractionSlots), where=where)
+    if sparse: # array-backed interactions for large interaction matrices, numbering their targets for this loader only
+      self.interactionRegistry = objects.UnitRegistry()
+      interClass = objects.SparseInteractions.withRegistry(self.interactionRegistry)
+      if self.zoneClass:
+        self.zoneClass.interactionClass = interClass
+      if self.regionalizer:
+        self.regionalizer.getRegionFactory().interactionClass = interClass
+      self.interLoader.remapClass = interClass
+    self.interSource = [unicode(layer), sorted(slots.items()), where]
     self.makeInteractions = True
   
   def sourceOfMultiInteractions(self, layer, slots, where=None, ordering=None):
@@ -162,6 +176,7 @@ class RegionalLoader:
     if self.regionalizer:
       self.regionalizer.getRegionFactory().interactionClass = objects.MultiInteractions
     self.interLoader = MultiInteractionReader(layer, slots, ordering=ordering, where=where)
+    self.interSource = [unicode(layer), sorted(slots.items()), where, ordering]
     self.makeInteractions = True
   
   def possibleNeighbourhood(self, layer, slots={}, exterior=False):
@@ -170,6 +185,7 @@ class RegionalLoader:
       if not layer:
         layer = self.createNeighbourTable(exterior=exterior)
       self.makeNeighbourhood = True
+      self.neighbourSlots = dict(slots)
       self.neighbourLoader = NeighbourTableReader(layer, slots, exterior)
     
   def createNeighbourTable(self, exterior=False):
@@ -178,18 +194,103 @@ class RegionalLoader:
     return neighbour_table.table(self.zoneLayer, self.zoneSlots['id'], tblPath, exterior=exterior, selfrel=False)
     
   def load(self):
+    if self.interactionRegistry is not None: # units of a previous load must not keep their indexes
+      self.interactionRegistry.reset()
     self.zoneLoader = ZoneReader(self.zoneLayer, self.zoneSlots, targetClass=self.zoneClass)
-    self.zoneList = self.zoneLoader.read('loading zones')
-    if self.makeInteractions:
-      self.interLoader.match(self.zoneList, text='loading interactions')
-    if self.makeNeighbourhood:
-      self.neighbourLoader.match(self.zoneList, text='loading neighbourhood')
+    self.signature = self.snapshotSignature() if self.snapshotPath else None # fingerprints the sources, so only once
+    if self.snapshotPath and not self.snapshotRefresh and graph.ZoneGraph.exists(self.snapshotPath, self.signature):
+      self.loadSnapshot(self.snapshotPath)
+    else:
+      self.loadSources()
+      if self.snapshotPath:
+        self.saveSnapshot(self.snapshotPath)
     if self.regionalizer:
       if self.makePresets:
         self.regionalizer.initRun(self.zoneList, presets=self.zoneLoader.getPresets())
       else:
         self.regionalizer.initRun(self.zoneList)
   
+  def loadSources(self):
+    if (self.makeInteractions or self.makeNeighbourhood) and self.readsConcurrently():
+      self.zoneList, interactions, neighbourhood = self.readConcurrently()
+    else:
+      self.zoneList = self.readZones('loading zones')
+      interactions, neighbourhood = None, None
+    if self.makeInteractions:
+      self.interLoader.match(self.zoneList, relations=interactions, text='loading interactions')
+    if self.makeNeighbourhood:
+      self.neighbourLoader.match(self.zoneList, relations=neighbourhood, text='loading neighbourhood')
+  
+  def readZones(self, text='loading zones'):
+    if self.snapshotPath: # keep the raw rows for the snapshot
+      rows = self.zoneLoader.readRows(text)
+      self.zoneGraph = graph.ZoneGraph.fromRows(rows, self.signature)
+      return self.zoneLoader.createZones(rows)
+    else:
+      return self.zoneLoader.read(text)
+  
+  def snapshot(self, path, refresh=False):
+    '''Makes the loader save the loaded zone graph to a snapshot folder at path
+    and to load it from there in subsequent runs with the same sources unless refresh is set.
+    No toolbox parameter exposes this; it is available to scripts using the loader directly.'''
+    self.snapshotPath = path
+    self.snapshotRefresh = refresh
+  
+  def snapshotSignature(self):
+    '''Returns a description of the loaded sources to detect stale snapshots.'''
+    signature = [unicode(self.zoneLayer), sorted(self.zoneSlots.items()), self.zoneCoreQuery,
+      common.fingerprint(self.zoneLayer, [self.zoneSlots['id']])]
+    if self.makeInteractions:
+      slots = dict(self.interSource[1])
+      signature.append(self.interSource + [common.fingerprint(self.interSource[0], [slots['from'], slots['to']])])
+    if self.makeNeighbourhood:
+      fields = dict(NeighbourTableReader.defaultFields, **self.neighbourSlots)
+      signature.append([unicode(self.neighbourLoader.layer), common.fingerprint(self.neighbourLoader.layer, [fields['from'], fields['to']])])
+    return json.loads(json.dumps(signature))
+  
+  def saveSnapshot(self, path):
+    common.progress('saving zone graph snapshot')
+    self.zoneGraph.readRelations(self.zoneList, neighbourhood=self.makeNeighbourhood, interactions=self.makeInteractions)
+    self.zoneGraph.save(path)
+  
+  def loadSnapshot(self, path):
+    common.progress('loading zone graph snapshot')
+    self.zoneGraph = graph.ZoneGraph.load(path)
+    self.zoneList = self.zoneLoader.createZones(self.zoneGraph.rows())
+    self.zoneGraph.applyRelations(self.zoneList, regional.exterior, neighbourhood=self.makeNeighbourhood, interactions=self.makeInteractions)
+  
+  def readsConcurrently(self):
+    '''Tells whether to read the sources in parallel: as set by setConcurrentLoading(), or else
+    if any source is remote, where waiting for the server dominates the reading time.'''
+    if self.concurrentLoad is not None:
+      return self.concurrentLoad
+    sources = [self.zoneLayer]
+    if self.makeInteractions:
+      sources.append(self.interSource[0])
+    if self.makeNeighbourhood:
+      sources.append(self.neighbourLoader.layer)
+    return any(common.isRemote(unicode(source)) for source in sources)
+  
+  def readConcurrently(self):
+    '''Reads zones, interactions and neighbourhood in parallel threads.
+    The sources are independent until matched, so their I/O latencies overlap.
+    Progress is reported as a single message for all of them, without the per-source progress bars.'''
+    from multiprocessing.pool import ThreadPool
+    common.progress('loading zones, interactions and neighbourhood')
+    readers = [self.readZones]
+    readers.append(self.interLoader.read if self.makeInteractions else None)
+    readers.append(self.neighbourLoader.read if self.makeNeighbourhood else None)
+    pool = ThreadPool(sum(1 for reader in readers if reader is not None))
+    try:
+      pending = [(pool.apply_async(reader, (None, )) if reader is not None else None) for reader in readers]
+      return [(result.get() if result is not None else None) for result in pending]
+    finally:
+      pool.close()
+      pool.join()
+  
+  def setConcurrentLoading(self, state=True):
+    self.concurrentLoad = state
+  
   def checkSlots(self, slots, required):
     # common.debug(slots)
     todel = []
@@ -231,6 +332,7 @@ class RegionalLoader:
         prefix = self.zoneOutputSlots['assign'] + '_' if 'assign' in self.zoneOutputSlots else ''
         self.zoneOutputSlots[slot] = prefix + field
         self.zoneOutputCallers[slot] = objects.ZoneMeasurer().measureGetter(slot)
+        self.zoneMeasureSlots.append(slot)
     else:
       if require:
         raise ValueError, 'required zone output field for {} not provided'.format(slot.upper())
@@ -239,6 +341,25 @@ class RegionalLoader:
     # print self.zoneList, self.zoneOutputSlots, self.zoneOutputCallers
     self.zoneOutputTypes.update(inferFieldTypes(self.zoneList, self.zoneOutputSlots, callers=self.zoneOutputCallers))
   
+  def measureZones(self, zones):
+    '''Computes all the zone output measures in one pass and makes their output callers read the results.'''
+    if not self.zoneMeasureSlots:
+      return
+    zones = list(zones)
+    measurer = objects.ZoneMeasurer()
+    columns = measurer.measureAll(zones, self.zoneMeasureSlots)
+    positions = {zone : i for i, zone in enumerate(zones)}
+    for slot in self.zoneMeasureSlots:
+      self.zoneOutputCallers[slot] = self.columnCaller(columns[slot].tolist(), positions, measurer.measureGetter(slot))
+  
+  @staticmethod
+  def columnCaller(column, positions, fallback):
+    '''Returns a caller reading zone values from the column; zones not in positions are measured by fallback.'''
+    def caller(zone):
+      pos = positions.get(zone)
+      return fallback(zone) if pos is None else column[pos]
+    return caller
+  
   def setOverlapOutput(self, overlapTable):
     self.outputs.append(InteractionWriter(overlapTable, {'value' : 'OVERLAP'}, convertToID=True))
     self.outputTransforms.append(operator.methodcaller('getRegionOverlaps'))
@@ -253,6 +374,7 @@ class RegionalLoader:
       self.outputs[i].write(self.outputTransforms[i](regionalizer))
   
   def outputZones(self, zoneDict):
+    self.measureZones(zoneDict.values())
     self.inferZoneTypes()
     ObjectMarker(self.zoneLayer, self.zoneIDSlot, self.zoneOutputSlots, self.zoneOutputCallers, self.zoneOutputTypes).mark(zoneDict)
 
@@ -919,12 +1041,17 @@ class ZoneReader(DatasetReader):
     return row
         
   def read(self, text='loading zones'):
+    return self.createZones(row for reader in self.readers for row in reader.rows(text=text))
+  
+  def readRows(self, text='loading zones'):
+    return [row for reader in self.readers for row in reader.rows(text=text)]
+  
+  def createZones(self, rows):
     zones = []
-    for reader in self.readers:
-      for row in reader.rows(text=text):
-        if self.presetsOn:
-          row = self.savePreset(row)
-        zones.append(self.zoneClass(**row))
+    for row in rows:
+      if self.presetsOn:
+        row = self.savePreset(row)
+      zones.append(self.zoneClass(**row))
     return zones
   
   
@@ -962,12 +1089,13 @@ class RelationReader(MatchReader):
       self.addRelation(relations, row)
     return relations
 
-  def match(self, objects, idGetter=None, fromSetterName=None, toSetterName=None, setFrom=True, setTo=None, text=None):
+  def match(self, objects, idGetter=None, fromSetterName=None, toSetterName=None, setFrom=True, setTo=None, relations=None, text=None):
     idGetter = self.DEFAULT_ID_GETTER if idGetter is None else idGetter
     fromSetterName = self.DEFAULT_FROM_SETTER_NAME if fromSetterName is None else fromSetterName
     toSetterName = self.DEFAULT_TO_SETTER_NAME if toSetterName is None else toSetterName
     setTo = self.setTo if setTo is None else setTo
-    relations = self.read(text=text)
+    if relations is None: # not read in advance
+      relations = self.read(text=text)
     objectDict = {idGetter(obj) : obj for obj in objects}
     for id in objectDict:
       relTuple = relations[id]
@@ -989,13 +1117,14 @@ class InteractionReader(RelationReader):
   setTo = True
   containsWhat = 'interactions'
   handledFails = 'used as unknown (raw) flows'
+  remapClass = None
   
   def addRelation(self, relations, row):
     relations[row['from']][0][row['to']] += row['value']
     relations[row['to']][1][row['from']] += row['value']
   
   def remapTargets(self, objectDict, relation):
-    remapped = relation.new()
+    remapped = relation.new() if self.remapClass is None else self.remapClass()
     for id, value in relation.iteritems():
       if id in objectDict:
         remapped[objectDict[id]] = value
@@ -1443,8 +1572,94 @@ def inferFieldTypes(data, slots, callers={}):
   
 def getUniqueValues(fc, fld):
   return list(set(OneFieldReader(fc, fld).read()))
+
+def readZoneGraph(layer, slots, neighTable, path, refresh=False, neighSlots={}):
+  '''Reads zone attribute columns and the neighbour table into a zone graph saved at path
+  and returns it memory-mapped. Zone objects are never created, so the graph may be larger than memory allows for them.
+  A snapshot of the same sources present at path is reused unless refresh is set.'''
+  if not neighTable:
+    import neighbour_table
+    neighTable = neighbour_table.table(layer, slots['id'],
+      common.tablePath(common.location(layer), common.fcName(layer) + '_neigh'), exterior=True, selfrel=False)
+  neighFields = dict(NeighbourTableReader.defaultFields, **neighSlots)
+  signature = json.loads(json.dumps([unicode(layer), sorted(slots.items()), unicode(neighTable), sorted(neighFields.items()),
+    common.fingerprint(layer, [slots['id']]), common.fingerprint(neighTable, [neighFields['from'], neighFields['to']])]))
+  if not refresh and graph.ZoneGraph.exists(path, signature):
+    return graph.ZoneGraph.load(path)
+  common.progress('reading zone columns')
+  slotNames = list(slots)
+  fields = [slots[slot] for slot in slotNames]
+  nulls = {fld : 0 for fld in fields if common.pyTypeOfField(layer, fld) in (int, float)}
+  data = arcpy.da.TableToNumPyArray(layer, fields, null_value=nulls)
+  zoneGraph = graph.ZoneGraph.fromArrays({slot : data[fld] for slot, fld in zip(slotNames, fields)}, signature)
+  common.progress('reading neighbourhood')
+  pairs = arcpy.da.TableToNumPyArray(neighTable, [neighFields['from'], neighFields['to']])
+  toIDs = pairs[neighFields['to']]
+  exteriorID = u'-1' if toIDs.dtype.kind in 'US' else -1
+  unknown, selfPairs = zoneGraph.setNeighbourhood(pairs[neighFields['from']], toIDs, exteriorID)
+  if unknown:
+    common.warning('{} neighbourhood relations ignored because of unknown zone IDs'.format(unknown))
+  if selfPairs:
+    common.message('{} relations of zones to themselves ignored'.format(selfPairs))
+  zoneGraph.save(path)
+  return graph.ZoneGraph.load(path)
+
+def writeZoneGraphLabels(layer, idFld, targetFld, zoneGraph, labels, colorFld=None, regionColors={}, text='writing zone labels'):
+  '''Writes IDs of zones referenced by the labels array (-1 for none) to targetFld of the zones in layer.
+  If colorFld is given, region colors (a dict of labels and hex codes) are written in the same pass.'''
+  outSlots = {'assign' : targetFld}
+  outCallers = {'assign' : 'getRegionID'}
+  outTypes = {'assign' : common.pyTypeOfField(layer, idFld)}
+  output = ZoneGraphOutput(zoneGraph, labels, regionColors)
+  if colorFld:
+    outSlots['color'] = colorFld
+    outCallers['color'] = 'getColor'
+    outTypes['color'] = str
+    ColorMarker(layer, {'id' : idFld}, outSlots, outCallers, outTypes).mark(output, text)
+  else:
+    ObjectMarker(layer, {'id' : idFld}, outSlots, outCallers, outTypes).mark(output, text)
+
+class ZoneGraphOutput:
+  '''A read-only mapping of zone IDs to output rows of labelled zone graph zones, to be used by markers.'''
+  WHITE = 'ffffff'
   
-  
+  class Row:
+    def __init__(self, regionID, color):
+      self.regionID = regionID
+      self.color = color
+    
+    def getRegionID(self):
+      return self.regionID
+    
+    def getColor(self):
+      return self.color
+  
+  def __init__(self, zoneGraph, labels, regionColors={}):
+    self.graph = zoneGraph
+    self.labels = labels
+    self.regionColors = regionColors
+    self.ids = zoneGraph.columns['id']
+    self.positions = None # zone ID to graph index, built on the first lookup
+  
+  def __len__(self):
+    return len(self.graph)
+  
+  def __iter__(self):
+    for index in xrange(len(self.graph)):
+      yield self.row(index)
+  
+  def __getitem__(self, id):
+    if self.positions is None:
+      self.positions = {zoneID : index for index, zoneID in enumerate(self.ids.tolist())}
+    return self.row(self.positions.get(id, -1))
+  
+  def row(self, index):
+    label = int(self.labels[index]) if index >= 0 else -1
+    if label < 0:
+      return self.Row(None, self.WHITE)
+    else:
+      return self.Row(self.ids[label].item(), self.regionColors.get(label, self.WHITE))
+
 def findExtentTiles(clipping, maxxDeg, maxyDeg, shout=False):
   dsc = arcpy.Describe(clipping)
   crs = dsc.spatialReference
@@ -1,11 +1,14 @@
-import common
+import common, spatial
 import arcpy
 
 TOLERANCE = '1 Centimeters'
 EXTERIOR_ID = -1
+TILE_LAYER = 'tmp_tile'
 
-def table(zones, idFld, output, exterior=True, selfrel=True):
+def table(zones, idFld, output, exterior=True, selfrel=True, tileSize=None, overlap=None, workers=None):
   common.debug('running neighbour table', zones, idFld, output, exterior, selfrel)
+  if tileSize:
+    return tiledTable(zones, idFld, output, tileSize, exterior, selfrel, overlap, workers)
   with common.PathManager(output) as pathman:
     if exterior:
       common.progress('mapping zone surroundings')
@@ -42,10 +45,83 @@ def table(zones, idFld, output, exterior=True, selfrel=True):
     common.clearFields(output, [common.NEIGH_FROM_FLD, common.NEIGH_TO_FLD])
   return output
 
+def tiledTable(zones, idFld, output, tileSize, exterior=True, selfrel=True, overlap=None, workers=None):
+  '''Creates the neighbour table tile by tile in worker processes.
+
+  Every zone is owned by the tile containing its centroid; only the relations
+  found in the tile of their origin zone are kept, which deduplicates the border
+  pairs and retains exterior relations only where they are not caused by the tile
+  cut. Each tile is processed with all zones intersecting it widened by overlap,
+  which must exceed twice the largest zone extent (the default).'''
+  import loaders
+  common.progress('reading zone extents')
+  ids, centroids, maxDim = readZoneExtents(zones, idFld)
+  if overlap is None:
+    overlap = 2 * maxDim
+  ext = arcpy.Describe(zones).extent
+  grid = spatial.TileGrid((ext.XMin, ext.YMin, ext.XMax, ext.YMax), tileSize)
+  owners = {id : grid.tileOf(centroid) for id, centroid in zip(ids, centroids)}
+  usedTiles = sorted(set(owners.itervalues()))
+  with common.PathManager(output) as pathman:
+    folder = pathman.tmpSubfolder()
+    tasks = [(zones, idFld, grid.window(tile, overlap), folder, tile, exterior) for tile in usedTiles]
+    common.progress('finding neighbours in {} tiles'.format(len(tasks)))
+    if workers == 1 or len(tasks) == 1:
+      results = [tileTable(task) for task in tasks]
+    else:
+      pool = common.processPool(workers)
+      try:
+        results = pool.map(tileTable, tasks)
+      finally:
+        pool.close()
+        pool.join()
+  common.progress('stitching tile neighbour tables')
+  pairs = spatial.TileGrid.ownedPairs(results, owners, selfrel)
+  common.progress('writing neighbour table')
+  rows = [{'from' : fromID, 'to' : toID} for fromID, toID in sorted(pairs)]
+  loaders.BasicWriter(output, {'from' : common.NEIGH_FROM_FLD, 'to' : common.NEIGH_TO_FLD}).write(rows)
+  return output
+
+def tileTable(task):
+  '''Computes the full neighbour table (including self relations) of the zones intersecting the window.
+  Runs in a worker process; returns the tile number and a list of ID pairs.'''
+  zones, idFld, window, folder, tile, exterior = task
+  import loaders
+  common.overwrite(True)
+  crs = arcpy.Describe(zones).spatialReference
+  xmin, ymin, xmax, ymax = window
+  windowShape = loaders.polygonToArcPy([[[(xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin)]]], crs)
+  layer = TILE_LAYER + str(tile)
+  arcpy.MakeFeatureLayer_management(zones, layer)
+  arcpy.SelectLayerByLocation_management(layer, 'INTERSECT', windowShape)
+  tileZones = common.featurePath(folder, 'tile{}'.format(tile))
+  arcpy.CopyFeatures_management(layer, tileZones)
+  common.delete(layer)
+  tileOut = common.tablePath(folder, 'neigh{}'.format(tile))
+  table(tileZones, idFld, tileOut, exterior=exterior, selfrel=True)
+  cursor = arcpy.da.SearchCursor(tileOut, [common.NEIGH_FROM_FLD, common.NEIGH_TO_FLD])
+  pairs = [tuple(row) for row in cursor]
+  del cursor
+  common.delete(tileZones, tileOut)
+  return tile, pairs
+
+def readZoneExtents(zones, idFld):
+  '''Returns zone IDs, their centroids and the largest extent dimension of any zone.'''
+  ids = []
+  centroids = []
+  maxDim = 0
+  cursor = arcpy.da.SearchCursor(zones, [idFld, 'SHAPE@TRUECENTROID', 'SHAPE@'])
+  for id, centroid, shape in cursor:
+    ids.append(id)
+    centroids.append(centroid)
+    ext = shape.extent
+    maxDim = max(maxDim, ext.width, ext.height)
+  del cursor
+  return ids, centroids, maxDim
+
 if __name__ == '__main__':
   with common.runtool(5) as parameters:
     zones, idFld, output, exteriorStr, selfrelStr = parameters
     exterior = common.toBool(exteriorStr, 'exterior relationship record switch')
     selfrel = common.toBool(selfrelStr, 'self-neighbourhood record switch')
     table(zones, idFld, output, exterior, selfrel)
-
@@ -1,13 +1,14 @@
-import sys, arcpy, operator, numpy
-from collections import defaultdict, deque
+import sys, arcpy, operator, heapq, numpy
+from collections import defaultdict, deque, Counter, OrderedDict
 sys.path.append('.')
-import common, colors
+import common, colors, spatial, graph
 
 MASS_TO_STRG = 1e-10
 ID_SORTER = operator.methodcaller('getID')
 MASS_SORTER = operator.methodcaller('getMass')
 SECONDARY_MASS_SORTER = operator.methodcaller('getSecondaryMass')
 GAIN_SORTER = operator.methodcaller('getGain')
+MEASURE_CACHE_SIZE = 100000 # measure values kept by a measurer
 
 class BaseInteractions(defaultdict):
   '''An "abstract" base class that stores interaction targets and strengths.
@@ -284,30 +285,14 @@ class Interactions(BaseInteractions):
   def significant(self):
     '''Returns only significant flows according to Van Nuffel's algorithm.
 
-    Compares the flows' strengths normalised by the largest one to the theoretical sequence of [1 / n] * n + [0] * (len(self) - n) for n starting at 1 and increasing as long as the correlation keeps growing. When it no longer grows, stops and declares the first n largest flows as significant.'''
+    Compares the flows' strengths normalised by the largest one to the theoretical sequence of [1 / n] * n + [0] * (len(self) - n) for n starting at 1 and increasing as long as the correlation keeps growing. When it no longer grows, stops and declares the first n largest flows as significant.
+    The residual variances are computed from prefix sums of the sorted strengths (see graph.significantFlows).'''
     if not self: return self
-    maxFlow = self.max()
-    real = [(target, strength / maxFlow) for target, strength in self.iteritems()]
-    real.sort(key=operator.itemgetter(1), reverse=True)
-    expected = [0] * len(real) # expected flows: first num is 1/num, others are 0
-    num = 0
-    prevResVar = len(real) + 2
-    resVar = prevResVar - 1
-    while resVar < prevResVar: # as long as the residual variance keeps diminishing
-      if num == len(real): break
-      num += 1
-      factor = 1 / float(num)
-      for i in range(num):
-        expected[i] = factor # first n expected values
-      prevResVar = resVar
-      # calculate the determination coefficient (only residual variance; the only thing needed to compare)
-      resVar = 0
-      for i in range(len(real)):
-        resVar += (real[i][1] - expected[i]) ** 2
-    # create the significant flows instance
+    targets = self.keys()
+    positions, strengths = graph.significantFlows([0, len(targets)], [self[target] for target in targets])
     over = self.new()
-    for item in real[:(num-1)]: # the last one was bad, do not include it
-      over[item[0]] = item[1]
+    for pos, strength in zip(positions, strengths):
+      over[targets[pos]] = strength
     return over
   
   def sortedTargets(self):
@@ -336,50 +321,318 @@ class Interactions(BaseInteractions):
     return trans
         
     
-class InteractionVector(list):
-  '''A vector that stores values of MultiInteractions strengths.
+class UnitRegistry:
+  '''Numbers the targets of SparseInteractions and keeps their region labels.
   
-  A sibling of list that adds a few methods to implement vector arithmetic.
-  Overrides boolean checking - evaluates to True iff any of its items is nonzero.'''
+  The labels are kept in arrays by registry index, each valid for the count of RegionalUnit modifications
+  it was found at, so that labeling the targets of unmodified regions is a single array lookup.'''
+  
+  def __init__(self):
+    self.reset()
+  
+  def reset(self):
+    '''Forgets all registered units.'''
+    self.units = []
+    self.unitIndexes = {}
+    self.labelTables = {} # region getter name: (label array, modification count array)
+  
+  def indexOf(self, unit):
+    '''Returns the registry index of the unit, registering it if necessary.'''
+    try:
+      return self.unitIndexes[unit]
+    except KeyError:
+      self.unitIndexes[unit] = len(self.units)
+      self.units.append(unit)
+      return self.unitIndexes[unit]
+  
+  def knownIndexes(self, units):
+    '''Returns an array of registry indexes of those of the units that are registered.'''
+    return numpy.array([self.unitIndexes[unit] for unit in units if unit in self.unitIndexes], dtype=int)
+  
+  def labels(self, index, getterName):
+    '''Returns an array of registry indexes of the regions of the units with the given indexes
+    (as returned by their method getterName), or of the units themselves if they are regions or have no region.'''
+    labels, found = self.labelTables.get(getterName, (numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)))
+    if len(labels) < len(self.units): # grow for newly registered units
+      labels = numpy.concatenate((labels, numpy.zeros(len(self.units) - len(labels), dtype=int)))
+      found = numpy.concatenate((found, numpy.zeros(len(self.units) - len(found), dtype=int) - 1))
+    current = RegionalUnit.modifications
+    for i in index[found[index] != current]: # relabel only units whose regions might have changed
+      unit = self.units[i]
+      region = unit if isinstance(unit, Region) else getattr(unit, getterName)()
+      labels[i] = i if region is None else self.indexOf(region)
+      found[i] = current
+    self.labelTables[getterName] = (labels, found)
+    return labels[index]
+
+
+class SparseInteractions(object):
+  '''Simple interactions stored in sorted arrays of target indexes and strengths.
+  
+  An alternative to Interactions with the same methods. Targets are numbered in a UnitRegistry, so that addition is a merge of the index arrays and aggregation to regions a bincount on region labels.
+  The class registry is meant for standalone use; a loader binds its own registry to a subclass by withRegistry() for every run.
+  Item assignments are buffered and merged into the arrays before any whole-array operation. The arrays are never modified in place, so copies may share them.'''
+  registry = UnitRegistry()
 
+  def __init__(self):
+    self._index = numpy.zeros(0, dtype=int)
+    self._strengths = numpy.zeros(0, dtype=int)
+    self.raw = 0
+    self._pending = {}
+  
   @classmethod
-  def zeros(cls, length):
-    return cls([0] * length)
+  def new(cls):
+    return cls()
+  
+  def default_factory(self):
+    return 0
+  
+  @classmethod
+  def fromArrays(cls, index, values, raw=0):
+    '''Creates interactions from a sorted array of unique target indexes and an array of their strengths.'''
+    inter = cls()
+    inter._index = index
+    inter._strengths = values
+    inter.raw = raw
+    return inter
+  
+  @classmethod
+  def aggregate(cls, index, values, raw=0):
+    '''Creates interactions from an array of target indexes (possibly repeated) by summing the strengths of the same targets.'''
+    targets, inverse = numpy.unique(index, return_inverse=True)
+    sums = numpy.bincount(inverse, weights=values, minlength=len(targets)).astype(values.dtype) # keep integer strengths integer
+    return cls.fromArrays(targets, sums, raw)
+  
+  @classmethod
+  def withRegistry(cls, registry):
+    '''Returns a subclass numbering its targets in the given registry.'''
+    return type(cls.__name__, (cls,), {'registry' : registry})
+  
+  def arrays(self):
+    '''Returns the target index and strength arrays with all buffered assignments merged.'''
+    if self._pending:
+      pendIndex = numpy.array([self.registry.indexOf(unit) for unit in self._pending], dtype=int)
+      pendValues = numpy.array(self._pending.values())
+      kept = numpy.in1d(self._index, pendIndex, invert=True)
+      index = numpy.concatenate((self._index[kept], pendIndex))
+      order = numpy.argsort(index, kind='mergesort')
+      self._index = index[order]
+      self._strengths = numpy.concatenate((self._strengths[kept], pendValues))[order]
+      self._pending = {}
+    return self._index, self._strengths
+  
+  def position(self, target):
+    '''Returns the position of the target in the arrays (not counting buffered assignments) or None if it is not present.'''
+    i = self.registry.unitIndexes.get(target)
+    if i is not None:
+      pos = self._index.searchsorted(i)
+      if pos < len(self._index) and self._index[pos] == i:
+        return pos
+    return None
+  
+  def __getitem__(self, target):
+    if target in self._pending:
+      return self._pending[target]
+    pos = self.position(target)
+    return 0 if pos is None else self._strengths[pos]
+  
+  def __setitem__(self, target, value):
+    self._pending[target] = value
+  
+  def __delitem__(self, target):
+    self.arrays()
+    pos = self.position(target)
+    if pos is None:
+      raise KeyError, target
+    self._index = numpy.delete(self._index, pos)
+    self._strengths = numpy.delete(self._strengths, pos)
+  
+  def __contains__(self, target):
+    return target in self._pending or self.position(target) is not None
+  
+  def get(self, target, default=None):
+    return self[target] if target in self else default
+  
+  def __len__(self):
+    return len(self.arrays()[0])
+  
+  def __nonzero__(self):
+    return bool(self._pending) or bool(len(self._index))
+  
+  def __iter__(self):
+    units = self.registry.units
+    return (units[i] for i in self.arrays()[0])
+  
+  iterkeys = __iter__
   
-  def __add__(self, other):
-    both = self.new()
-    for i in range(len(self)):
-      both[i] = self[i] + other[i]
-    return both
+  def itervalues(self):
+    return iter(self.arrays()[1])
   
-  def __iadd__(self, other):
-    for i in range(len(self)):
-      self[i] += other[i]
+  def iteritems(self):
+    units = self.registry.units
+    index, values = self.arrays()
+    return ((units[i], value) for i, value in zip(index, values))
+  
+  def keys(self):
+    return list(self.iterkeys())
+  
+  def values(self):
+    return list(self.itervalues())
+  
+  def items(self):
+    return list(self.iteritems())
+  
+  def __repr__(self):
+    return 'SparseInteractions({%s}, raw=%r)' % (', '.join('%r: %r' % item for item in self.iteritems()), self.raw)
+  
+  def copy(self):
+    index, values = self.arrays()
+    return self.fromArrays(index, values, self.raw)
+  
+  def __add__(self, plusinter):
+    ret = self.copy()
+    ret += plusinter
+    return ret
+  
+  def __iadd__(self, inter):
+    return self._merge(inter, 1)
+  
+  def __isub__(self, inter):
+    return self._merge(inter, -1)
+  
+  def _merge(self, inter, sign):
+    index, values = self.arrays()
+    plusIndex, plusValues = inter.arrays()
+    merged = self.aggregate(numpy.concatenate((index, plusIndex)), numpy.concatenate((values, sign * plusValues)))
+    self._index, self._strengths = merged._index, merged._strengths
+    self.raw += sign * inter.raw
     return self
   
   def __mul__(self, factor):
-    fac = self.new()
-    for item in self:
-      fac.append(item * factor)
-    return fac
-  
-  def __isub__(self, other):
-    for i in range(len(self)):
-      self[i] -= other[i]
-    return self
-   
+    index, values = self.arrays()
+    return self.fromArrays(index, values * factor, self.raw * factor)
+  
   def __div__(self, divisor):
-    fac = self.new()
     divisor = float(divisor)
-    for item in self:
-      fac.append(item / divisor)
-    return fac
+    index, values = self.arrays()
+    return self.fromArrays(index, values / divisor, self.raw / divisor)
+  
+  def _select(self, targets, invert=False):
+    index, values = self.arrays()
+    kept = numpy.in1d(index, self.registry.knownIndexes(targets), invert=invert)
+    self._index, self._strengths = index[kept], values[kept]
+    return self
+  
+  def restrict(self, restricted):
+    '''Removes all targets that are not contained in the provided sequence from the interactions.'''
+    return self._select(restricted)
+  
+  def exclude(self, excluded):
+    '''Removes all targets that are contained in the provided sequence from the interactions.'''
+    return self._select(excluded, invert=True)
+  
+  def restrictToRegions(self):
+    '''Removes all targets that are not regions from the interactions.'''
+    return self._select([target for target in self if isinstance(target, Region)])
+  
+  def sum(self):
+    '''Returns a sum of its values (strengths) including raw.'''
+    return self.arrays()[1].sum() + self.raw
+  
+  def max(self):
+    '''Returns a maximum of its values.'''
+    values = self.arrays()[1]
+    return values.max() if len(values) else 0
+  
+  def strongest(self):
+    '''Returns a target with the highest corresponding strength.'''
+    index, values = self.arrays()
+    return self.registry.units[index[values.argmax()]]
+  
+  def toCore(self):
+    '''Returns its copy. If any of its targets is a zone that is a core of a region, its value is added to that region's value instead.'''
+    return self._relabel('getCore')
+  
+  def toRegional(self):
+    '''Returns its copy. If any of its targets is a zone that is inside a region, its value is added to that region's value instead.'''
+    return self._relabel('getRegion')
+  
+  def _relabel(self, getterName):
+    index, values = self.arrays()
+    return self.aggregate(self.registry.labels(index, getterName), values, self.raw)
+  
+  @classmethod
+  def inflowsTo(cls, sources):
+    '''Given a list of RegionalUnits, returns a sum of their inflows.'''
+    return cls.sumOf([zone.getInflows() for zone in sorted(sources, key=MASS_SORTER)])
+  
+  @classmethod
+  def outflowsFrom(cls, sources):
+    '''Given a list of RegionalUnits, returns a sum of their outflows.'''
+    return cls.sumOf([zone.getOutflows() for zone in sorted(sources, key=MASS_SORTER)])
+  
+  @classmethod
+  def sumOf(cls, inters):
+    '''Sums the given interactions in a single merge.'''
+    if not inters:
+      return cls()
+    arrays = [inter.arrays() for inter in inters]
+    return cls.aggregate(
+      numpy.concatenate([index for index, values in arrays]),
+      numpy.concatenate([values for index, values in arrays]),
+      sum(inter.raw for inter in inters)
+    )
+  
+  def significant(self):
+    '''Returns only significant flows according to Van Nuffel's algorithm (see Interactions.significant).'''
+    index, values = self.arrays()
+    positions, strengths = graph.significantFlows([0, len(index)], values)
+    order = numpy.argsort(index[positions])
+    return self.fromArrays(index[positions][order], strengths[order])
+  
+  # the remaining methods only iterate over the items, share them with the dict-based interactions
+  onlyClassSum = BaseInteractions.onlyClassSum.im_func
+  sumToCoreOf = BaseInteractions.sumToCoreOf.im_func
+  sumToRegion = BaseInteractions.sumToRegion.im_func
+  sumOutOf = BaseInteractions.sumOutOf.im_func
+  sumsByCore = BaseInteractions.sumsByCore.im_func
+  sumsByRegion = BaseInteractions.sumsByRegion.im_func
+  addRaw = BaseInteractions.addRaw.im_func
+  subRaw = BaseInteractions.subRaw.im_func
+  getRaw = BaseInteractions.getRaw.im_func
+  allOver = Interactions.allOver.im_func
+  sortedTargets = Interactions.sortedTargets.im_func
+  orders = Interactions.orders.im_func
+  relativeStrengths = Interactions.relativeStrengths.im_func
+  transform = Interactions.__dict__['transform']
+  
+    
+class InteractionVector(numpy.ndarray):
+  '''A vector that stores values of MultiInteractions strengths.
+  
+  A fixed-length numpy array view keeping the type of its values; the vector arithmetic is done by numpy ufuncs
+  (in place for the augmented operators). Division always gives floats.
+  Overrides boolean checking - evaluates to True iff any of its items is nonzero.'''
+
+  def __new__(cls, values=()):
+    return numpy.array(values).view(cls)
+
+  @classmethod
+  def zeros(cls, length):
+    return numpy.zeros(length).view(cls)
+  
+  def __div__(self, divisor):
+    return numpy.true_divide(self, divisor)
+  
+  __idiv__ = __div__ # integer vectors cannot hold the quotient in place
 
   def __nonzero__(self):
-    return bool(sum(self))
+    return numpy.count_nonzero(self) > 0
   
   def __repr__(self):
-    return 'I' + list.__repr__(self)
+    return 'I' + repr(self.tolist())
+  
+  __str__ = __repr__
    
   @classmethod
   def new(cls):
@@ -396,14 +649,13 @@ class MultiInteractions(BaseInteractions):
         raise ValueError, 'must provide length for multiinteractions'
       else:
         length = self.defaultLength
-    lamb = lambda: numpy.zeros(length)
-    # lamb = lambda: InteractionVector.zeros(length)
+    lamb = lambda: InteractionVector.zeros(length)
     BaseInteractions.__init__(self, lamb, *args, **kwargs)
 
   def copy(self):
     cp = self.new()
     for target in self:
-      cp[target] = numpy.copy(self[target])
+      cp[target] = self[target].copy()
     cp.raw = self.raw
     return cp
     
@@ -413,14 +665,26 @@ class MultiInteractions(BaseInteractions):
 
   
 class RegionalUnit:
-  '''A measurable regional unit - a pseudoabstract superclass of Zone and Region allowing both of them to provide IDs.'''
+  '''A measurable regional unit - a pseudoabstract superclass of Zone and Region allowing both of them to provide IDs.
+  
+  Counts its modifications (assignment changes) to invalidate cached measures; modifications counts those of all units.'''
   id = None
+  version = 0
+  modifications = 0
 
   def __init__(self, id):
     self.id = id
 
   def getID(self):
     return self.id
+  
+  def touch(self):
+    '''Records a modification of the unit.'''
+    self.version += 1
+    RegionalUnit.modifications += 1
+  
+  def getVersion(self):
+    return self.version
 
   # for interaction calculations (excluding zones by their region)
   def getRegion(self):
@@ -457,6 +721,7 @@ class GeometricalZone(Neighbour):
   '''A zone that implements neighbourhood by geometry intersection.'''
 
   def __init__(self, id, geometry=None):
+    Neighbour.__init__(self)
     self.id = id
     if geometry is not None:
       geometry = self.prepareGeometry(geometry)
@@ -464,11 +729,17 @@ class GeometricalZone(Neighbour):
   
   def intersects(self, zone):
     # tried to test minimum bounding rectangles... no speedup obvious (probably is done already)
+    # pairwise use is quadratic, query a GeometricalZoneIndex for candidates first
     return not self.geometry.disjoint(zone.getGeometry())
   
   def getGeometry(self):
     return self.geometry
 
+  def getExtent(self):
+    '''Returns the geometry bounding box as (xmin, ymin, xmax, ymax).'''
+    ext = self.geometry.extent
+    return (ext.XMin, ext.YMin, ext.XMax, ext.YMax)
+
   def getID(self):
     return self.id
   
@@ -481,6 +752,41 @@ class GeometricalZone(Neighbour):
     return arcpy.Polygon(array)
 
 
+class GeometricalZoneIndex:
+  '''A bounding box index over a set of GeometricalZones, built once per zone set.
+
+  Only zones whose extents overlap are passed to the exact intersection test.'''
+
+  def __init__(self, zones, tolerance=0):
+    self.zones = list(zones)
+    self.tolerance = tolerance
+    self.index = spatial.BoxIndex([zone.getExtent() for zone in self.zones])
+
+  def window(self, bbox):
+    '''Returns zones whose extent overlaps the given (xmin, ymin, xmax, ymax) window.'''
+    return [self.zones[i] for i in self.index.query(bbox, self.tolerance)]
+
+  def intersecting(self, zone):
+    '''Returns indexed zones other than zone that intersect its geometry.'''
+    return [cand for cand in self.window(zone.getExtent())
+        if cand is not zone and zone.intersects(cand)]
+
+  def intersectingPairs(self):
+    '''Returns a list of all pairs of indexed zones whose geometries intersect.'''
+    firsts, seconds = self.index.candidatePairs(self.tolerance)
+    pairs = []
+    for i, j in zip(firsts, seconds):
+      if self.zones[i].intersects(self.zones[j]):
+        pairs.append((self.zones[i], self.zones[j]))
+    return pairs
+
+  def linkNeighbours(self):
+    '''Makes all intersecting zones each other's neighbours.'''
+    for zone, other in self.intersectingPairs():
+      zone.addNeighbour(other)
+      other.addNeighbour(zone)
+
+
 # zone (a basic territorial unit for which data is provided, usually a settlement)    
 class RegionalZone(RegionalUnit, Neighbour):
   delegation = 'region'
@@ -714,6 +1020,7 @@ class FlowZone(RegionalZone):
   def transferExclaveFlag(self):
     '''Freezes the zone's current exclave status to the exclaveFlag variable.'''
     self.exclaveFlag = (1 if self.isExclave() else 0)
+    self.touch()
   
   def hamplMembership(self, region, penal=1):
     '''Returns Hampl membership function value for the given region.'''
@@ -842,8 +1149,8 @@ class MonoZone(FlowZone):
 
 class MultiZone(FlowZone):
   def __init__(self, *args, **kwargs):
-    RegionalZone.__init__(self, *args, **kwargs)
-    self.assignments = []
+    self.assignments = [] # before the zone initialization removes any assignment
+    FlowZone.__init__(self, *args, **kwargs)
 
   def isExclave(self): # if the zone is an exclave
     for ass in self.assignments:
@@ -958,13 +1265,21 @@ class SimpleAssignment:
     # common.debug('assigning %s to %s' % (self.zone, self.region))
     self.zone.addAssignment(self)
     self.region.addAssignment(self)
+    self.touch()
     
   def erase(self): # erases the relationship from both sides
     self.zone.removeAssignment(self)
     self.region.removeAssignment(self)
+    self.touch()
   
   def dissolve(self): # erases the relationship only from the zone side (used when region is dissolved)
     self.zone.removeAssignment(self)
+    self.touch()
+
+  def touch(self):
+    '''Records a modification of both the zone and the region.'''
+    self.zone.touch()
+    self.region.touch()
 
   def getZone(self):
     return self.zone
@@ -981,8 +1296,10 @@ class SimpleAssignment:
   def isExclave(self):
     return False
     
-  def isOnlyConnection(self, diffZone): # PERFORMANCE BOTTLENECK
+  def isOnlyConnection(self, diffZone):
     '''Returns True if diffZone would change exclave status of this assignment, False otherwise.'''
+    if diffZone.isInRegion(self.region): # splitting diffZone, use the articulation index
+      return self.region.getConnectivityIndex().separates(diffZone, self.zone)
     artic = self.region.getArticulation(diffZone)
     if artic: # if diffZone is an articulation point of self.region
       cores = len(self.region.getCoreZones())
@@ -1003,6 +1320,54 @@ class SimpleAssignment:
     else:
       return False
     
+class ConnectivityIndex:
+  '''An index of region hinterland subtrees separated by its articulation points.
+
+  The subtrees are subtrees of the DFS tree of the articulation search, so they form intervals of its preorder
+  numbering. Whether a zone lies in a separated subtree is an interval check and the number of cores in it
+  a difference of prefix counts. Valid until the region assignments change, like the articulations.'''
+
+  def __init__(self, root, children, separated):
+    self.separated = separated
+    self.coreCount = None # number of region cores, set by the region
+    self.enter = {}
+    order = []
+    stack = [] if root is None else [root]
+    while stack: # preorder
+      now = stack.pop()
+      self.enter[now] = len(order)
+      order.append(now)
+      stack.extend(reversed(children.get(now, ())))
+    sizes = {}
+    for zone in reversed(order):
+      sizes[zone] = 1 + sum(sizes[child] for child in children.get(zone, ()))
+    self.exit = {zone : self.enter[zone] + sizes[zone] for zone in order}
+    self.order = order
+    self.cores = None # core flags in preorder, computed on first use (only zones with cores have them)
+
+  def countCores(self):
+    self.cores = [bool(zone.getCore()) for zone in self.order]
+    self.corePrefix = [0]
+    for isCore in self.cores:
+      self.corePrefix.append(self.corePrefix[-1] + isCore)
+
+  def separates(self, articulation, zone):
+    '''Returns True if removing the articulation would leave the zone in a component without any region core.'''
+    if self.cores is None:
+      self.countCores()
+    cores = self.coreCount
+    pos = self.enter.get(zone)
+    for root in self.separated.get(articulation, ()):
+      start, end = self.enter[root], self.exit[root]
+      subtreeCores = self.corePrefix[end] - self.corePrefix[start]
+      if pos is not None and start <= pos < end: # zone is inside, OK if there is another core in the same subtree
+        return subtreeCores == self.cores[pos]
+      elif subtreeCores: # one core less to be in the same component with zone
+        cores -= 1
+        if cores == 0: return True
+    return False
+
+  
 class Assignment(SimpleAssignment):
   '''An assignment of a zone to a region storing its strength and contiguity (exclave) status.'''
 
@@ -1028,12 +1393,14 @@ class Assignment(SimpleAssignment):
   
   def setDegree(self, degree):
     self.degree = degree
+    self.touch()
   
   def isExclave(self):
     return self.exclave
    
   def setExclave(self, state):
     self.exclave = state
+    self.touch()
     
   def __repr__(self):
     return '<%s as %s of %s (%g%s)>' % (self.zone, ('core' if self.core else 'hinterland'), self.region, self.degree, ', exclave' if self.exclave else '')
@@ -1124,6 +1491,7 @@ class Region(RegionalUnit):
     self.assignments = []
     self.indepOverride = False
     self.articulations = None
+    self.connectivity = None
     self._mass = 0
   
   def setID(self, id):
@@ -1188,10 +1556,21 @@ class Region(RegionalUnit):
       self.articulations = self.calcArticulations()
     return self.articulations
   
+  def getConnectivityIndex(self):
+    '''Returns the index of subtrees separated by its articulation points, built together with them.'''
+    if self.articulations is None:
+      self.articulations = self.calcArticulations()
+    if self.connectivity.coreCount is None:
+      self.connectivity.coreCount = len(self.getCoreZones())
+    return self.connectivity
+  
   def calcArticulations(self):
     '''Calculates region articulation points - zones that would cause some other hinterland zones of the region to become exclaves.'''
-    if not self.assignments: return []
+    if not self.assignments:
+      self.connectivity = ConnectivityIndex(None, {}, {})
+      return []
     artic = defaultdict(list) # articulation points and portions they hide from the start zone
+    separated = defaultdict(list) # roots of the DFS subtrees in artic
     togo = [] # DFS stack
     ins = {} # enter time of DFS
     lows = {} # lowpoint function
@@ -1231,11 +1610,14 @@ class Region(RegionalUnit):
                   break
               else:
                 artic[now].append(self.subtree(children, neigh)) # get what neigh separates from now
+                separated[now].append(neigh)
             elif now not in children[neigh] and lows[now] > ins[neigh]:
               lows[now] = ins[neigh]
         del togo[-1]
     for child in children[root][1:]: # if root has 2+ children, it is articulation
       artic[now].append(self.subtree(children, child))
+      separated[now].append(child)
+    self.connectivity = ConnectivityIndex(root, children, separated)
     # if artic:
       # common.debug('articulation of %s detected: %s' % (self, artic))
     return artic
@@ -1343,11 +1725,21 @@ class PlainRegion(Region):
 class StaticRegion(Region):
   def __init__(self, zone, id):
     self.rigidUnit = zone.getRigidUnit()
+    self.flexibleUnit = zone.getFlexibleUnit()
     Region.__init__(self, id)
     self._secmass = 0
-    self._location = zone.getLocation()
+    self._locsum = numpy.zeros(2) # running sum and count of zone locations
+    self._loccount = 0
+    self._location = None
     SimpleAssignment(zone, self).tangle()
-    self.flexibleUnit = zone.getFlexibleUnit()
+    self.rigidUnit.addRegion(self)
+    self.flexibleUnit.addRegion(self)
+  
+  def erase(self):
+    '''Erases the region from all its zones and its administrative units.'''
+    Region.erase(self)
+    self.rigidUnit.removeRegion(self)
+    self.flexibleUnit.removeRegion(self)
     
   def _addMass(self, assignment):
     '''Updates the mass with the mass of an assignment.'''
@@ -1360,7 +1752,11 @@ class StaticRegion(Region):
       if self._secmass is None:
         self._secmass = 0
       self._secmass += secmass
-    self._location = None
+    loc = assignment.getZone().getLocation()
+    if loc is not None:
+      self._locsum += loc
+      self._loccount += 1
+    self._invalidateLocation()
       
   def _subMass(self, assignment):
     '''Updates the mass with the mass of an assignment.'''
@@ -1368,13 +1764,26 @@ class StaticRegion(Region):
     secmass = assignment.getSecondaryMass()
     if secmass is not None and self._secmass is not None:
       self._secmass -= secmass
-    self._location = None
+    loc = assignment.getZone().getLocation()
+    if loc is not None:
+      self._locsum -= loc
+      self._loccount -= 1
+    self._invalidateLocation()
   
   def _resetMass(self):
     self._mass = 0
     if self._secmass is not None:
       self._secmass = 0
-    self._location = None
+    self._locsum[:] = 0
+    self._loccount = 0
+    self._invalidateLocation()
+  
+  def _invalidateLocation(self):
+    '''Resets the location and reports the move to the administrative units (once until it is recomputed).'''
+    if self._location is not None:
+      self._location = None
+      self.rigidUnit.moveRegion(self)
+      self.flexibleUnit.moveRegion(self)
   
   def getSecondaryMass(self):
     return self._secmass
@@ -1386,21 +1795,15 @@ class StaticRegion(Region):
     return self.flexibleUnit
   
   def getLocation(self):
+    '''Returns the mean location of its zones (those that have one).'''
     if self._location is None:
-      zones = self.getZones()
-      self._location = numpy.array([0, 0])
-      loccount = 0
-      for zone in zones:
-        loc = zone.getLocation()
-        if loc is not None:
-          loccount += 1
-          self._location += loc
-      self._location /= loccount
+      self._location = self._locsum / max(self._loccount, 1)
     return self._location
   
   def distanceTo(self, other):
-    diff = self.getLocation() - other.getLocation()
-    return diff.dot(diff) ** 0.5
+    loc = self.getLocation()
+    otherLoc = other.getLocation()
+    return ((loc[0] - otherLoc[0]) ** 2 + (loc[1] - otherLoc[1]) ** 2) ** 0.5
     # except ValueError:
       # return 1e15
   
@@ -1419,8 +1822,7 @@ class FunctionalRegion(Region):
   def __init__(self, coreZone):
     '''Initializes the region, making the coreZone ID and color the ID and color of the region.'''
     Region.__init__(self, coreZone.getID()) 
-    self._coremass = 0
-    self._rawcoremass = 0 # a true mass of the core zones (no membership correction) for discriminating between zero-EMW regions
+    self._resetMass()
     Assignment(coreZone, self, core=True).tangle()
     zoneColor = coreZone.getColor()
     self.color = colors.BLACK_RGB if zoneColor is None else zoneColor
@@ -1432,7 +1834,9 @@ class FunctionalRegion(Region):
     if assignment.isCore():
       self._coremass += mass
       self._rawcoremass += assignment.getZone().getMass()
-    self._inflows = None
+    if assignment or assignment.isCore():
+      self._flowZones.add(assignment.getZone())
+      self._changeFlows(assignment.getZone(), 1)
       
   def _subMass(self, assignment):
     '''Updates the mass with the mass of an assignment.'''
@@ -1441,13 +1845,60 @@ class FunctionalRegion(Region):
     if assignment.isCore():
       self._coremass -= mass
       self._rawcoremass -= assignment.getZone().getMass()
-    self._inflows = None
+    if assignment or assignment.isCore():
+      self._changeFlows(assignment.getZone(), -1)
+      self._flowZones.discard(assignment.getZone())
   
   def _resetMass(self):
     self._mass = 0
     self._coremass = 0
-    self._rawcoremass = 0
-    self._inflows = None
+    self._rawcoremass = 0 # a true mass of the core zones (no membership correction) for discriminating between zero-EMW regions
+    self._flowZones = set() # zones whose flows are aggregated
+    self._outflows = self.interactionClass() # all outflows of its zones, including those into the region
+    self._inflows = self.interactionClass()
+    self._intraflows = self.interactionClass()
+    self._outTargets = Counter() # numbers of its zones having the target among their outflows
+    self._inSources = Counter()
+  
+  def _changeFlows(self, zone, sign):
+    '''Adds (sign 1) or subtracts (sign -1) the flows of its zone to or from the running flow aggregates.
+    
+    Targets no longer present in the flows of any of its zones are removed, as in the aggregates computed anew.'''
+    members = self._flowZones
+    outflows = zone.getOutflows()
+    inflows = zone.getInflows()
+    intra = self.interactionClass()
+    intra.addRaw(outflows.getRaw()) # raw outflows count as intraflows, as in outflowsFrom(...).restrict(...)
+    for target, strength in outflows.iteritems():
+      if target in members:
+        intra[target] += strength
+    for source, strength in inflows.iteritems():
+      if source in members and source is not zone:
+        intra[zone] += strength
+    if sign > 0:
+      self._outflows += outflows
+      self._inflows += inflows
+      self._intraflows += intra
+      self._countTargets(self._outTargets, outflows, sign)
+      self._countTargets(self._inSources, inflows, sign)
+    else:
+      self._outflows -= outflows
+      self._inflows -= inflows
+      self._intraflows -= intra
+      self._outflows.exclude(self._countTargets(self._outTargets, outflows, sign))
+      self._inflows.exclude(self._countTargets(self._inSources, inflows, sign))
+      self._intraflows.exclude([target for target in intra if target not in self._outTargets] + [zone])
+  
+  @staticmethod
+  def _countTargets(counter, flows, sign):
+    '''Updates the counts of zones having the flow targets and returns a list of targets whose count dropped to zero.'''
+    gone = []
+    for target in flows:
+      counter[target] += sign
+      if not counter[target]:
+        del counter[target]
+        gone.append(target)
+    return gone
     
   def getHinterlandMass(self):
     return (self._mass - self._coremass)
@@ -1513,22 +1964,19 @@ class FunctionalRegion(Region):
   def getOutflows(self, core=True, hinter=True, own=False):
     '''Returns outflows from given parts of the region out of the region.'''
     # oscilacni zony se nepocitaji jako region...
-    src = (self.getCoreZones() if core else []) + (self.getHinterlandZones() if hinter else [])
-    # common.debug(self, core, hinter, src)
-    # common.debug(self.interactionClass.outflowsFrom(src))
-    # common.debug(self.interactionClass.outflowsFrom(src).exclude(self.getZones()))
-    outfl = self.interactionClass.outflowsFrom(src)
+    if core and hinter: # whole region, use the running aggregate
+      outfl = self._outflows.copy()
+    else:
+      src = (self.getCoreZones() if core else []) + (self.getHinterlandZones() if hinter else [])
+      outfl = self.interactionClass.outflowsFrom(src)
     return outfl if own else outfl.exclude(self.getZones())
 
-  def getInflows(self, **kwargs):
-    if self._inflows is None or kwargs != self._lastInflowKWArgs:
-      self._inflows = self._getInflows(**kwargs)
-      self._lastInflowKWArgs = kwargs
-    return self._inflows
-
-  def _getInflows(self, core=True, hinter=True, own=False):
-    zones = (self.getCoreZones() if core else []) + (self.getHinterlandZones() if hinter else [])
-    infl = self.interactionClass.inflowsTo(zones)
+  def getInflows(self, core=True, hinter=True, own=False):
+    if core and hinter:
+      infl = self._inflows.copy()
+    else:
+      zones = (self.getCoreZones() if core else []) + (self.getHinterlandZones() if hinter else [])
+      infl = self.interactionClass.inflowsTo(zones)
     return infl if own else infl.exclude(self.getZones())
   
   def getMutualFlows(self, core=True, hinter=True, own=False):
@@ -1538,10 +1986,31 @@ class FunctionalRegion(Region):
   def getIntraflows(self, fromCore=True, fromHinter=True, toCore=True, toHinter=True):
     '''Returns outflows from given parts of the region into the region.'''
     # oscilacni zony se nepocitaji jako region...
+    if fromCore and fromHinter and toCore and toHinter:
+      return self._intraflows.copy()
     fromZones = (self.getCoreZones() if fromCore else []) + (self.getHinterlandZones() if fromHinter else [])
     toZones = (self.getCoreZones() if toCore else []) + (self.getHinterlandZones() if toHinter else [])
     return self.interactionClass.outflowsFrom(fromZones).restrict(toZones)
   
+  def getOutflowSum(self):
+    '''Returns the sum of outflows from the region out of the region (including raw outflows), as getOutflows().sum().'''
+    return self._flowSumOutside(self._outflows)
+  
+  def getInflowSum(self):
+    '''Returns the sum of inflows to the region from outside the region (including raw inflows), as getInflows().sum().'''
+    return self._flowSumOutside(self._inflows)
+  
+  def _flowSumOutside(self, flows):
+    inside = 0
+    for zone in self.getZones():
+      if zone in flows:
+        inside += flows[zone]
+    return flows.sum() - inside
+  
+  def getIntraflowSum(self):
+    '''Returns the sum of flows between the region zones (including raw outflows), as getIntraflows().sum().'''
+    return self._intraflows.sum()
+  
   # def getCoreHintFlows(self):
     # '''Returns flows from core to hinterland.'''
     # return self._getIntraflows(fromHinter=False, toCore=False)
@@ -1593,6 +2062,53 @@ class FunctionalRegion(Region):
     
 # a unit that contains zones and limits region growth
 class AdministrativeUnit(RegionalUnit):
+  def __init__(self, id):
+    RegionalUnit.__init__(self, id)
+    self.regions = set() # live regions within the unit
+    self.locationIndex = None # built on the first nearest region query
+    self.moved = set() # regions to reindex before the next query
+  
+  def addRegion(self, region):
+    self.regions.add(region)
+    self.moveRegion(region)
+  
+  def removeRegion(self, region):
+    self.regions.discard(region)
+    self.moved.discard(region)
+    if self.locationIndex is not None and region in self.locationIndex:
+      self.locationIndex.remove(region)
+  
+  def moveRegion(self, region):
+    '''Records a change of the region location for the location index.'''
+    if self.locationIndex is not None and region in self.regions:
+      self.moved.add(region)
+  
+  def getRegions(self):
+    return self.regions
+  
+  def nearestRegion(self, location, accept=None, key=None):
+    '''Returns the region of the unit nearest to the location, passing the accept filter if given.
+    Ties are decided by the smallest key, if given.'''
+    if self.locationIndex is None:
+      self.locationIndex = self.buildLocationIndex()
+    else:
+      for region in self.moved:
+        self.locationIndex.insert(region, region.getLocation())
+    self.moved.clear()
+    return self.locationIndex.nearest(location, accept, key)
+  
+  def buildLocationIndex(self):
+    '''Creates a grid index of region locations with about one region per cell.'''
+    regions = list(self.regions)
+    locations = numpy.array([region.getLocation() for region in regions], dtype=float).reshape(-1, 2)
+    cellSize = 0
+    if len(regions) > 1:
+      cellSize = (locations.max(axis=0) - locations.min(axis=0)).max() / numpy.sqrt(len(regions))
+    index = spatial.PointGrid(cellSize)
+    for region, location in zip(regions, locations):
+      index.insert(region, location)
+    return index
+  
   def __repr__(self):
     return '<Unit {}>'.format(self.id)
  
@@ -1897,10 +2413,7 @@ class MultiInteractionLoader(BaseInteractionLoader):
       target = self.zones[row.getValue(self.fieldNames[1])]
     except KeyError:
       target = None
-    vec = InteractionVector()
-    for fld in self.fieldNames[2:]:
-      vec.append(row.getValue(fld))
-    return (source, target, vec)
+    return (source, target, InteractionVector([row.getValue(fld) for fld in self.fieldNames[2:]]))
   
   def getStrengthFieldNames(self):
     return self.fieldNames[2:]
@@ -1913,7 +2426,7 @@ class MultiInteractionLoader(BaseInteractionLoader):
     firstKey = next(flows.iterkeys()) 
     idType = common.fieldType(type(firstKey.getID()))
     # some arbitrary InteractionVector to browse types
-    valIter = iter(flows[firstKey][next(flows[firstKey].iterkeys())])
+    valIter = iter(flows[firstKey][next(flows[firstKey].iterkeys())].tolist())
     # add the fields
     arcpy.AddField_management(output, self.fieldNames[0], idType)
     arcpy.AddField_management(output, self.fieldNames[1], idType)
@@ -1926,10 +2439,8 @@ class MultiInteractionLoader(BaseInteractionLoader):
         row = outCur.newRow()
         row.setValue(self.fieldNames[0], source.getID())
         row.setValue(self.fieldNames[1], target.getID())
-        i = 0
-        for fld in self.fieldNames[2:]: # value fields
-          row.setValue(fld, flows[source][target][i])
-          i += 1
+        for fld, value in zip(self.fieldNames[2:], flows[source][target].tolist()): # value fields
+          row.setValue(fld, value)
         outCur.insertRow(row)
     del outCur
       
@@ -2014,13 +2525,24 @@ class BaseRegionaliser:
   def __init__(self, zones):
     self.zones = zones
     self.regions = []
+    self.regionIndex = {}
   
   def findRegion(self, regID):
-    # dirty but sure works for any sorting
-    for reg in self.regions:
-      if reg.getID() == regID:
-        return reg
-    return None
+    regions = self.regionIndex.get(regID)
+    return regions[0] if regions else None
+  
+  def addRegion(self, region):
+    '''Adds the region to the region list and the ID index.'''
+    self.regions.append(region)
+    self.regionIndex.setdefault(region.getID(), []).append(region) # duplicate IDs are found in the order of adding
+  
+  def removeRegion(self, region):
+    '''Removes the region from the region list and the ID index.'''
+    self.regions.remove(region)
+    regions = self.regionIndex[region.getID()]
+    regions.remove(region)
+    if not regions:
+      del self.regionIndex[region.getID()]
   
   def getRegions(self):
     return self.regions
@@ -2045,12 +2567,16 @@ class BaseRegionaliser:
   def updateAssignments(self):
     pass
   
+  def postRun(self):
+    pass
+  
   def createRegions(self, regClass=FunctionalRegion):
     '''Creates regions for its zones. For every coreable zone, a region is created.'''
     self.regions = []
+    self.regionIndex = {}
     for zone in self.zones.values(): # region for each core zone
       if zone.coreable:
-        self.regions.append(regClass(zone))
+        self.addRegion(regClass(zone))
     self.regions.sort(key=ID_SORTER)
 
   def verify(self, region):
@@ -2114,7 +2640,183 @@ class BaseRegionaliser:
     return neighTable
 
 
+class FunctionalRegionaliser(BaseRegionaliser):
+  '''A regionaliser of functional regions, marking their exclaves after the run.'''
+  
+  def detectExclaves(self):
+    '''Detects exclaves of all regions at once by a breadth first search started from all region cores,
+    spreading only to zones of the same region. Marks the hinterland zones left unreached as exclaves
+    and all others as contiguous, and returns a dict of the exclave lists by region.'''
+    reached = set() # (zone, region) pairs contiguous with a core of the region
+    queue = deque()
+    for region in self.regions:
+      for zone in region.getCoreZones():
+        reached.add((zone, region))
+        queue.append((zone, region))
+    while queue:
+      examined, region = queue.popleft()
+      for neigh in examined.getNeighbours():
+        if neigh is not exterior and (neigh, region) not in reached and neigh.isInRegion(region):
+          reached.add((neigh, region))
+          queue.append((neigh, region))
+    exclaves = {}
+    for region in self.regions:
+      exclaves[region] = []
+      for ass in region.getAssignments():
+        isExclave = (ass.getZone(), region) not in reached
+        ass.setExclave(isExclave) # clears earlier marks of zones that are now contiguous
+        if isExclave:
+          exclaves[region].append(ass.getZone())
+    return exclaves
+
+  def postRun(self):
+    '''Marks the exclaves of all regions and freezes the exclave status of its zones for the zone output.'''
+    self.detectExclaves()
+    for zone in self.zones.values():
+      zone.transferExclaveFlag()
+
+
     
+class SuffixAllocator:
+  '''Allocates the smallest unused numeric suffix of region IDs within an administrative unit.
+  
+  Suffixes up to the high-water mark are taken except for those released, which are kept
+  in a heap. The heap is checked against the region ID index lazily, so a suffix
+  returned by allocate stays free until a region with it is actually added.'''
+  def __init__(self, unitID, formatter, finder):
+    self.unitID = unitID
+    self.formatter = formatter
+    self.finder = finder
+    self.mark = 0
+    self.released = []
+  
+  def idOf(self, suffix):
+    return self.unitID + self.formatter.format(suffix)
+  
+  def allocate(self):
+    '''Returns the region ID with the smallest suffix not used by any region.'''
+    while self.released:
+      if not self.finder(self.idOf(self.released[0])):
+        return self.idOf(self.released[0])
+      heapq.heappop(self.released)
+    while self.finder(self.idOf(self.mark + 1)):
+      self.mark += 1
+    return self.idOf(self.mark + 1)
+  
+  def release(self, suffixStr):
+    '''Marks the suffix given in its formatted form as possibly free again.'''
+    if suffixStr.isdigit():
+      suffix = int(suffixStr)
+      if 0 < suffix <= self.mark and self.idOf(suffix) == self.unitID + suffixStr:
+        heapq.heappush(self.released, suffix)
+
+
+class DescendingKey:
+  '''Reverses the ordering of a sort key (for max-heaps).'''
+  def __init__(self, key):
+    self.key = key
+  
+  def __lt__(self, other):
+    return other.key < self.key
+
+
+class AggregationQueue:
+  '''Orders regions for smallest-first aggregation.
+  
+  Replays the walk over a list of regions sorted by mass that is re-sorted after
+  every merge: regions not yet reached wait in a heap keyed by (mass, secondary mass, ID),
+  regions already passed in a max-heap. Merged regions and outdated keys are
+  skipped when popped instead of being removed from the heaps.
+  A step back before the start of the list continues from its end, as negative
+  list indexes did; depth counts the positions from the end until the walk
+  wraps around to the smallest region.'''
+  WAITING = 0
+  PASSED = 1
+  
+  def __init__(self, regions):
+    self.waiting = []
+    self.passed = []
+    self.states = {}
+    self.depth = 0
+    for region in regions:
+      self.wait(region)
+    self.current = self.popWaiting()
+  
+  @staticmethod
+  def keyOf(region):
+    return (region.getMass(), region.getSecondaryMass(), region.getID())
+  
+  def wait(self, region):
+    key = self.keyOf(region)
+    self.states[region] = (self.WAITING, key)
+    heapq.heappush(self.waiting, (key, region))
+  
+  def passOver(self, region):
+    key = self.keyOf(region)
+    self.states[region] = (self.PASSED, key)
+    heapq.heappush(self.passed, (DescendingKey(key), region))
+  
+  def popWaiting(self):
+    while self.waiting:
+      key, region = heapq.heappop(self.waiting)
+      if self.states.get(region) == (self.WAITING, key):
+        del self.states[region]
+        return region
+    return None
+  
+  def popPassed(self):
+    while self.passed:
+      key, region = heapq.heappop(self.passed)
+      if self.states.get(region) == (self.PASSED, key.key):
+        del self.states[region]
+        return region
+    return None
+  
+  def popLargest(self, rank):
+    '''Returns the waiting region at the given rank from the largest (counted from 1).'''
+    live = [(key, region) for key, region in self.waiting if self.states.get(region) == (self.WAITING, key)]
+    if not live:
+      return None
+    key, region = heapq.nlargest(min(rank, len(live)), live)[-1]
+    del self.states[region]
+    return region
+  
+  def advance(self):
+    '''Passes the current region and returns the next one (None at the end).'''
+    if self.depth: # counting from the end, nothing is passed until the walk wraps around
+      self.wait(self.current)
+      self.depth -= 1
+      self.current = self.popLargest(self.depth) if self.depth else self.popWaiting()
+      return self.current
+    self.passOver(self.current)
+    self.current = self.popWaiting()
+    return self.current
+  
+  def merged(self, target, recheck=False):
+    '''Drops the current region merged into target and returns the next region to examine.
+    If recheck, the position of the walk moves back by one.'''
+    if self.depth:
+      self.wait(target)
+      if recheck:
+        self.depth += 1
+      self.current = self.popLargest(self.depth)
+      return self.current
+    if self.states[target][0] == self.PASSED:
+      # the target leaves the passed part with its updated mass, the smallest waiting region fills its place
+      self.wait(target)
+      self.passOver(self.popWaiting())
+    else:
+      self.wait(target)
+    if not recheck:
+      self.current = self.popWaiting()
+    else: # step back to the largest passed region
+      self.current = self.popPassed()
+      if self.current is None: # none passed, the step goes before the smallest region to the largest one
+        self.depth = 1
+        self.current = self.popLargest(self.depth)
+    return self.current
+  
+  
 class StaticAggregationRegionaliser(BaseRegionaliser):
   TMP_NEIGH_TABLE = 'tmp_neigh'
   
@@ -2140,6 +2842,8 @@ class StaticAggregationRegionaliser(BaseRegionaliser):
   
   def generateRegions(self, zones):
     self.regions = []
+    self.regionIndex = {}
+    self.suffixes = {}
     zones.sort(key=operator.methodcaller('getRigidUnitID'))
     prevUnitID = False
     for zone in zones:
@@ -2151,7 +2855,7 @@ class StaticAggregationRegionaliser(BaseRegionaliser):
         prevUnitID = unitID
       else:
         i += 1
-      self.regions.append(StaticRegion(zone, ('' if unitID is None else unitID) + self.formatter.format(i)))
+      self.addRegion(StaticRegion(zone, ('' if unitID is None else unitID) + self.formatter.format(i)))
   
   def generateUnits(self, zones):
     self.rigidUnits, maxI = self.makeUnitSet(zones, operator.methodcaller('getRigidUnitID'), 'setRigidUnit')
@@ -2201,37 +2905,33 @@ class StaticAggregationRegionaliser(BaseRegionaliser):
     causes the aggregate to cross the threshold.'''
     # common.debug(self.leaks)
     if locationFallback: self.leaks = [] # reset leaks, location fallback removes them
-    self.sortByMass(self.regions) # aggregate smallest first
-    # common.debug(self.regions)
-    i = 0
-    while i < len(self.regions):
-      if not (self.verify(self.regions[i]) or self.handleZero(self.regions[i])):
-        # common.debug('aggregating %s' % self.regions[i])
-        move = self.assignRegion(self.regions[i], self.targetByNeighbourhood)
-        if move: # some aggregation performed
-          self.regions.pop(i)
-          i -= move
-          self.sortByMass(self.regions)
-        elif self.rigidUnitExhausted(self.regions[i]): # no target within rigid unit
-          # common.debug('%s exhausted' % self.regions[i])
-          self.exhausted.append(self.regions[i])
-          self.regions[i].setOverride()
-        elif locationFallback:
-          move = self.assignRegion(self.regions[i], self.targetByLocation)
-          if move: # some aggregation performed
-            self.regions.pop(i)
-            i -= move
-            self.sortByMass(self.regions)
-          else: # logical error, must find some (or else rigid unit is exhausted)
-            self.regions[i].setOverride()
-            common.warning('Aggregation failed for region {reg}, left independent'.format(reg=self.regions[i].getID()))
-        else:
+    queue = AggregationQueue(self.regions) # aggregate smallest first
+    region = queue.current
+    while region is not None:
+      if not (self.verify(region) or self.handleZero(region)):
+        # common.debug('aggregating %s' % region)
+        tgt = self.assignRegion(region, self.targetByNeighbourhood)
+        if tgt is None and self.rigidUnitExhausted(region): # no target within rigid unit
+          # common.debug('%s exhausted' % region)
+          self.exhausted.append(region)
+          region.setOverride()
+        elif tgt is None and locationFallback:
+          tgt = self.assignRegion(region, self.targetByLocation)
+          if tgt is None: # logical error, must find some (or else rigid unit is exhausted)
+            region.setOverride()
+            common.warning('Aggregation failed for region {reg}, left independent'.format(reg=region.getID()))
+        elif tgt is None:
           # no override set, will be aggregated in the next step, if applicable
-          self.leaks.append(self.regions[i])
-          # common.warning('Region {reg} is an exclave of rigid superunit {unit}, left independent: potential data leak'.format(reg=self.regions[i].getID(), unit=self.regions[i].getRigidUnit().getID()))
+          self.leaks.append(region)
+          # common.warning('Region {reg} is an exclave of rigid superunit {unit}, left independent: potential data leak'.format(reg=region.getID(), unit=region.getRigidUnit().getID()))
+        if tgt is not None: # some aggregation performed
+          self.removeRegion(region)
+          region = queue.merged(tgt, self.needsRecheck(region, tgt))
+          continue
       # else:
-        # common.message('%s independent' % self.regions[i])
-      i += 1
+        # common.message('%s independent' % region)
+      region = queue.advance()
+    self.sortByMass(self.regions)
     self.dropZeros()
   
   def report(self):
@@ -2248,9 +2948,8 @@ class StaticAggregationRegionaliser(BaseRegionaliser):
     return bool(self.leaks)
   
   def rigidUnitExhausted(self, region):
-    regUnit = region.getRigidUnit()
-    for compReg in self.regions:
-      if compReg.getRigidUnit() is regUnit and compReg is not region:
+    for compReg in region.getRigidUnit().getRegions():
+      if compReg is not region:
         return False
     return True
   
@@ -2262,32 +2961,117 @@ class StaticAggregationRegionaliser(BaseRegionaliser):
         self.dropZeroZonesFrom(region)
       
   def dropZeroZonesFrom(self, region):
-    # all zero mass zones
+    '''Drops zero weight zones of the region one by one, starting from the largest by sortByMass,
+    unless they separate the contiguous part of the region they lie in at the moment of their drop.
+    
+    One articulation pass finds the zero weight zones separating weighted zones from each other;
+    those stay separating whatever else is dropped, so they are kept without further checks.
+    Whether any other zone separates its part is decided by a search around it.'''
     zeros = [zone for zone in region.getZones() if self.hasZeroWeight(zone)]
+    if not zeros:
+      return
     self.sortByMass(zeros) # assure stable unique ordering
-    stop = False
+    zones = region.getZones()
+    inside = set(zones)
+    neighs = {}
+    for zone in zones:
+      neighs[zone] = [neigh for neigh in zone.getNeighbours() if neigh is not exterior and neigh in inside and neigh is not zone]
+    needed = self.separatingZeros(zones, neighs)
     while zeros:
       zero = zeros.pop()
-      # that would not cause the region to break into two parts
-      if not region.getArticulation(zero):
-        # make their own region back
-        unused = self.getUnusedID(zero.getRigidUnit())
-        zero.deassign()
-        self.regions.append(StaticRegion(zero, unused))
-        # SimpleAssignment(zero, self.regions[-1]).tangle()
+      if zero in needed or self.separatesNeighbours(zero, neighs, inside):
+        continue
+      inside.remove(zero)
+      # make their own region back
+      unused = self.getUnusedID(zero.getRigidUnit())
+      zero.deassign()
+      self.addRegion(StaticRegion(zero, unused))
+  
+  def separatingZeros(self, zones, neighs):
+    '''Returns a set of zero weight zones separating weighted zones of their contiguous part
+    from each other, found by a single depth first search computing articulation points.'''
+    ins = {} # enter time of DFS
+    lows = {} # lowpoint function
+    weights = {} # weighted zone counts of DFS subtrees
+    separated = defaultdict(list) # weighted zone counts of DFS subtrees separated by the zone
+    needed = set()
+    for root in zones:
+      if root in ins:
+        continue
+      part = [root]
+      ins[root] = lows[root] = len(ins)
+      weights[root] = 0
+      togo = [(root, None, iter(neighs[root]))] # DFS stack
+      while togo:
+        now, parent, toVisit = togo[-1]
+        for neigh in toVisit:
+          if neigh not in ins: # enter vertex
+            ins[neigh] = lows[neigh] = len(ins)
+            weights[neigh] = 0
+            part.append(neigh)
+            togo.append((neigh, now, iter(neighs[neigh])))
+            break
+          elif neigh is not parent and ins[neigh] < lows[now]:
+            lows[now] = ins[neigh]
+        else: # exit vertex
+          del togo[-1]
+          if not self.hasZeroWeight(now):
+            weights[now] += 1
+          if parent is not None:
+            weights[parent] += weights[now]
+            if lows[now] < lows[parent]:
+              lows[parent] = lows[now]
+            if lows[now] >= ins[parent]: # parent is an articulation point (or the root)
+              separated[parent].append(weights[now])
+      for zone in part:
+        if zone in separated and self.hasZeroWeight(zone):
+          sides = separated[zone] + [weights[root] - sum(separated[zone])]
+          if sum(1 for side in sides if side) >= 2:
+            needed.add(zone)
+    return needed
+  
+  @staticmethod
+  def separatesNeighbours(zone, neighs, inside):
+    '''Returns True if the zones in inside adjacent to zone would not all be connected without it.
+    
+    Runs a breadth first search from each of them in turn, so that the first search to exhaust
+    its part or to reach all of the others decides; this keeps the search local to the zone.'''
+    starts = [neigh for neigh in neighs[zone] if neigh in inside]
+    if len(starts) < 2:
+      return False
+    targets = frozenset(starts)
+    searches = [[deque([start]), set([start]), 1] for start in starts] # queue, reached zones, reached targets
+    while True:
+      for search in searches:
+        queue, reached = search[0], search[1]
+        if not queue:
+          return True
+        for neigh in neighs[queue.popleft()]:
+          if neigh in inside and neigh is not zone and neigh not in reached:
+            reached.add(neigh)
+            queue.append(neigh)
+            if neigh in targets:
+              search[2] += 1
+              if search[2] == len(starts):
+                return False
   
   def getUnusedID(self, unit):
     '''Finds an ID for the region with respect to its administrative unit belonging.
     Tries to minimize the suffix number.'''
     unitID = unit.getID()
     if unitID is None: unitID = ''
-    i = 1
-    while True:
-      tryID = unitID + self.formatter.format(i)
-      if self.findRegion(tryID):
-        i += 1
-      else:
-        return tryID 
+    if unitID not in self.suffixes:
+      self.suffixes[unitID] = SuffixAllocator(unitID, self.formatter, self.findRegion)
+    return self.suffixes[unitID].allocate()
+  
+  def removeRegion(self, region):
+    '''Removes the region and releases its ID suffix for reuse.'''
+    BaseRegionaliser.removeRegion(self, region)
+    regID = region.getID()
+    for cut in xrange(len(regID)): # any unit ID the region ID might be composed from
+      allocator = self.suffixes.get(regID[:cut])
+      if allocator is not None:
+        allocator.release(regID[cut:])
   
   def handleZero(self, region):
     # common.debug('%s: %s' % (region, self.hasZeroWeight(region)))
@@ -2298,6 +3082,7 @@ class StaticAggregationRegionaliser(BaseRegionaliser):
       return False
   
   def assignRegion(self, region, searchFx):
+    '''Merges the region into a target found by searchFx. Returns the target, or None if no target was found.'''
     # try within the flexible unit first
     tgt = searchFx(region, crossFlexible=False)
     # only after preferring merges within flexible unit, drop this preference
@@ -2310,13 +3095,15 @@ class StaticAggregationRegionaliser(BaseRegionaliser):
       region.erase()
       if tgt.hasOverride(): # remove the override if merged into one (needs re-checking)
         tgt.setOverride(False)
-      if tgt.getMass() == region.getMass() and tgt.getSecondaryMass() == region.getSecondaryMass():
-        return 2 # need to re-check the result (no mass improvement)
-      else:
-        return 1
+      return tgt
     else:
       # no targets found, can't do anything (probably rigid unit limits reached)
-      return 0
+      return None
+  
+  @staticmethod
+  def needsRecheck(region, tgt):
+    '''Tells whether the merge of region into tgt brought no mass improvement, so the walk must step back.'''
+    return tgt.getMass() == region.getMass() and tgt.getSecondaryMass() == region.getSecondaryMass()
   
   def targetByNeighbourhood(self, region, crossFlexible=False, omitZeros=True):
     rigidUnit = region.getRigidUnit()
@@ -2345,40 +3132,197 @@ class StaticAggregationRegionaliser(BaseRegionaliser):
   def targetByLocation(self, region, crossFlexible=False):
     rigidUnit = region.getRigidUnit()
     flexUnit = region.getFlexibleUnit()
-    candidates = {}
-    for cand in self.regions:
-      if cand is not None and cand.getRigidUnit() is rigidUnit and (crossFlexible or cand.getFlexibleUnit() is flexUnit) and cand is not region:
-        candidates[cand] = region.distanceTo(cand)
-    # common.debug('LOCATIONAL candidates for %s: %s' % (region, candidates))
-    if candidates:
-      return min(candidates.iteritems(), key=operator.itemgetter(1))[0]
-    else:
-      return None
+    accept = lambda cand: cand is not region and cand.getRigidUnit() is rigidUnit and (crossFlexible or cand.getFlexibleUnit() is flexUnit)
+    # equally distant candidates are decided by mass
+    return (rigidUnit if crossFlexible else flexUnit).nearestRegion(region.getLocation(), accept, AggregationQueue.keyOf)
       
       
     
 
     
+class MeasureCache:
+  '''A bounded cache of measure values, valid for the version of the measured object they were computed at.
+  Evicts the least recently used values when full.'''
+  
+  def __init__(self, size=MEASURE_CACHE_SIZE):
+    self.size = size
+    self.values = OrderedDict()
+  
+  def get(self, key, version, compute):
+    '''Returns the value cached under key if computed at version; otherwise computes it by calling compute and caches it.'''
+    cached = self.values.pop(key, None)
+    if cached is None or cached[0] != version:
+      cached = (version, compute())
+      if len(self.values) >= self.size:
+        self.values.popitem(last=False)
+    self.values[key] = cached # most recently used last
+    return cached[1]
+  
+  def clear(self):
+    self.values.clear()
+  
+  def __len__(self):
+    return len(self.values)
+
+
+def objectColumn(values):
+  '''Returns an object array of the values (which may be sequences themselves).'''
+  values = list(values)
+  column = numpy.empty(len(values), dtype=object)
+  for i, value in enumerate(values):
+    column[i] = value
+  return column
+
+
+class FlowMatrix:
+  '''Flows of a list of zones as a CSR matrix (indptr, indices, values) over zone positions,
+  with their raw flows and region and core labels of the zones, for computing measures in batch.
+  
+  A single label cannot tell all regions of a zone with several assignments, so rows with flows to such zones
+  or to zones out of the list are not exact and must be measured zone by zone.'''
+  
+  def __init__(self, zones, flowGetter, regionLabels, coreLabels, positions, singles):
+    self.zones = zones
+    self.zoneRegions = regionLabels
+    self.zoneCores = coreLabels
+    counts = []
+    indices = []
+    values = []
+    raws = []
+    for zone in zones:
+      flows = flowGetter(zone)
+      counts.append(len(flows))
+      for target, strength in flows.iteritems():
+        indices.append(positions.get(target, -1))
+        values.append(strength)
+      raws.append(flows.getRaw())
+    self.counts = numpy.array(counts, dtype=int)
+    self.indptr = numpy.concatenate(([0], self.counts.cumsum()))
+    self.rows = numpy.repeat(numpy.arange(len(zones)), self.counts)
+    self.indices = numpy.array(indices, dtype=int)
+    self.values = numpy.array(values)
+    self.raws = numpy.array(raws)
+    self.nonempty = self.counts > 0
+    known = self.indices >= 0
+    self.regions = regionLabels[self.rows] # region of the source zone
+    self.targetRegions = numpy.where(known, regionLabels[self.indices], -1)
+    self.targetCores = numpy.where(known, coreLabels[self.indices], -1)
+    self.measured = self.nonempty & (regionLabels >= 0) # zones with flows in a region
+    self.inRegion = (self.targetRegions == self.regions) & (self.regions >= 0)
+    inexact = ~known | ~singles[self.indices]
+    self.exact = numpy.bincount(self.rows, weights=inexact, minlength=len(zones)) == 0
+  
+  def rowSums(self, mask=None):
+    '''Returns the sums of flows of every zone, only of those selected by the mask if given.'''
+    weights = self.values if mask is None else numpy.where(mask, self.values, 0)
+    sums = numpy.bincount(self.rows, weights=weights, minlength=len(self.counts))
+    return sums.astype(self.values.dtype) if self.values.dtype.kind in 'iu' else sums
+  
+  def totals(self):
+    '''Returns the sums of flows of every zone including raw flows.'''
+    return self.rowSums() + self.raws
+  
+  def rowMax(self):
+    maxima = numpy.zeros(len(self.counts), dtype=self.values.dtype)
+    maxima[self.nonempty] = numpy.maximum.reduceat(self.values, self.indptr[:-1][self.nonempty])
+    return maxima
+  
+  def rowArgmax(self):
+    '''Returns positions of the strongest flow targets of every zone, -1 for zones without flows.'''
+    order = numpy.lexsort((-self.values, self.rows))
+    strongest = numpy.full(len(self.counts), -1, dtype=int)
+    strongest[self.nonempty] = self.indices[order[self.indptr[:-1][self.nonempty]]]
+    return strongest
+  
+  def distinctCounts(self, labels):
+    '''Returns the numbers of distinct nonnegative labels among the flows of every zone.'''
+    valid = labels >= 0
+    if not valid.any():
+      return numpy.zeros(len(self.counts), dtype=int)
+    base = labels.max() + 1
+    pairs = numpy.unique(self.rows[valid] * base + labels[valid])
+    return numpy.bincount(pairs // base, minlength=len(self.counts))
+
+  def ratio(self, values):
+    '''Returns the values divided by the zone flow totals (zero for zones without flows).'''
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      return numpy.where(self.nonempty, values / self.totals().astype(float), 0)
+
+
 class ZoneMeasurer:
   def __init__(self, names=[], regName=None):
     self.names = names
     self.dedicatedMeasurer = RegionMeasurer()
     self.outputNames = self.createOutputNameDict(names, regName).items()
+    self.cache = MeasureCache()
 
   def getMeasure(self, object, name):
     # common.message(name)
     # common.message(self.measureMethods.keys())
     if name not in self.measureMethods:
-      measure = self.dedicatedMeasurer.getDedicatedMeasure(object, name)
+      return self.dedicatedMeasurer.getDedicatedMeasure(object, name)
     else:
-      measure = self.measureMethods[name](object)
+      return self.cache.get((object, name), self.versionOf(object, name), lambda: self.computeMeasure(object, name))
+  
+  def computeMeasure(self, object, name):
+    measure = self.measureMethods[name](object)
     return measure.getID() if isinstance(measure, RegionalUnit) else measure
   
+  def versionOf(self, object, name):
+    '''Returns the state a zone measure depends on - the versions of the zone and its region, or all modifications for measures involving other regions.'''
+    if name in self.globalMeasures:
+      return RegionalUnit.modifications
+    else:
+      region = object.getRegion()
+      return (object.getVersion(), (None if region is None else region.getVersion()))
+  
+  def measureAll(self, zones, names):
+    '''Computes the named measures for all the zones in one pass.
+    
+    Returns a dict of measure names and arrays of their values in the order of zones. Flow measures are computed
+    as columns over shared matrices of zone flows and arrays of region and core labels; the other zone measures
+    are measured zone by zone and the region measures once per region. Zones whose flows
+    the labels do not describe exactly (see FlowMatrix) are measured zone by zone as well.'''
+    zones = list(zones)
+    positions = {zone : i for i, zone in enumerate(zones)}
+    regions = []
+    regionIndex = {}
+    def label(region):
+      if region is None:
+        return -1
+      if region not in regionIndex:
+        regionIndex[region] = len(regions)
+        regions.append(region)
+      return regionIndex[region]
+    regionLabels = numpy.array([label(zone.getRegion()) for zone in zones], dtype=int)
+    coreLabels = numpy.array([label(zone.getCore()) for zone in zones], dtype=int)
+    singles = numpy.array([len(zone.getAssignments()) <= 1 for zone in zones], dtype=bool)
+    matrices = {}
+    columns = {}
+    for name in names:
+      if name in self.batchMethods and name not in columns:
+        direction, method = self.batchMethods[name]
+        if direction not in matrices:
+          getter = operator.methodcaller('getOutflows' if direction == 'out' else 'getInflows')
+          matrices[direction] = FlowMatrix(zones, getter, regionLabels, coreLabels, positions, singles)
+        flows = matrices[direction]
+        if flows.values.ndim == 1:
+          column = method(flows)
+          for i in numpy.flatnonzero(~flows.exact):
+            column[i] = self.getMeasure(zones[i], name)
+          columns[name] = column
+          continue
+      if name in self.measureMethods:
+        columns[name] = objectColumn(self.getMeasure(zone, name) for zone in zones)
+      else:
+        regionValues = [self.dedicatedMeasurer.getMeasure(region, name) for region in regions] + [None]
+        columns[name] = objectColumn(regionValues)[regionLabels] # None for zones with no region
+    return columns
+  
   def measureGetter(self, name):
     if name in self.measureMethods:
       def getter(object):
-        measure = self.measureMethods[name](object)
-        return measure.getID() if isinstance(measure, RegionalUnit) else measure
+        return self.getMeasure(object, name)
       return getter
     else:
       return self.dedicatedMeasurer.dedicatedMeasureGetter(name)    
@@ -2404,6 +3348,57 @@ class ZoneMeasurer:
         raise KeyError, 'measure %s not found' % name
     return d
   
+  # BATCH MEASUREMENT METHODS, operating on FlowMatrix
+  @staticmethod
+  def batchMaxFlow(flows):
+    return flows.rowMax()
+  
+  @staticmethod
+  def batchRegionFlow(flows):
+    return numpy.where(flows.measured, flows.rowSums(flows.inRegion), 0)
+  
+  @staticmethod
+  def batchCoreFlow(flows):
+    toCore = (flows.targetCores == flows.regions) & (flows.regions >= 0)
+    return numpy.where(flows.measured, numpy.where(flows.zoneCores >= 0, flows.rowSums(flows.inRegion), flows.rowSums(toCore)), 0)
+  
+  @staticmethod
+  def batchOutFlow(flows):
+    return numpy.where(flows.measured, flows.rowSums(~flows.inRegion), 0)
+  
+  @staticmethod
+  def batchMaxFlowRatio(flows):
+    return flows.ratio(flows.rowMax())
+  
+  @classmethod
+  def batchCoreFlowRatio(cls, flows):
+    return flows.ratio(cls.batchCoreFlow(flows))
+  
+  @classmethod
+  def batchRegionFlowRatio(cls, flows):
+    return flows.ratio(cls.batchRegionFlow(flows))
+  
+  @classmethod
+  def batchOutFlowRatio(cls, flows):
+    return flows.ratio(cls.batchOutFlow(flows))
+  
+  @staticmethod
+  def batchMaxTarget(flows):
+    ids = objectColumn([zone.getID() for zone in flows.zones] + [None])
+    return ids[flows.rowArgmax()] # None for zones without flows
+  
+  @staticmethod
+  def batchFlowSum(flows):
+    return flows.totals()
+  
+  @staticmethod
+  def batchCoreZoneFlowSum(flows):
+    return flows.rowSums(flows.targetCores >= 0) + flows.raws # raw flows are kept by toCore().restrictToRegions()
+  
+  @staticmethod
+  def batchCoreZoneFlowCount(flows):
+    return flows.distinctCounts(flows.targetCores)
+  
   # MEASUREMENT METHODS
   @staticmethod
   def maxOutflow(object):
@@ -2514,24 +3509,30 @@ class ZoneMeasurer:
     return object.getExclaveFlag()
 
 ZoneMeasurer.measureMethods = {'MAX_OUT' : ZoneMeasurer.maxOutflow, 'MAX_D' : ZoneMeasurer.maxTarget, 'CORE_OUT' : ZoneMeasurer.coreOutflow, 'REG_OUT' : ZoneMeasurer.regOutflow, 'NOREG_OUT' : ZoneMeasurer.outOutflow, 'NOREG_OUT_Q' : ZoneMeasurer.outOutflowRatio, 'MAX_MEM' : ZoneMeasurer.maxHamplMembership, 'REG_MEM' : ZoneMeasurer.regHamplMembership, 'MAX_OUT_Q' : ZoneMeasurer.maxOutflowRatio, 'CORE_OUT_Q' : ZoneMeasurer.coreOutflowRatio, 'REG_OUT_Q' : ZoneMeasurer.regOutflowRatio,   'REG_MASS' : ZoneMeasurer.regHamplMembershipMass, 'IS_EXC' : ZoneMeasurer.exclaveFlag, 'TOT_IN' : ZoneMeasurer.sumInflows, 'TOT_OUT' : ZoneMeasurer.sumOutflows, 'TOT_IN_CORE' : ZoneMeasurer.sumCoreZoneInflows, 'TOT_OUT_CORE' : ZoneMeasurer.sumCoreZoneOutflows, 'COUNT_IN_CORE' : ZoneMeasurer.countCoreZoneInflows, 'COUNT_OUT_CORE' : ZoneMeasurer.countCoreZoneOutflows}
+ZoneMeasurer.globalMeasures = set(['MAX_MEM', 'TOT_IN_CORE', 'TOT_OUT_CORE', 'COUNT_IN_CORE', 'COUNT_OUT_CORE']) # depend on the state of all regions
+ZoneMeasurer.batchMethods = {'MAX_OUT' : ('out', ZoneMeasurer.batchMaxFlow), 'MAX_D' : ('out', ZoneMeasurer.batchMaxTarget), 'CORE_OUT' : ('out', ZoneMeasurer.batchCoreFlow), 'REG_OUT' : ('out', ZoneMeasurer.batchRegionFlow), 'NOREG_OUT' : ('out', ZoneMeasurer.batchOutFlow), 'NOREG_OUT_Q' : ('out', ZoneMeasurer.batchOutFlowRatio), 'MAX_OUT_Q' : ('out', ZoneMeasurer.batchMaxFlowRatio), 'CORE_OUT_Q' : ('out', ZoneMeasurer.batchCoreFlowRatio), 'REG_OUT_Q' : ('out', ZoneMeasurer.batchRegionFlowRatio), 'TOT_IN' : ('in', ZoneMeasurer.batchFlowSum), 'TOT_OUT' : ('out', ZoneMeasurer.batchFlowSum), 'TOT_IN_CORE' : ('in', ZoneMeasurer.batchCoreZoneFlowSum), 'TOT_OUT_CORE' : ('out', ZoneMeasurer.batchCoreZoneFlowSum), 'COUNT_IN_CORE' : ('in', ZoneMeasurer.batchCoreZoneFlowCount), 'COUNT_OUT_CORE' : ('out', ZoneMeasurer.batchCoreZoneFlowCount)}
 
       
 class RegionMeasurer:
+  '''Measures regions, caching the measures until the region assignments change.'''
   def __init__(self):
-    self.measures = {}
+    self.cache = MeasureCache()
+  
+  def measureAll(self, regions, names):
+    '''Computes the named measures for all the regions. Returns a dict of measure names and arrays of their values in the order of regions.'''
+    regions = list(regions)
+    return {name : objectColumn(self.getMeasure(region, name) for region in regions) for name in names}
   
   def getMeasure(self, object, name):
     # common.message(name)
     # common.message(self.measureMethods.keys())
-    if object not in self.measures:
-      self.measures[object] = {}
-    if name not in self.measures[object]:
-      if name not in self.measureMethods:
-        raise ValueError, 'measure %s not known' % name
-      else:
-        measure = self.measureMethods[name](object)
-        self.measures[object][name] = (measure.getID() if isinstance(measure, RegionalUnit) else measure)
-    return self.measures[object][name]
+    if name not in self.measureMethods:
+      raise ValueError, 'measure %s not known' % name
+    return self.cache.get((object, name), object.getVersion(), lambda: self.computeMeasure(object, name))
+  
+  def computeMeasure(self, object, name):
+    measure = self.measureMethods[name](object)
+    return measure.getID() if isinstance(measure, RegionalUnit) else measure
   
   def getDedicatedMeasure(self, object, name):
     return self.getMeasure(object.getRegion(), name)
@@ -2540,19 +3541,13 @@ class RegionMeasurer:
     if name not in self.measureMethods:
       raise ValueError, 'measure %s not known' % name
     def getter(object):
-      reg = object.getRegion()
-      if reg not in self.measures:
-        self.measures[reg] = {}
-      if name not in self.measures[reg]:
-        measure = self.measureMethods[name](reg)
-        self.measures[reg][name] = (measure.getID() if isinstance(measure, RegionalUnit) else measure)
-      return self.measures[reg][name]
+      return self.getMeasure(object.getRegion(), name)
     return getter
   
   # MEASUREMENT METHODS
   @classmethod
   def hamplRegionIntegrity(cls, object):
-    outsum = object.getOutflows().sum()
+    outsum = object.getOutflowSum()
     if outsum:
       return cls.coreHintMutualFlowSum(object) / float(outsum) # i1+i2/d1+d2
     else:
@@ -2572,7 +3567,7 @@ class RegionMeasurer:
 
   @staticmethod
   def bezakSelfContainment(object):
-    return object.getIntraflows().sum() / float(object.getMutualFlows().sum())
+    return object.getIntraflowSum() / float(object.getInflowSum() + object.getOutflowSum())
 
   @classmethod
   def coombesSelfContainment(cls, object):
@@ -2586,13 +3581,13 @@ class RegionMeasurer:
 
   @staticmethod
   def residenceSelfContainment(object):
-    intra = object.getIntraflows().sum()
-    return intra / float(intra + object.getOutflows().sum())
+    intra = object.getIntraflowSum()
+    return intra / float(intra + object.getOutflowSum())
   
   @staticmethod
   def workplaceSelfContainment(object):
-    intra = object.getIntraflows().sum()
-    return intra / float(intra + object.getInflows().sum())
+    intra = object.getIntraflowSum()
+    return intra / float(intra + object.getInflowSum())
   
   @staticmethod
   def emw(object):
@@ -2604,7 +3599,7 @@ class RegionMeasurer:
   
   @staticmethod
   def intraFlowSum(object):
-    return object.getIntraflows().sum()
+    return object.getIntraflowSum()
   
   @staticmethod
   def coreHintMutualFlowSum(object):
@@ -2612,15 +3607,15 @@ class RegionMeasurer:
   
   @staticmethod
   def outflowSum(object):
-    return object.getOutflows().sum()
+    return object.getOutflowSum()
   
   @staticmethod
   def inflowSum(object):
-    return object.getInflows().sum()
+    return object.getInflowSum()
   
   @staticmethod
   def mutualFlowSum(object):
-    return object.getMutualFlows().sum()
+    return object.getInflowSum() + object.getOutflowSum()
   
 RegionMeasurer.measureMethods = {'HAM_IR' : RegionMeasurer.hamplRegionIntegrity, 'HAM_IZ' : RegionMeasurer.hamplHinterlandIntegrity, 'HAM_SIG' : RegionMeasurer.hinterlandSignificance, 'COO_SC' : RegionMeasurer.coombesSelfContainment, 'BEZ_SC' : RegionMeasurer.bezakSelfContainment, 'RB_SC' : RegionMeasurer.residenceSelfContainment, 'WB_SC' : RegionMeasurer.workplaceSelfContainment, 'FMW' : RegionMeasurer.fmw, 'EMW' : RegionMeasurer.emw, 'R_INTRA_SUM' : RegionMeasurer.intraFlowSum, 'R_C_H_SUM' : RegionMeasurer.coreHintMutualFlowSum, 'R_OUT_SUM' : RegionMeasurer.outflowSum, 'R_IN_SUM' : RegionMeasurer.inflowSum, 'R_BOTH_SUM' : RegionMeasurer.mutualFlowSum}
   
\ No newline at end of file
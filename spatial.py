@@ -0,0 +1,232 @@
+import numpy
+
+XMIN, YMIN, XMAX, YMAX = range(4)
+
+class BoxIndex:
+  '''A static bounding box index (an R-tree packed by the Sort-Tile-Recursive algorithm).
+
+  Built once over an (n, 4) array of xmin, ymin, xmax, ymax rows; all queries
+  return indices into that array. Boxes that only touch are considered overlapping
+  so that neighbouring polygons sharing a border are always reported.'''
+
+  def __init__(self, boxes, nodeSize=16):
+    self.boxes = numpy.asarray(boxes, dtype=float).reshape(-1, 4)
+    self.nodeSize = int(nodeSize)
+    self.levels = [] # (node boxes, child starts, child ends) from leaf level upwards
+    self.order = numpy.arange(0)
+    if len(self.boxes):
+      self.build()
+
+  def __len__(self):
+    return len(self.boxes)
+
+  def build(self):
+    self.order = self.packOrder(self.boxes)
+    current = self.boxes[self.order]
+    while True:
+      starts = numpy.arange(0, len(current), self.nodeSize)
+      ends = numpy.append(starts[1:], len(current))
+      nodes = numpy.empty((len(starts), 4))
+      nodes[:,XMIN] = numpy.minimum.reduceat(current[:,XMIN], starts)
+      nodes[:,YMIN] = numpy.minimum.reduceat(current[:,YMIN], starts)
+      nodes[:,XMAX] = numpy.maximum.reduceat(current[:,XMAX], starts)
+      nodes[:,YMAX] = numpy.maximum.reduceat(current[:,YMAX], starts)
+      if len(nodes) > 1: # pack the nodes themselves for the next level
+        perm = self.packOrder(nodes)
+        nodes, starts, ends = nodes[perm], starts[perm], ends[perm]
+      self.levels.append((nodes, starts, ends))
+      if len(nodes) == 1:
+        break
+      current = nodes
+
+  def packOrder(self, boxes):
+    '''Returns a Sort-Tile-Recursive ordering of the boxes: vertical slices by x center, sorted by y center within.'''
+    count = len(boxes)
+    xcenter = boxes[:,XMIN] + boxes[:,XMAX]
+    ycenter = boxes[:,YMIN] + boxes[:,YMAX]
+    sliceCount = int(numpy.ceil(numpy.sqrt(numpy.ceil(count / float(self.nodeSize)))))
+    sliceSize = self.nodeSize * int(numpy.ceil(count / float(self.nodeSize * sliceCount)))
+    byX = numpy.argsort(xcenter, kind='mergesort')
+    slices = numpy.empty(count, dtype=int)
+    slices[byX] = numpy.arange(count) // sliceSize
+    return numpy.lexsort((ycenter, slices))
+
+  def query(self, bbox, tolerance=0):
+    '''Returns a sorted array of indices of boxes overlapping the given window.'''
+    if not len(self.boxes):
+      return numpy.arange(0)
+    window = self.expanded(numpy.asarray(bbox, dtype=float), tolerance)
+    cands = numpy.arange(1)
+    for nodes, starts, ends in reversed(self.levels):
+      hits = cands[self.overlaps(nodes[cands], window)]
+      cands = expandRanges(starts[hits], ends[hits])
+    found = self.order[cands]
+    return numpy.sort(found[self.overlaps(self.boxes[found], window)])
+
+  def candidatePairs(self, tolerance=0):
+    '''Returns two index arrays (first, second) of all box pairs that overlap, first < second.
+
+    Descends the tree with itself, so only overlapping node pairs are ever expanded.'''
+    empty = numpy.arange(0)
+    if len(self.boxes) < 2:
+      return empty, empty
+    firsts = numpy.zeros(1, dtype=int)
+    seconds = numpy.zeros(1, dtype=int)
+    for nodes, starts, ends in reversed(self.levels):
+      keep = self.overlaps(nodes[firsts], nodes[seconds], tolerance)
+      firsts, seconds = firsts[keep], seconds[keep]
+      firsts, seconds = self.childPairs(starts, ends, firsts, seconds)
+    # now at item positions within the packed order
+    firsts, seconds = self.order[firsts], self.order[seconds]
+    keep = (firsts != seconds) & self.overlaps(self.boxes[firsts], self.boxes[seconds], tolerance)
+    firsts, seconds = firsts[keep], seconds[keep]
+    swap = firsts > seconds
+    firsts[swap], seconds[swap] = seconds[swap], firsts[swap]
+    return firsts, seconds
+
+  @staticmethod
+  def childPairs(starts, ends, firsts, seconds):
+    '''Expands node pairs to all pairs of their children. Pairs of a node with itself
+    yield only the ordered child pairs (including the child with itself except at the leaves).'''
+    firstLens = ends[firsts] - starts[firsts]
+    secondLens = ends[seconds] - starts[seconds]
+    counts = firstLens * secondLens
+    pairIndex = numpy.repeat(numpy.arange(len(counts)), counts)
+    within = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    childFirsts = starts[firsts][pairIndex] + within // secondLens[pairIndex]
+    childSeconds = starts[seconds][pairIndex] + within % secondLens[pairIndex]
+    same = (firsts == seconds)[pairIndex]
+    keep = ~same | (childFirsts <= childSeconds)
+    return childFirsts[keep], childSeconds[keep]
+
+  @staticmethod
+  def expanded(box, tolerance):
+    if tolerance:
+      box = box + numpy.array([-tolerance, -tolerance, tolerance, tolerance])
+    return box
+
+  @staticmethod
+  def overlaps(boxes, others, tolerance=0):
+    return ((boxes[...,XMIN] <= others[...,XMAX] + tolerance) &
+      (others[...,XMIN] <= boxes[...,XMAX] + tolerance) &
+      (boxes[...,YMIN] <= others[...,YMAX] + tolerance) &
+      (others[...,YMIN] <= boxes[...,YMAX] + tolerance))
+
+
+def expandRanges(starts, ends):
+  '''Returns a concatenation of ranges [starts[i], ends[i]) as a single array.'''
+  lens = ends - starts
+  return numpy.repeat(starts - numpy.cumsum(lens) + lens, lens) + numpy.arange(lens.sum())
+
+
+class PointGrid:
+  '''A dynamic point index bucketing items into square grid cells.
+
+  Items can be inserted, moved and removed at any time. Nearest neighbour queries
+  scan rings of cells outwards from the query point until no unscanned cell can hold
+  a closer item.'''
+
+  def __init__(self, cellSize):
+    self.cellSize = float(cellSize) if cellSize > 0 else 1.0
+    self.cells = {}
+    self.points = {}
+    self.bounds = None # cell range ever occupied, (colmin, rowmin, colmax, rowmax)
+
+  def __len__(self):
+    return len(self.points)
+
+  def __contains__(self, item):
+    return item in self.points
+
+  def cellOf(self, point):
+    return (int(numpy.floor(point[0] / self.cellSize)), int(numpy.floor(point[1] / self.cellSize)))
+
+  def insert(self, item, point):
+    '''Inserts the item at the given (x, y) point, moving it if already present.'''
+    if item in self.points:
+      self.remove(item)
+    point = (float(point[0]), float(point[1]))
+    cell = self.cellOf(point)
+    self.points[item] = (point, cell)
+    self.cells.setdefault(cell, {})[item] = point
+    if self.bounds is None:
+      self.bounds = cell + cell
+    else:
+      self.bounds = (min(self.bounds[0], cell[0]), min(self.bounds[1], cell[1]),
+        max(self.bounds[2], cell[0]), max(self.bounds[3], cell[1]))
+
+  def remove(self, item):
+    point, cell = self.points.pop(item)
+    items = self.cells[cell]
+    del items[item]
+    if not items:
+      del self.cells[cell]
+
+  def nearest(self, point, accept=None, key=None):
+    '''Returns the accepted item closest to the point, or None if there is none.
+    Equally distant items are decided by the smallest key, if given.'''
+    if not self.points:
+      return None
+    x, y = float(point[0]), float(point[1])
+    col, row = self.cellOf((x, y))
+    maxRing = max(col - self.bounds[0], row - self.bounds[1], self.bounds[2] - col, self.bounds[3] - row)
+    best = None
+    bestRank = None
+    for ring in xrange(max(maxRing, 0) + 1):
+      if best is not None and bestRank[0] < (self.cellSize * (ring - 1)) ** 2:
+        break # the ring lies farther than the best item (ties must be seen as well)
+      for cell in self.ringCells(col, row, ring):
+        for item, (ix, iy) in self.cells.get(cell, {}).iteritems():
+          if accept is None or accept(item):
+            rank = ((ix - x) ** 2 + (iy - y) ** 2, None if key is None else key(item))
+            if bestRank is None or rank < bestRank:
+              best, bestRank = item, rank
+    return best
+
+  @staticmethod
+  def ringCells(col, row, ring):
+    '''Yields the cells at the given Chebyshev distance from the cell (col, row).'''
+    if ring == 0:
+      yield (col, row)
+      return
+    for c in xrange(col - ring, col + ring + 1):
+      yield (c, row - ring)
+      yield (c, row + ring)
+    for r in xrange(row - ring + 1, row + ring):
+      yield (col - ring, r)
+      yield (col + ring, r)
+
+
+class TileGrid:
+  '''Square tiles covering a bounding box, numbered row by row from its lower left corner.
+
+  Every point is owned by the tile containing it (points outside the box by the nearest tile).
+  Relations found in several overlapping tiles are kept only from the tile owning their origin,
+  which deduplicates those found across tile borders.'''
+
+  def __init__(self, bbox, tileSize):
+    self.xmin, self.ymin = float(bbox[XMIN]), float(bbox[YMIN])
+    self.tileSize = float(tileSize)
+    self.xcells = max(int(numpy.ceil((bbox[XMAX] - bbox[XMIN]) / self.tileSize)), 1)
+    self.ycells = max(int(numpy.ceil((bbox[YMAX] - bbox[YMIN]) / self.tileSize)), 1)
+
+  def tileOf(self, point):
+    col = min(max(int((point[0] - self.xmin) / self.tileSize), 0), self.xcells - 1)
+    row = min(max(int((point[1] - self.ymin) / self.tileSize), 0), self.ycells - 1)
+    return row * self.xcells + col
+
+  def window(self, tile, overlap=0):
+    '''Returns the (xmin, ymin, xmax, ymax) extent of the tile widened by overlap on all sides.'''
+    xmin = self.xmin + (tile % self.xcells) * self.tileSize
+    ymin = self.ymin + (tile // self.xcells) * self.tileSize
+    return (xmin - overlap, ymin - overlap, xmin + self.tileSize + overlap, ymin + self.tileSize + overlap)
+
+  @staticmethod
+  def ownedPairs(results, owners, selfrel=True):
+    '''Merges (tile, pairs) results into a set of (from, to) pairs found by the tile owning from.'''
+    pairs = set()
+    for tile, tilePairs in results:
+      for fromID, toID in tilePairs:
+        if owners.get(fromID) == tile and (selfrel or fromID != toID):
+          pairs.add((fromID, toID))
+    return pairs
@@ -0,0 +1,291 @@
+'''Checks the queue driven aggregation of StaticAggregationRegionaliser against the walk over a re-sorted region list and its region lookups against scans of the list. Needs arcpy (imported by objects).'''
+import os, sys, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+  import objects
+except ImportError:
+  objects = None
+
+FIXTURE_COUNT = 300
+WALK_COUNT = 300
+ALLOCATION_COUNT = 300
+UNIT_IDS = ['A', 'A1', 'B', '', None]
+
+class KeyedRegion:
+  '''Carries the masses and ID the aggregation queue orders by.'''
+  def __init__(self, id, mass, secondaryMass):
+    self.id = id
+    self.mass = mass
+    self.secondaryMass = secondaryMass
+
+  def getID(self):
+    return self.id
+
+  def getMass(self):
+    return self.mass
+
+  def getSecondaryMass(self):
+    return self.secondaryMass
+
+if objects is not None:
+  class ThresholdMixin:
+    '''Verifies regions by a plain main mass threshold and logs the merges.'''
+    def verify(self, region):
+      return region.getMass() >= self.threshold
+
+    def verifyTogether(self, units):
+      return sum(unit.getMass() for unit in units) >= self.threshold
+
+    def assignRegion(self, region, searchFx):
+      tgt = objects.StaticAggregationRegionaliser.assignRegion(self, region, searchFx)
+      if tgt is not None:
+        self.merges.append((region.getID(), tgt.getID(), tgt.getMass()))
+      return tgt
+
+  class QueueRegionaliser(ThresholdMixin, objects.StaticAggregationRegionaliser):
+    pass
+
+  class ListWalkRegionaliser(ThresholdMixin, objects.StaticAggregationRegionaliser):
+    '''Walks the region list sorted by mass, re-sorting it after every merge.'''
+    def aggregate(self, locationFallback=False):
+      if locationFallback: self.leaks = []
+      self.sortByMass(self.regions)
+      i = 0
+      while i < len(self.regions):
+        region = self.regions[i]
+        if not (self.verify(region) or self.handleZero(region)):
+          tgt = self.assignRegion(region, self.targetByNeighbourhood)
+          if tgt is None and self.rigidUnitExhausted(region):
+            self.exhausted.append(region)
+            region.setOverride()
+          elif tgt is None and locationFallback:
+            tgt = self.assignRegion(region, self.targetByLocation)
+            if tgt is None:
+              region.setOverride()
+          elif tgt is None:
+            self.leaks.append(region)
+          if tgt is not None:
+            self.removeRegion(region)
+            i -= 2 if self.needsRecheck(region, tgt) else 1
+            self.sortByMass(self.regions)
+        i += 1
+      self.dropZeros()
+
+  class ScanningRegionaliser(QueueRegionaliser):
+    '''Looks for other regions of the rigid unit in the whole region list.'''
+    def rigidUnitExhausted(self, region):
+      regUnit = region.getRigidUnit()
+      for compReg in self.regions:
+        if compReg.getRigidUnit() is regUnit and compReg is not region:
+          return False
+      return True
+
+  class LocationScanRegionaliser(QueueRegionaliser):
+    '''Measures the distance to every candidate in the region list, equal distances decided by mass.'''
+    def targetByLocation(self, region, crossFlexible=False):
+      rigidUnit = region.getRigidUnit()
+      flexUnit = region.getFlexibleUnit()
+      candidates = [cand for cand in self.regions if cand.getRigidUnit() is rigidUnit
+        and (crossFlexible or cand.getFlexibleUnit() is flexUnit) and cand is not region]
+      if candidates:
+        return min(candidates, key=lambda cand: (region.distanceTo(cand), objects.AggregationQueue.keyOf(cand)))
+      else:
+        return None
+
+def createFixture(seed, cls, missing=0):
+  '''Creates a regionaliser of single zone regions on a partially linked grid split into rigid and flexible units.
+  Locations of the given share of zones are missing.'''
+  rnd = random.Random(seed)
+  size = rnd.randint(3, 9)
+  zones = []
+  for i in range(size ** 2):
+    x, y = i % size, i // size
+    mass = rnd.choice([0, 0, 0, 1, 2, 3, 5, 8, rnd.randint(0, 50)])
+    rigid = 'R{}'.format(x * 3 // size + 3 * (y * 2 // size))
+    location = (rnd.randint(0, 10 ** 6), rnd.randint(0, 10 ** 6))
+    if missing and rnd.random() < missing:
+      location = None
+    zones.append(objects.NoFlowZone(str(i), mass, rnd.choice([None, 0, 1, 2]), rigid, 'F{}'.format(x // 2), location))
+  for i, zone in enumerate(zones):
+    right = i + 1 if i % size < size - 1 else None
+    down = i + size if i < size * (size - 1) else None
+    for j in (right, down):
+      if j is not None and rnd.random() < 0.8:
+        zone.getNeighbours().add(zones[j])
+        zones[j].getNeighbours().add(zone)
+  regionaliser = cls(dict((zone.getID(), zone) for zone in zones))
+  regionaliser.createRegions()
+  regionaliser.threshold = rnd.choice([5, 10, 20, 40])
+  regionaliser.exhausted = []
+  regionaliser.leaks = []
+  regionaliser.merges = []
+  return regionaliser
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class AggregationTest(unittest.TestCase):
+  def state(self, regionaliser):
+    regions = sorted((region.getID(), sorted(zone.getID() for zone in region.getZones())) for region in regionaliser.getRegions())
+    return (regionaliser.merges, regions,
+      [region.getID() for region in regionaliser.exhausted], [region.getID() for region in regionaliser.leaks])
+
+  def testSameMerges(self):
+    for seed in range(FIXTURE_COUNT):
+      fallback = seed % 2
+      walked = createFixture(seed, ListWalkRegionaliser)
+      queued = createFixture(seed, QueueRegionaliser)
+      for regionaliser in (walked, queued):
+        regionaliser.aggregate()
+        if fallback:
+          regionaliser.aggregate(True)
+      self.assertEqual(self.state(queued), self.state(walked))
+
+  def testUnitRegions(self):
+    '''Checks the regions of the administrative units against the region list and the exhaustion of rigid units
+    against the scan of the list, merging through the units and the list scan the same.'''
+    for seed in range(FIXTURE_COUNT):
+      scanned = createFixture(seed, ScanningRegionaliser)
+      queued = createFixture(seed, QueueRegionaliser)
+      for regionaliser in (scanned, queued):
+        regionaliser.aggregate()
+        regionaliser.aggregate(True)
+        for unit in regionaliser.rigidUnits + regionaliser.flexibleUnits:
+          self.assertEqual(unit.getRegions(), set(region for region in regionaliser.getRegions()
+            if unit in (region.getRigidUnit(), region.getFlexibleUnit())))
+      self.assertEqual(self.state(queued), self.state(scanned))
+
+  def testSameNearest(self):
+    '''Merges leaks into the nearest region found through the location grids of the units and by the list scan.'''
+    for seed in range(FIXTURE_COUNT):
+      scanned = createFixture(seed, LocationScanRegionaliser)
+      queued = createFixture(seed, QueueRegionaliser)
+      for regionaliser in (scanned, queued):
+        regionaliser.aggregate()
+        regionaliser.aggregate(True)
+      self.assertEqual(self.state(queued), self.state(scanned))
+
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class LocationIndexTest(unittest.TestCase):
+  def testSameAsScan(self):
+    '''Queries the nearest regions between random merges that move the target regions.'''
+    for seed in range(FIXTURE_COUNT // 5):
+      rnd = random.Random(seed)
+      regionaliser = createFixture(seed, QueueRegionaliser)
+      while len(regionaliser.regions) > 1:
+        region = rnd.choice(regionaliser.regions)
+        for crossFlexible in (False, True):
+          self.assertIs(regionaliser.targetByLocation(region, crossFlexible),
+            LocationScanRegionaliser.targetByLocation.im_func(regionaliser, region, crossFlexible))
+        others = [other for other in regionaliser.regions if other is not region and other.getRigidUnit() is region.getRigidUnit()]
+        if others:
+          target = rnd.choice(others)
+          for ass in region.getAssignments():
+            objects.SimpleAssignment(ass.getZone(), target).tangle()
+        region.erase()
+        regionaliser.removeRegion(region)
+
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class RegionLocationTest(unittest.TestCase):
+  def check(self, region):
+    '''Compares the region location with the mean location of its zones computed afresh.'''
+    locations = [zone.getLocation() for zone in region.getZones() if zone.getLocation() is not None]
+    for coord in range(2):
+      expected = sum(float(loc[coord]) for loc in locations) / max(len(locations), 1)
+      self.assertAlmostEqual(region.getLocation()[coord], expected, places=6)
+
+  def testSameAsZoneMean(self):
+    '''Moves single zones and merges whole regions at random, some zones without a location.'''
+    for seed in range(FIXTURE_COUNT // 5):
+      rnd = random.Random(seed)
+      regionaliser = createFixture(seed, QueueRegionaliser, missing=0.2)
+      while len(regionaliser.regions) > 1:
+        region, target = rnd.sample(regionaliser.regions, 2)
+        if len(region.getZones()) > 1 and rnd.random() < 0.5:
+          zone = rnd.choice(list(region.getZones()))
+          zone.deassign()
+          objects.SimpleAssignment(zone, target).tangle()
+          self.check(region)
+        else:
+          for ass in region.getAssignments():
+            objects.SimpleAssignment(ass.getZone(), target).tangle()
+          region.erase()
+          regionaliser.removeRegion(region)
+        self.check(target)
+        self.assertAlmostEqual(region.distanceTo(target), sum((region.getLocation() - target.getLocation()) ** 2) ** 0.5, places=6)
+
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class AggregationQueueTest(unittest.TestCase):
+  def testSameWalk(self):
+    '''Replays random advances and merges, some with a step back, on a list re-sorted by index arithmetic.'''
+    wraps = 0
+    for seed in range(WALK_COUNT):
+      rnd = random.Random(seed)
+      regions = [KeyedRegion(str(i), rnd.choice([0, 1, 2, rnd.randint(0, 50)]), rnd.choice([None, 0, 1]))
+        for i in range(rnd.randint(1, 30))]
+      walk = sorted(regions, key=objects.AggregationQueue.keyOf)
+      queue = objects.AggregationQueue(regions)
+      i = 0
+      while i < len(walk):
+        self.assertIs(queue.current, walk[i])
+        if len(walk) > 1 and rnd.random() < 0.4:
+          region = walk.pop(i)
+          target = rnd.choice(walk)
+          target.mass += region.mass
+          recheck = rnd.random() < 0.3 and i > -len(walk)
+          walk.sort(key=objects.AggregationQueue.keyOf)
+          i -= 2 if recheck else 1
+          wraps += (i < 0)
+          queue.merged(target, recheck)
+        else:
+          queue.advance()
+        i += 1
+      self.assertIs(queue.current, None)
+    self.assertTrue(wraps)
+
+
+def scanRegions(regions, regID):
+  '''Finds the first region with the given ID by walking the region list.'''
+  for region in regions:
+    if region.getID() == regID:
+      return region
+  return None
+
+def scanUnusedID(regions, unitID, formatter):
+  '''Returns the unit ID with the smallest suffix not used by any region, trying the suffixes one by one.'''
+  i = 1
+  while scanRegions(regions, unitID + formatter.format(i)):
+    i += 1
+  return unitID + formatter.format(i)
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class SuffixAllocationTest(unittest.TestCase):
+  def testSameAsScan(self):
+    '''Replays random region additions, removals and ID allocations, with unit IDs prefixing each other.'''
+    for seed in range(ALLOCATION_COUNT):
+      rnd = random.Random(seed)
+      regionaliser = objects.StaticAggregationRegionaliser({})
+      regionaliser.calculateOutputIDs(rnd.choice([2, 10, 50, 500]))
+      regionaliser.regions = []
+      regionaliser.regionIndex = {}
+      regionaliser.suffixes = {}
+      for i in range(rnd.randint(1, 200)):
+        unitID = rnd.choice(UNIT_IDS)
+        action = rnd.random()
+        if action < 0.5:
+          unused = regionaliser.getUnusedID(KeyedRegion(unitID, 0, None))
+          self.assertEqual(unused, scanUnusedID(regionaliser.regions, unitID or '', regionaliser.formatter))
+          if rnd.random() < 0.8:
+            regionaliser.addRegion(KeyedRegion(unused, 0, None))
+        elif action < 0.7: # given IDs, some repeated
+          regionaliser.addRegion(KeyedRegion((unitID or '') + regionaliser.formatter.format(rnd.randint(1, 12)), 0, None))
+        elif regionaliser.regions:
+          regionaliser.removeRegion(rnd.choice(regionaliser.regions))
+        regID = (unitID or '') + regionaliser.formatter.format(rnd.randint(1, 12))
+        self.assertIs(regionaliser.findRegion(regID), scanRegions(regionaliser.regions, regID))
+
+
+if __name__ == '__main__':
+  unittest.main()
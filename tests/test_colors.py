@@ -0,0 +1,80 @@
+'''Checks the heap driven heuristic coloring against repeated stable re-sorts and the array color mixers against the item ones.'''
+import os, sys, random, tempfile, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import colors
+
+GRAPH_COUNT = 2000
+MIX_COUNT = 200
+COLORS = ['ff0000', '00ff00', '0000ff', 'ffff00']
+
+class ResortingChooser(colors.ColorChooser):
+  '''Picks the most urgent zone by re-sorting the uncolored zones after every coloring.'''
+  def colorHeuristically(self, shuffle=True):
+    uncolored = list(self.zones.values())
+    while uncolored:
+      uncolored.sort(key=self.sortFx)
+      now = uncolored.pop()
+      now.colorWithFirst(self.colors, shuffle=shuffle)
+    for zone in self.zones.itervalues():
+      zone.colorIfNot(self.WHITE)
+    return self.zones
+
+class HeuristicColoringTest(unittest.TestCase):
+  def setUp(self):
+    handle, self.colorFile = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(handle, 'w') as file:
+      file.write('\n'.join(COLORS) + '\n')
+
+  def tearDown(self):
+    os.remove(self.colorFile)
+
+  def createNeighbourhood(self, seed):
+    '''Creates a random neighbourhood, mostly symmetric, with some repeated neighbours and self-neighbours.'''
+    rnd = random.Random(seed)
+    count = rnd.randint(1, 60)
+    density = rnd.random() * 0.3
+    symmetric = rnd.random() < 0.7
+    neighs = dict((i, []) for i in range(count))
+    for i in range(count):
+      for j in range(count):
+        if i != j and rnd.random() < density:
+          neighs[i].append(j)
+          if rnd.random() < 0.2: neighs[i].append(j)
+          if rnd.random() < 0.05: neighs[i].append(i)
+          if symmetric and i not in neighs[j]: neighs[j].append(i)
+    return neighs
+
+  def testSameAsResorting(self):
+    for seed in range(GRAPH_COUNT):
+      neighs = self.createNeighbourhood(seed)
+      heaped = colors.ColorChooser(neighs, self.colorFile).colorHeuristically(shuffle=False)
+      resorted = ResortingChooser(neighs, self.colorFile).colorHeuristically(shuffle=False)
+      self.assertEqual(dict((id, zone.getColor()) for id, zone in heaped.items()),
+        dict((id, zone.getColor()) for id, zone in resorted.items()))
+
+
+class ColorMixerTest(unittest.TestCase):
+  def testArraySameAsItems(self):
+    '''Mixes random colors by degree matrices with some all-zero rows both ways.'''
+    rnd = random.Random(36)
+    for i in range(MIX_COUNT):
+      count = rnd.randint(1, 5)
+      rgbs = [[rnd.randint(0, colors.MAX_VALUE) for j in range(3)] for k in range(count)]
+      degrees = []
+      for row in range(rnd.randint(1, 6)):
+        if rnd.random() < 0.3:
+          degrees.append([0.0] * count)
+        else:
+          weights = [rnd.random() for k in range(count)]
+          degrees.append([weight / sum(weights) * rnd.random() for weight in weights])
+      for name, mixer in colors.COLOR_MIXERS.items():
+        mixed = mixer(rgbs, degrees)
+        for row, rowDegrees in enumerate(degrees):
+          expected = mixer(list(zip(rgbs, rowDegrees)))
+          for j in range(3):
+            self.assertAlmostEqual(mixed[row][j], expected[j], places=6, msg=name)
+
+
+if __name__ == '__main__':
+  unittest.main()
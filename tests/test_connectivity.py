@@ -0,0 +1,82 @@
+'''Checks the connectivity index answers of isOnlyConnection against the scan of separated subtrees. Needs arcpy (imported by objects).'''
+import os, sys, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+  import objects
+except ImportError:
+  objects = None
+
+GRID_SIZE = 7
+FIXTURE_COUNT = 40
+
+def scanSubtrees(assignment, diffZone):
+  '''Tells whether diffZone separates the assignment zone from all region cores by scanning the separated subtrees.'''
+  region = assignment.getRegion()
+  artic = region.getArticulation(diffZone)
+  if artic:
+    cores = len(region.getCoreZones())
+    myZone = False
+    for subtree in artic:
+      coreZone = False
+      for zone in subtree:
+        if zone == assignment.getZone():
+          myZone = True
+        elif zone.getCore():
+          coreZone = True
+      if myZone:
+        return (not coreZone)
+      elif coreZone:
+        cores -= 1
+        if cores == 0: return True
+    return False
+  else:
+    return False
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class ConnectivityIndexTest(unittest.TestCase):
+  def createRegions(self, seed):
+    '''Creates regions with several cores on a partially linked zone grid.'''
+    rnd = random.Random(seed)
+    zones = [objects.MonoZone(str(i), mass=rnd.randint(1, 100)) for i in range(GRID_SIZE ** 2)]
+    for i, zone in enumerate(zones):
+      right = i + 1 if i % GRID_SIZE < GRID_SIZE - 1 else None
+      down = i + GRID_SIZE if i < GRID_SIZE * (GRID_SIZE - 1) else None
+      for j in (right, down):
+        if j is not None and rnd.random() < 0.85:
+          zone.addNeighbour(zones[j])
+          zones[j].addNeighbour(zone)
+    free = list(zones)
+    rnd.shuffle(free)
+    regions = [objects.FunctionalRegion(free.pop()) for i in range(rnd.randint(1, 3))]
+    for zone in free:
+      if rnd.random() < 0.9:
+        objects.Assignment(zone, rnd.choice(regions), core=(rnd.random() < 0.15)).tangle()
+    return regions
+
+  def check(self, region):
+    '''Compares both answers for all zone pairs within the region, returns the number of separating ones.'''
+    separating = 0
+    for ass in region.getAssignments():
+      for diffZone in ass.getZone().getNeighbours():
+        if diffZone.isInRegion(region):
+          expected = scanSubtrees(ass, diffZone)
+          self.assertEqual(ass.isOnlyConnection(diffZone), expected)
+          separating += expected
+    return separating
+
+  def testSameAsSubtreeScan(self):
+    separating = 0
+    for seed in range(FIXTURE_COUNT):
+      rnd = random.Random(seed)
+      for region in self.createRegions(seed):
+        separating += self.check(region)
+        hinterland = [ass for ass in region.getAssignments() if not ass.isCore()]
+        for ass in rnd.sample(hinterland, min(3, len(hinterland))): # the index must follow the changes
+          ass.erase()
+        separating += self.check(region)
+    self.assertTrue(separating)
+
+
+if __name__ == '__main__':
+  unittest.main()
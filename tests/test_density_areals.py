@@ -0,0 +1,93 @@
+'''Checks the density areals delimited on a zone graph against those delimited on zone objects. Needs arcpy (imported by common).'''
+import os, sys, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy
+
+try:
+  import delimit_density_areals, graph, regional
+except ImportError:
+  delimit_density_areals = None
+
+FIXTURE_COUNT = 150
+
+if delimit_density_areals is not None:
+  class OnceEnclaveAreal(delimit_density_areals.DensityAreal):
+    '''Binds every enclave zone once; DensityAreal.includeEnclaves binds a zone once per
+    unassigned neighbour leading to its pocket and counts its mass that many times.'''
+    def includeEnclaves(self):
+      for zone in self.enclaveZones():
+        self.bind(zone)
+
+def objectRegionalize(zones, thrDens, minPop, doMergeEnclaves):
+  '''Follows regionalize() on the zone objects, growing the areals in the order of their seed zones.'''
+  areals = [OnceEnclaveAreal(zone) for zone in zones if zone.get('dens') >= thrDens]
+  absorbed = set()
+  for areal in areals:
+    if areal in absorbed:
+      continue
+    while True:
+      nextZone = areal.getNextZone(doMergeEnclaves)
+      if nextZone is None:
+        break
+      elif nextZone.isAssigned():
+        other = nextZone.getRegion()
+        absorbed.add(other)
+        areal.merge(other)
+      elif areal.isAccepted(nextZone, thrDens):
+        areal.bind(nextZone)
+        if doMergeEnclaves:
+          areal.includeEnclaves()
+      else:
+        break
+  delimit_density_areals.mergeAdjacent(areals)
+  delimit_density_areals.eraseSmall(areals, minPop)
+  for areal in areals:
+    if areal:
+      areal.relabel()
+
+
+@unittest.skipIf(delimit_density_areals is None, 'arcpy not available')
+class GraphArealsTest(unittest.TestCase):
+  def createZones(self, rnd):
+    '''Creates zones on a partially linked grid with distinct densities and masses, the border touching the exterior.'''
+    size = rnd.randint(2, 12)
+    masses = rnd.sample(xrange(1, 100 * size ** 2), size ** 2)
+    zones = [delimit_density_areals.DensityZone(i, mass=masses[i], area=rnd.uniform(0.5, 2.0)) for i in range(size ** 2)]
+    for i, zone in enumerate(zones):
+      x, y = i % size, i // size
+      if x in (0, size - 1) or y in (0, size - 1):
+        zone.addNeighbour(regional.exterior)
+      for j in (i + 1 if x < size - 1 else None, i + size if y < size - 1 else None):
+        if j is not None and rnd.random() < 0.85:
+          zone.addNeighbour(zones[j])
+          zones[j].addNeighbour(zone)
+    return zones
+
+  def testSameAsObjects(self):
+    rnd = random.Random(30)
+    for i in range(FIXTURE_COUNT):
+      zones = self.createZones(rnd)
+      densities = sorted(zone.get('dens') for zone in zones)
+      thrDens = densities[int(len(densities) * rnd.uniform(0.4, 0.95))]
+      minPop = rnd.choice([0, 0, 500, 2000])
+      doMergeEnclaves = rnd.random() < 0.7
+      zoneGraph = graph.ZoneGraph.fromRows([{'id' : zone.getID(), 'mass' : zone.get('mass'), 'area' : zone.get('area')} for zone in zones])
+      zoneGraph.readRelations(zones, interactions=False)
+      labels = delimit_density_areals.regionalizeGraph(zoneGraph, numpy.zeros(len(zones), dtype=numpy.int64),
+        thrDens, minPop, doMergeEnclaves)
+      objectRegionalize(zones, thrDens, minPop, doMergeEnclaves)
+      self.assertEqual(labels.tolist(), [-1 if zone.getRegionID() is None else zone.getRegionID() for zone in zones])
+
+
+@unittest.skipIf(delimit_density_areals is None, 'arcpy not available')
+class NeighbourhoodTest(unittest.TestCase):
+  def testDroppedPairs(self):
+    zoneGraph = graph.ZoneGraph.fromRows([{'id' : id} for id in (10, 20, 30)])
+    counts = zoneGraph.setNeighbourhood([10, 10, 20, 20, 30, 40, 30], [20, 10, 30, -1, 30, 10, 50], -1)
+    self.assertEqual(counts, (2, 2))
+    self.assertEqual(zoneGraph.neighIndptr.tolist(), [0, 1, 3, 3])
+    self.assertEqual(zoneGraph.neighIndices.tolist(), [1, graph.EXTERIOR, 2])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,120 @@
+'''Checks the vectorized region statistics of dissolve_regions against the loop over zone records and the streamed region records. Needs arcpy (imported by dissolve_regions).'''
+import os, sys, random, collections, itertools, operator, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+  import dissolve_regions
+except ImportError:
+  dissolve_regions = None
+
+FIXTURE_COUNT = 300
+NAMES = ['Praha', 'Brno', 'Plzen', 'Most', 'Cheb', 7, 12]
+
+def loopStatistics(zoneData, regTransFlds, nameFlds, sumCoreFlds, countCores, sumAllFlds, countAll):
+  '''Computes the region statistics zone by zone from an ordered dict of zone records.'''
+  coreTransItems = [(fld, 'CORE_' + fld) for fld in sumCoreFlds]
+  allTransItems = [(fld, 'ALL_' + fld) for fld in sumAllFlds]
+  regionData = {}
+  for zoneDict in zoneData.itervalues():
+    id = zoneDict['id']
+    regID = zoneDict['assign']
+    if regID is None:
+      continue
+    if regID not in regionData:
+      regionData[regID] = {'id' : regID, 'coreids' : []}
+      for fld, outFld in coreTransItems + allTransItems:
+        regionData[regID][outFld] = 0
+      for fld in regTransFlds:
+        regionData[regID][fld] = None
+      if countCores:
+        regionData[regID]['CORE_COUNT'] = 0
+      if countAll:
+        regionData[regID]['ALL_COUNT'] = 0
+    myreg = regionData[regID]
+    if id == regID:
+      for mainFld in regTransFlds:
+        myreg[mainFld] = zoneDict[mainFld]
+    if id == regID or zoneDict.get('core') == regID:
+      myreg['coreids'].append(id)
+      for coreFld, outCoreFld in coreTransItems:
+        myreg[outCoreFld] += zoneDict[coreFld]
+      if countCores:
+        myreg['CORE_COUNT'] += 1
+    for allFld, outAllFld in allTransItems:
+      myreg[outAllFld] += zoneDict[allFld]
+    if countAll:
+      myreg['ALL_COUNT'] += 1
+  for regDict in regionData.itervalues():
+    coreIDs = regDict.pop('coreids')
+    if regDict['id'] in coreIDs:
+      coreIDs.remove(regDict['id'])
+      coreIDs.insert(0, regDict['id'])
+    for nameFld in nameFlds:
+      regDict[nameFld] = u'-'.join(unicode(str(zoneData[coreID][nameFld]), 'utf8') for coreID in coreIDs)
+  return regionData
+
+
+@unittest.skipIf(dissolve_regions is None, 'arcpy not available')
+class RegionStatisticsTest(unittest.TestCase):
+  def setUp(self):
+    self.readColumns = dissolve_regions.readColumns
+    dissolve_regions.readColumns = self.readRows
+
+  def tearDown(self):
+    dissolve_regions.readColumns = self.readColumns
+
+  def readRows(self, layer, fields, where=None):
+    '''Reads the fixture rows of assigned zones instead of the layer.'''
+    rows = [row for row in self.rows if row['REG'] is not None]
+    return {fld : [row[fld] for row in rows] for fld in fields}
+
+  def createRows(self, rnd):
+    count = rnd.randint(1, 60)
+    ids = rnd.sample(xrange(1, 1000), count)
+    regIDs = rnd.sample(ids, rnd.randint(1, min(count, 8))) + [rnd.randint(1000, 1010)] # one without a main core
+    rows = []
+    for id in ids:
+      regID = id if id in regIDs else rnd.choice(regIDs + [None])
+      rows.append({'ID' : id, 'REG' : regID, 'COOP' : rnd.choice([None, None, regID, rnd.choice(regIDs)]),
+        'NAME' : rnd.choice(NAMES), 'CODE' : rnd.randint(0, 99), 'POP' : rnd.randint(0, 5000), 'AREA' : rnd.randint(1, 400) * 0.25})
+    return rows
+
+  def testSameAsLoop(self):
+    rnd = random.Random(31)
+    for i in range(FIXTURE_COUNT):
+      self.rows = self.createRows(rnd)
+      coopFld = rnd.choice([None, 'COOP'])
+      sumCoreFlds = rnd.sample(['POP', 'AREA'], rnd.randint(0, 2))
+      sumAllFlds = rnd.sample(['POP', 'AREA'], rnd.randint(0, 2))
+      countCores, countAll = rnd.random() < 0.5, rnd.random() < 0.5
+      zoneData = collections.OrderedDict()
+      for row in self.rows:
+        zoneData[row['ID']] = dict(row, id=row['ID'], assign=row['REG'], core=(row['COOP'] if coopFld else None))
+      expected = loopStatistics(zoneData, ['CODE'], ['NAME'], sumCoreFlds, countCores, sumAllFlds, countAll)
+      self.assertEqual(dissolve_regions.regionStatistics(None, 'ID', 'REG', coopFld, ['CODE'], ['NAME'],
+        sumCoreFlds, countCores, sumAllFlds, countAll), expected)
+
+  def testStreamingSameAsBatch(self):
+    '''Computes the region records from zones grouped by region as the streaming dissolve reads them.'''
+    rnd = random.Random(33)
+    fields = ['ID', 'REG', 'COOP', 'NAME', 'CODE', 'POP', 'AREA']
+    index = {fld : i for i, fld in enumerate(fields)}
+    for i in range(FIXTURE_COUNT):
+      self.rows = self.createRows(rnd)
+      coopFld = rnd.choice([None, 'COOP'])
+      sumCoreFlds = rnd.sample(['POP', 'AREA'], rnd.randint(0, 2))
+      sumAllFlds = rnd.sample(['POP', 'AREA'], rnd.randint(0, 2))
+      countCores, countAll = rnd.random() < 0.5, rnd.random() < 0.5
+      expected = dissolve_regions.regionStatistics(None, 'ID', 'REG', coopFld, ['CODE'], ['NAME'],
+        sumCoreFlds, countCores, sumAllFlds, countAll)
+      assigned = sorted((row for row in self.rows if row['REG'] is not None), key=operator.itemgetter('REG'))
+      streamed = {}
+      for regID, rows in itertools.groupby([tuple(row[fld] for fld in fields) for row in assigned], operator.itemgetter(1)):
+        streamed[regID] = dissolve_regions.regionRecord(regID, list(rows), index, 'ID', coopFld, ['CODE'], ['NAME'],
+          sumCoreFlds, countCores, sumAllFlds, countAll)
+        streamed[regID]['id'] = regID
+      self.assertEqual(streamed, expected)
+
+
+if __name__ == '__main__':
+  unittest.main()
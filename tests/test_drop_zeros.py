@@ -0,0 +1,92 @@
+'''Checks the zero weight zone drops of StaticAggregationRegionaliser against a zone by zone procedure. Needs arcpy (imported by objects).'''
+import os, sys, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+  import objects
+except ImportError:
+  objects = None
+
+FIXTURE_COUNT = 150
+
+def countParts(zones):
+  '''Returns the number of contiguous parts of the zones.'''
+  inside = set(zones)
+  reached = set()
+  count = 0
+  for start in zones:
+    if start not in reached:
+      count += 1
+      reached.add(start)
+      stack = [start]
+      while stack:
+        for neigh in stack.pop().getNeighbours():
+          if neigh in inside and neigh not in reached:
+            reached.add(neigh)
+            stack.append(neigh)
+  return count
+
+if objects is not None:
+  class SequentialRegionaliser(objects.StaticAggregationRegionaliser):
+    '''Drops zero weight zones one by one, counting the contiguous parts of the region anew for every zone.'''
+    def dropZeroZonesFrom(self, region):
+      zeros = [zone for zone in region.getZones() if self.hasZeroWeight(zone)]
+      self.sortByMass(zeros)
+      while zeros:
+        zero = zeros.pop()
+        zones = region.getZones()
+        if countParts([zone for zone in zones if zone is not zero]) <= countParts(zones):
+          unused = self.getUnusedID(zero.getRigidUnit())
+          zero.deassign()
+          self.addRegion(objects.StaticRegion(zero, unused))
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class DropZerosTest(unittest.TestCase):
+  def createFixture(self, seed, cls):
+    '''Creates a regionaliser of a partially linked zone grid with many zero weight zones,
+    merged into blocks of regions.'''
+    rnd = random.Random(seed)
+    size = rnd.randint(3, 9)
+    zones = []
+    for i in range(size ** 2):
+      mass = rnd.choice([0, 0, 0, 1, 5])
+      zones.append(objects.NoFlowZone(str(i), mass, rnd.choice([None, 0, 0, 1]), 'R', 'F', (i % size, i // size)))
+    for i, zone in enumerate(zones):
+      right = i + 1 if i % size < size - 1 else None
+      down = i + size if i < size * (size - 1) else None
+      for j in (right, down):
+        if j is not None and rnd.random() < 0.85:
+          zone.getNeighbours().add(zones[j])
+          zones[j].getNeighbours().add(zone)
+    regionaliser = cls(dict((zone.getID(), zone) for zone in zones))
+    regionaliser.createRegions()
+    blocks = {}
+    for i, zone in enumerate(zones): # merge into a block region by grid position
+      block = (i % size) * 2 // size + 2 * ((i // size) * 2 // size)
+      if block in blocks:
+        region = zone.getRegion()
+        objects.SimpleAssignment(zone, blocks[block]).tangle()
+        region.erase()
+        regionaliser.removeRegion(region)
+      else:
+        blocks[block] = zone.getRegion()
+    return regionaliser
+
+  def state(self, regionaliser):
+    return sorted((region.getID(), sorted(zone.getID() for zone in region.getZones())) for region in regionaliser.getRegions())
+
+  def testSameAsSequential(self):
+    dropped = 0
+    for seed in range(FIXTURE_COUNT):
+      batched = self.createFixture(seed, objects.StaticAggregationRegionaliser)
+      sequential = self.createFixture(seed, SequentialRegionaliser)
+      before = len(batched.getRegions())
+      batched.dropZeros()
+      sequential.dropZeros()
+      self.assertEqual(self.state(batched), self.state(sequential))
+      dropped += len(batched.getRegions()) - before
+    self.assertTrue(dropped)
+
+
+if __name__ == '__main__':
+  unittest.main()
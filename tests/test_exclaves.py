@@ -0,0 +1,66 @@
+'''Checks the exclave search of FunctionalRegionaliser against the per region search. Needs arcpy (imported by objects).'''
+import os, sys, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+  import objects
+except ImportError:
+  objects = None
+
+GRID_SIZE = 7
+FIXTURE_COUNT = 30
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class ExclaveSearchTest(unittest.TestCase):
+  def createFixture(self, seed):
+    '''Creates a regionaliser of a partially linked zone grid with several regions assigned at random.'''
+    rnd = random.Random(seed)
+    zones = [objects.MonoZone(str(i), mass=rnd.randint(1, 100)) for i in range(GRID_SIZE ** 2)]
+    for i, zone in enumerate(zones):
+      right = i + 1 if i % GRID_SIZE < GRID_SIZE - 1 else None
+      down = i + GRID_SIZE if i < GRID_SIZE * (GRID_SIZE - 1) else None
+      for j in (right, down):
+        if j is not None and rnd.random() < 0.8:
+          zone.addNeighbour(zones[j])
+          zones[j].addNeighbour(zone)
+    regionaliser = objects.FunctionalRegionaliser(dict((zone.getID(), zone) for zone in zones))
+    free = list(zones)
+    rnd.shuffle(free)
+    for i in range(rnd.randint(2, 5)):
+      regionaliser.addRegion(objects.FunctionalRegion(free.pop()))
+    for zone in free:
+      if rnd.random() < 0.8:
+        objects.Assignment(zone, rnd.choice(regionaliser.getRegions()), core=(rnd.random() < 0.1)).tangle()
+    return regionaliser
+
+  def perRegion(self, regionaliser):
+    for region in regionaliser.getRegions():
+      for ass in region.getAssignments():
+        ass.setExclave(False)
+    for region in regionaliser.getRegions():
+      region.detectExclaves()
+    return dict((region, sorted(zone.getID() for zone in region.getExclaves())) for region in regionaliser.getRegions())
+
+  def testSameAsPerRegion(self):
+    for seed in range(FIXTURE_COUNT):
+      regionaliser = self.createFixture(seed)
+      found = regionaliser.detectExclaves()
+      marked = dict((region, sorted(zone.getID() for zone in region.getExclaves())) for region in regionaliser.getRegions())
+      self.assertEqual(dict((region, sorted(zone.getID() for zone in zones)) for region, zones in found.items()), marked)
+      self.assertEqual(marked, self.perRegion(regionaliser))
+
+  def testStaleMarksCleared(self):
+    regionaliser = self.createFixture(0)
+    expected = self.perRegion(regionaliser)
+    for region in regionaliser.getRegions():
+      for ass in region.getAssignments():
+        ass.setExclave(True)
+    regionaliser.postRun()
+    for region in regionaliser.getRegions():
+      self.assertEqual(sorted(zone.getID() for zone in region.getExclaves()), expected[region])
+    for zone in regionaliser.getZones():
+      self.assertEqual(zone.getExclaveFlag(), 1 if zone.isExclave() else 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
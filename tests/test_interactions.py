@@ -0,0 +1,191 @@
+'''Checks that SparseInteractions provides the mapping methods and regional aggregation of Interactions, the InteractionVector arithmetic and the significant flow selection. Needs arcpy (imported by objects).'''
+import os, sys, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+  import objects, graph
+except ImportError:
+  objects = None
+
+FLOW_FIXTURE_COUNT = 500
+
+def loopSignificant(strengths):
+  '''Selects significant flows by growing the number of expected equal flows while the residual variance falls.
+  Returns positions of the significant flows with their strengths relative to the strongest one.'''
+  maxFlow = max(strengths)
+  real = [(pos, strength / maxFlow) for pos, strength in enumerate(strengths)]
+  real.sort(key=lambda item: item[1], reverse=True)
+  expected = [0] * len(real)
+  num = 0
+  prevResVar = len(real) + 2
+  resVar = prevResVar - 1
+  while resVar < prevResVar:
+    if num == len(real): break
+    num += 1
+    factor = 1 / float(num)
+    for i in range(num):
+      expected[i] = factor
+    prevResVar = resVar
+    resVar = 0
+    for i in range(len(real)):
+      resVar += (real[i][1] - expected[i]) ** 2
+  return real[:(num-1)]
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class MappingMethodsTest(unittest.TestCase):
+  def setUp(self):
+    self.zones = [objects.MonoZone(str(i), mass=i) for i in range(5)]
+    self.strengths = {self.zones[0] : 3, self.zones[2] : 5, self.zones[4] : 1}
+
+  def fill(self, cls):
+    inter = cls()
+    for zone, strength in self.strengths.items():
+      inter[zone] = strength
+    return inter
+
+  def check(self, inter):
+    self.assertEqual(dict(zip(inter.keys(), inter.values())), self.strengths)
+    self.assertEqual(dict(inter.items()), self.strengths)
+    self.assertEqual(sorted(inter.values()), sorted(self.strengths.values()))
+
+  def testInteractions(self):
+    self.check(self.fill(objects.Interactions))
+
+  def testSparseInteractions(self):
+    self.check(self.fill(objects.SparseInteractions))
+
+  def testSparseInteractionsAfterMerge(self):
+    inter = objects.SparseInteractions() + self.fill(objects.SparseInteractions)
+    self.check(inter)
+
+  def testEmpty(self):
+    for cls in (objects.Interactions, objects.SparseInteractions):
+      inter = cls()
+      self.assertEqual((inter.keys(), inter.values(), inter.items()), ([], [], []))
+
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class RelabelTest(unittest.TestCase):
+  def setUp(self):
+    self.random = random.Random(37)
+    self.zones = [objects.MonoZone(str(i), mass=i + 1) for i in range(12)]
+    self.regions = [objects.FunctionalRegion(zone) for zone in self.zones[:3]]
+    self.assignments = {}
+    for zone in self.zones[3:9]:
+      self.assign(zone, self.random.choice(self.regions))
+
+  def assign(self, zone, region):
+    self.assignments[zone] = objects.Assignment(zone, region)
+    self.assignments[zone].tangle()
+
+  def fill(self, cls):
+    inter = cls()
+    rnd = random.Random(1)
+    for zone in self.zones:
+      inter[zone] = rnd.randint(1, 9)
+    inter[self.regions[0]] = 4
+    inter.addRaw(3)
+    return inter
+
+  def check(self, cls):
+    plain = self.fill(objects.Interactions)
+    sparse = self.fill(cls)
+    for method in ('toRegional', 'toCore'):
+      expected, result = getattr(plain, method)(), getattr(sparse, method)()
+      self.assertEqual(dict(result.items()), dict(expected.items()))
+      self.assertEqual(result.sum(), expected.sum())
+
+  def testRelabel(self):
+    self.check(objects.SparseInteractions)
+
+  def testRelabelAfterReassignment(self):
+    cls = objects.SparseInteractions.withRegistry(objects.UnitRegistry())
+    self.check(cls)
+    for zone in self.zones[3:6]: # labels found before must not be reused
+      self.assignments.pop(zone).erase()
+    self.assign(self.zones[9], self.regions[1])
+    self.assign(self.zones[3], self.regions[2])
+    self.check(cls)
+
+  def testOwnRegistry(self):
+    registry = objects.UnitRegistry()
+    cls = objects.SparseInteractions.withRegistry(registry)
+    inter = self.fill(cls)
+    self.assertEqual(len(inter), 13)
+    self.assertEqual(len(registry.units), 13) # numbered when merged into the arrays
+    self.assertEqual(dict(inter.copy().items()), dict(inter.items()))
+    self.assertTrue(isinstance(inter + inter, cls))
+    registry.reset()
+    self.assertEqual(registry.units, [])
+
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class InteractionVectorTest(unittest.TestCase):
+  def testKeepsType(self):
+    vector = objects.InteractionVector([1, 2, 3])
+    self.assertEqual(vector.dtype.kind, 'i')
+    self.assertEqual((vector + vector).dtype.kind, 'i')
+    self.assertEqual((vector / 2).tolist(), [0.5, 1.0, 1.5])
+    vector /= 4
+    self.assertIsInstance(vector, objects.InteractionVector)
+    self.assertEqual(vector.tolist(), [0.25, 0.5, 0.75])
+
+  def testMultiInteractions(self):
+    inter = objects.MultiInteractions(2)
+    zone = objects.MonoZone('0')
+    inter[zone] += objects.InteractionVector([1, 2])
+    self.assertIsInstance(inter[objects.MonoZone('1')], objects.InteractionVector)
+    self.assertEqual(inter[zone].tolist(), [1.0, 2.0])
+
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class SignificantFlowsTest(unittest.TestCase):
+  def randomStrengths(self, rnd, integer):
+    '''Creates a nonempty row of integer or float flow strengths with a positive maximum.'''
+    count = rnd.randint(1, 25)
+    if integer:
+      return [rnd.choice([0, 1, rnd.randint(1, 100)]) for i in range(count - 1)] + [rnd.randint(1, 100)]
+    else:
+      return [rnd.choice([0.0, rnd.uniform(0, 1), rnd.expovariate(0.1)]) for i in range(count - 1)] + [rnd.uniform(0.1, 10)]
+
+  def check(self, expected, positions, strengths):
+    self.assertEqual(list(positions), [pos for pos, strength in expected])
+    for result, (pos, strength) in zip(strengths, expected):
+      self.assertAlmostEqual(result, strength, places=12)
+
+  def testSameAsLoop(self):
+    '''Selects the significant flows of a CSR matrix of random rows at once and row by row.'''
+    rnd = random.Random(38)
+    for i in range(FLOW_FIXTURE_COUNT // 10):
+      integer = rnd.random() < 0.3
+      rows = [self.randomStrengths(rnd, integer) for j in range(rnd.randint(1, 30))]
+      indptr = [0]
+      for row in rows:
+        indptr.append(indptr[-1] + len(row))
+      positions, strengths = graph.significantFlows(indptr, [value for row in rows for value in row])
+      for start, row in zip(indptr, rows):
+        expected = [(pos + start, strength) for pos, strength in loopSignificant(row)]
+        count = len(expected)
+        self.check(expected, positions[:count].tolist(), strengths[:count].tolist())
+        positions, strengths = positions[count:], strengths[count:]
+      self.assertEqual(len(positions), 0)
+
+  def testInteractions(self):
+    rnd = random.Random(138)
+    zones = [objects.MonoZone(str(i)) for i in range(25)]
+    for i in range(FLOW_FIXTURE_COUNT):
+      strengths = self.randomStrengths(rnd, rnd.random() < 0.3)
+      for cls in (objects.Interactions, objects.SparseInteractions):
+        inter = cls()
+        for zone, strength in zip(zones, strengths):
+          inter[zone] = strength
+        targets = inter.keys()
+        expected = dict((targets[pos], strength) for pos, strength in loopSignificant([inter[target] for target in targets]))
+        result = dict(inter.significant().items())
+        self.assertEqual(sorted(result), sorted(expected))
+        for target in expected:
+          self.assertAlmostEqual(result[target], expected[target], places=12)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,102 @@
+'''Checks the batch zone measures of ZoneMeasurer against the zone by zone measures and the cached measures against fresh ones. Needs arcpy (imported by objects).'''
+import os, sys, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+  import objects
+except ImportError:
+  objects = None
+
+ZONE_COUNT = 40
+OUTSIDE_COUNT = 5
+FLOW_COUNT = 300
+FIXTURE_COUNT = 20
+
+def createZones(seed):
+  '''Creates zones with random flows, some of them assigned to two regions, and returns those to measure
+  (the rest receive flows but stay out of the measured list).'''
+  rnd = random.Random(seed)
+  zones = [objects.MultiZone(str(i), mass=rnd.randint(1, 100)) for i in range(ZONE_COUNT + OUTSIDE_COUNT)]
+  for i in range(FLOW_COUNT):
+    source, target = rnd.choice(zones), rnd.choice(zones)
+    strength = rnd.randint(1, 20)
+    source.addOutflow(target, strength)
+    target.addInflow(source, strength)
+  free = list(zones)
+  rnd.shuffle(free)
+  regions = [objects.FunctionalRegion(free.pop()) for i in range(4)]
+  for zone in free:
+    if rnd.random() < 0.85:
+      first, second = rnd.sample(regions, 2)
+      if rnd.random() < 0.2: # split between two regions
+        degree = rnd.choice([0.5, 0.3])
+        objects.Assignment(zone, first, core=(rnd.random() < 0.2), degree=degree).tangle()
+        objects.Assignment(zone, second, core=(rnd.random() < 0.2), degree=1 - degree).tangle()
+      else:
+        objects.Assignment(zone, first, core=(rnd.random() < 0.2)).tangle()
+  return zones[:ZONE_COUNT]
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class MeasureAllTest(unittest.TestCase):
+  def testSameAsPerZone(self):
+    names = sorted(set(objects.ZoneMeasurer.measureMethods) - set(['MAX_MEM'])) # measured zone by zone either way
+    for seed in range(FIXTURE_COUNT):
+      zones = createZones(seed)
+      measurer = objects.ZoneMeasurer(names)
+      columns = measurer.measureAll(zones, names)
+      for name in names:
+        for i, zone in enumerate(zones):
+          expected = measurer.computeMeasure(zone, name)
+          if isinstance(expected, float):
+            self.assertAlmostEqual(columns[name][i], expected, places=9, msg=name)
+          else:
+            self.assertEqual(columns[name][i], expected, msg=name)
+
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class MeasureCacheTest(unittest.TestCase):
+  def assertSameMeasure(self, cached, fresh, name):
+    if not (cached != cached and fresh != fresh): # both NaN
+      self.assertEqual(cached, fresh, msg=name)
+
+  def modify(self, rnd, zones, regions):
+    '''Changes a few random assignments, their degrees and exclave states.'''
+    for i in range(rnd.randint(1, 4)):
+      zone = rnd.choice(zones)
+      assignments = [ass for ass in zone.getAssignments() if zone.getID() != ass.getRegion().getID()] # keep the seeds
+      action = rnd.randrange(4)
+      if action == 0 and assignments:
+        rnd.choice(assignments).erase()
+      elif action == 1 and not zone.getAssignments():
+        objects.Assignment(zone, rnd.choice(regions), core=(rnd.random() < 0.2)).tangle()
+      elif action == 2 and assignments:
+        ass = rnd.choice(assignments)
+        ass.setDegree(ass.getDegree() * 0.5)
+      elif action == 3 and assignments:
+        rnd.choice(assignments).setExclave(rnd.random() < 0.5)
+      else:
+        zone.transferExclaveFlag()
+
+  def testSameAsFresh(self):
+    '''Measures zones and regions repeatedly between modifications, with a cache small enough to evict.'''
+    names = sorted(set(objects.ZoneMeasurer.measureMethods) - set(['MAX_MEM']))
+    regionNames = sorted(set(objects.RegionMeasurer.measureMethods) - set(['HAM_IZ'])) # FunctionalRegion lacks getHintCoreFlows
+    for seed in range(FIXTURE_COUNT // 2):
+      rnd = random.Random(seed)
+      zones = createZones(seed)
+      regions = list(set(ass.getRegion() for zone in zones for ass in zone.getAssignments()))
+      measurer = objects.ZoneMeasurer(names)
+      regionMeasurer = objects.RegionMeasurer()
+      measurer.cache = objects.MeasureCache(rnd.choice([50, 500, 5000]))
+      for round in range(8):
+        for zone in rnd.sample(zones, len(zones) // 2):
+          for name in names:
+            self.assertSameMeasure(measurer.getMeasure(zone, name), measurer.computeMeasure(zone, name), name)
+        for region in regions:
+          for name in regionNames:
+            self.assertSameMeasure(regionMeasurer.getMeasure(region, name), regionMeasurer.computeMeasure(region, name), name)
+        self.modify(rnd, zones, regions)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,63 @@
+'''Checks that the tiled neighbour table equals the untiled one. Needs arcpy.'''
+import os, sys, shutil, tempfile, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+  import arcpy
+except ImportError:
+  arcpy = None
+
+GRID_SIZE = 5 # zones per side
+ZONE_SIZE = 100.0 # metres
+ID_FLD = 'ZID'
+
+@unittest.skipIf(arcpy is None, 'arcpy not available')
+class TiledTableTest(unittest.TestCase):
+  def setUp(self):
+    import common, loaders
+    common.overwrite(True)
+    self.folder = tempfile.mkdtemp()
+    arcpy.CreateFileGDB_management(self.folder, 'test.gdb')
+    self.gdb = os.path.join(self.folder, 'test.gdb')
+    crs = arcpy.SpatialReference(32633)
+    self.zones = os.path.join(self.gdb, 'zones')
+    arcpy.CreateFeatureclass_management(self.gdb, 'zones', 'POLYGON', spatial_reference=crs)
+    arcpy.AddField_management(self.zones, ID_FLD, 'TEXT')
+    cursor = arcpy.da.InsertCursor(self.zones, [ID_FLD, 'SHAPE@'])
+    for row in range(GRID_SIZE):
+      for col in range(GRID_SIZE):
+        x, y = col * ZONE_SIZE, row * ZONE_SIZE
+        ring = [(x, y), (x, y + ZONE_SIZE), (x + ZONE_SIZE, y + ZONE_SIZE), (x + ZONE_SIZE, y), (x, y)]
+        cursor.insertRow(['{}_{}'.format(row, col), loaders.polygonToArcPy([[ring]], crs)])
+    del cursor
+
+  def tearDown(self):
+    shutil.rmtree(self.folder, ignore_errors=True)
+
+  def readPairs(self, table):
+    import common
+    cursor = arcpy.da.SearchCursor(table, [common.NEIGH_FROM_FLD, common.NEIGH_TO_FLD])
+    pairs = set(tuple(str(value) for value in row) for row in cursor)
+    del cursor
+    return pairs
+
+  def compare(self, exterior, selfrel):
+    import neighbour_table
+    plain = os.path.join(self.gdb, 'plain')
+    tiled = os.path.join(self.gdb, 'tiled')
+    neighbour_table.table(self.zones, ID_FLD, plain, exterior=exterior, selfrel=selfrel)
+    neighbour_table.table(self.zones, ID_FLD, tiled, exterior=exterior, selfrel=selfrel,
+      tileSize=2 * ZONE_SIZE, workers=1)
+    plainPairs = self.readPairs(plain)
+    self.assertTrue(plainPairs)
+    self.assertEqual(plainPairs, self.readPairs(tiled))
+
+  def testTiledEqualsPlain(self):
+    self.compare(exterior=True, selfrel=True)
+
+  def testTiledEqualsPlainWithoutSelfRelations(self):
+    self.compare(exterior=False, selfrel=False)
+
+
+if __name__ == '__main__':
+  unittest.main()
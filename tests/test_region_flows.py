@@ -0,0 +1,66 @@
+'''Checks the running flow sums of FunctionalRegion against the flows summed anew. Needs arcpy (imported by objects).'''
+import os, sys, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+  import objects
+except ImportError:
+  objects = None
+
+ZONE_COUNT = 30
+FLOW_COUNT = 200
+STEP_COUNT = 60
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class RunningFlowSumTest(unittest.TestCase):
+  def setUp(self):
+    self.classes = (objects.MonoZone.interactionClass, objects.FunctionalRegion.interactionClass)
+
+  def tearDown(self):
+    objects.MonoZone.interactionClass, objects.FunctionalRegion.interactionClass = self.classes
+
+  def createZones(self, cls):
+    objects.MonoZone.interactionClass = cls # as the loader switches the interaction class
+    objects.FunctionalRegion.interactionClass = cls
+    self.random = random.Random(41)
+    self.zones = [objects.MonoZone(str(i), mass=self.random.randint(1, 100)) for i in range(ZONE_COUNT)]
+    for i in range(FLOW_COUNT):
+      source, target = self.random.choice(self.zones), self.random.choice(self.zones)
+      strength = self.random.randint(1, 20)
+      source.addOutflow(target, strength)
+      target.addInflow(source, strength)
+    for zone in self.zones[::3]:
+      zone.addRawOutflow(3)
+      zone.addRawInflow(2)
+
+  def freshSums(self, region, cls):
+    src = region.getCoreZones() + region.getHinterlandZones()
+    zones = region.getZones()
+    outflows = cls.outflowsFrom(src).exclude(zones)
+    inflows = cls.inflowsTo(src).exclude(zones)
+    return (outflows.sum(), inflows.sum(), cls.outflowsFrom(src).restrict(src).sum())
+
+  def check(self, cls):
+    self.createZones(cls)
+    region = objects.FunctionalRegion(self.zones[0])
+    assignments = {}
+    for i in range(STEP_COUNT):
+      zone = self.random.choice(self.zones[1:])
+      if zone in assignments:
+        assignments.pop(zone).erase()
+      else:
+        ass = objects.Assignment(zone, region, core=(self.random.random() < 0.2), degree=self.random.choice([1, 0.5, 0]))
+        ass.tangle()
+        assignments[zone] = ass
+      if region.getCoreZones() or region.getHinterlandZones():
+        self.assertEqual((region.getOutflowSum(), region.getInflowSum(), region.getIntraflowSum()), self.freshSums(region, cls))
+
+  def testInteractions(self):
+    self.check(objects.Interactions)
+
+  def testSparseInteractions(self):
+    self.check(objects.SparseInteractions)
+
+
+if __name__ == '__main__':
+  unittest.main()
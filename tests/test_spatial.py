@@ -0,0 +1,110 @@
+'''Checks the packed bounding box index against pairwise box and zone tests and the point grid against a scan of all points. GeometricalZoneIndex needs arcpy (imported by objects).'''
+import os, sys, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import spatial
+try:
+  import objects
+except ImportError:
+  objects = None
+
+FIXTURE_COUNT = 200
+QUERY_COUNT = 20
+
+def randomBoxes(rnd, count):
+  '''Creates boxes on a coarse integer grid so that many of them only touch, some of them degenerate.'''
+  span = rnd.randint(5, 100)
+  boxes = []
+  for i in range(count):
+    x, y = rnd.randint(0, span), rnd.randint(0, span)
+    boxes.append((x, y, x + rnd.randint(0, 10), y + rnd.randint(0, 10)))
+  return boxes
+
+def boxesOverlap(box, other, tolerance=0):
+  return (box[0] <= other[2] + tolerance and other[0] <= box[2] + tolerance and
+    box[1] <= other[3] + tolerance and other[1] <= box[3] + tolerance)
+
+
+class BoxIndexTest(unittest.TestCase):
+  def testSameAsPairwise(self):
+    rnd = random.Random(26)
+    for i in range(FIXTURE_COUNT):
+      boxes = randomBoxes(rnd, rnd.choice([0, 1, 2, rnd.randint(3, 40), rnd.randint(40, 400)]))
+      tolerance = rnd.choice([0, 0, 0.5, 2])
+      index = spatial.BoxIndex(boxes, nodeSize=rnd.choice([2, 3, 4, 16]))
+      firsts, seconds = index.candidatePairs(tolerance)
+      self.assertEqual(sorted(zip(firsts.tolist(), seconds.tolist())),
+        [(j, k) for j in range(len(boxes)) for k in range(j + 1, len(boxes)) if boxesOverlap(boxes[j], boxes[k], tolerance)])
+      for window in randomBoxes(rnd, QUERY_COUNT):
+        self.assertEqual(index.query(window, tolerance).tolist(),
+          [j for j, box in enumerate(boxes) if boxesOverlap(box, window, tolerance)])
+
+
+class PointGridTest(unittest.TestCase):
+  def testSameAsScan(self):
+    '''Replays random insertions, moves and removals, comparing nearest item queries with a scan of all items.'''
+    rnd = random.Random(47)
+    for i in range(FIXTURE_COUNT):
+      span = rnd.choice([5, 100, 10000])
+      cellSize = span * rnd.choice([0.1, 0.5, 3])
+      if span == 5 and rnd.random() < 0.3:
+        cellSize = 0 # unit cells
+      grid = spatial.PointGrid(cellSize)
+      points = {}
+      for j in range(rnd.randint(1, 150)):
+        action = rnd.random()
+        if action < 0.6 or not points:
+          item = rnd.randint(0, 60)
+          points[item] = (rnd.randint(-span, span), rnd.randint(-span, span)) # many equal distances
+          grid.insert(item, points[item])
+        elif action < 0.75:
+          item = rnd.choice(list(points))
+          del points[item]
+          grid.remove(item)
+        self.assertEqual(len(grid), len(points))
+        query = (rnd.uniform(-1.5 * span, 1.5 * span), rnd.uniform(-1.5 * span, 1.5 * span))
+        odd = rnd.random() < 0.5
+        accept = (lambda item: item % 2 == 1) if odd else None
+        candidates = [(((x - query[0]) ** 2 + (y - query[1]) ** 2, -other), other)
+          for other, (x, y) in points.items() if not odd or other % 2 == 1]
+        self.assertEqual(grid.nearest(query, accept, key=lambda item: -item), min(candidates)[1] if candidates else None)
+
+
+if objects is not None:
+  class DiscZone(objects.GeometricalZone):
+    '''A zone shaped as a disc, intersecting others by the distance of centres.'''
+    def __init__(self, id, x, y, radius):
+      objects.GeometricalZone.__init__(self, id)
+      self.x, self.y, self.radius = x, y, radius
+
+    def getExtent(self):
+      return (self.x - self.radius, self.y - self.radius, self.x + self.radius, self.y + self.radius)
+
+    def intersects(self, zone):
+      return (self.x - zone.x) ** 2 + (self.y - zone.y) ** 2 <= (self.radius + zone.radius) ** 2
+
+@unittest.skipIf(objects is None, 'arcpy not available')
+class GeometricalZoneIndexTest(unittest.TestCase):
+  def testSameNeighbours(self):
+    '''Links neighbours through the index and by testing every zone pair.'''
+    rnd = random.Random(126)
+    for i in range(FIXTURE_COUNT // 4):
+      discs = [(rnd.uniform(0, 100), rnd.uniform(0, 100), rnd.uniform(0.5, 8)) for j in range(rnd.randint(0, 150))]
+      indexed = [DiscZone(j, *disc) for j, disc in enumerate(discs)]
+      paired = [DiscZone(j, *disc) for j, disc in enumerate(discs)]
+      objects.GeometricalZoneIndex(indexed).linkNeighbours()
+      for j, zone in enumerate(paired):
+        for other in paired[j+1:]:
+          if zone.intersects(other):
+            zone.addNeighbour(other)
+            other.addNeighbour(zone)
+      neighIDs = lambda zones: [sorted(neigh.getID() for neigh in zone.getNeighbours()) for zone in zones]
+      self.assertEqual(neighIDs(indexed), neighIDs(paired))
+      index = objects.GeometricalZoneIndex(indexed)
+      for zone in indexed:
+        self.assertEqual(sorted(cand.getID() for cand in index.intersecting(zone)),
+          sorted(neigh.getID() for neigh in zone.getNeighbours()))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,80 @@
+'''Checks the tile ownership and the deduplication of tile results of the tiled neighbour table.'''
+import os, sys, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import spatial
+
+FIXTURE_COUNT = 100
+POINT_COUNT = 200
+EXTERIOR_ID = -1
+
+class TileGridTest(unittest.TestCase):
+  def createGrid(self, rnd):
+    xmin, ymin = rnd.uniform(-100, 100), rnd.uniform(-100, 100)
+    bbox = (xmin, ymin, xmin + rnd.uniform(1, 500), ymin + rnd.uniform(1, 500))
+    return bbox, spatial.TileGrid(bbox, rnd.uniform(10, 200))
+
+  def testOwnership(self):
+    '''Every point inside the box lies in the window of its tile, every point outside in the nearest one.'''
+    rnd = random.Random(27)
+    for i in range(FIXTURE_COUNT):
+      bbox, grid = self.createGrid(rnd)
+      for j in range(POINT_COUNT):
+        point = (rnd.uniform(bbox[0] - 50, bbox[2] + 50), rnd.uniform(bbox[1] - 50, bbox[3] + 50))
+        tile = grid.tileOf(point)
+        self.assertTrue(0 <= tile < grid.xcells * grid.ycells)
+        xmin, ymin, xmax, ymax = grid.window(tile)
+        clamped = (min(max(point[0], bbox[0]), bbox[2]), min(max(point[1], bbox[1]), bbox[3]))
+        self.assertTrue(xmin <= clamped[0] <= xmax + 1e-9 and ymin <= clamped[1] <= ymax + 1e-9)
+
+  def testWindowsCoverBox(self):
+    rnd = random.Random(28)
+    for i in range(FIXTURE_COUNT):
+      bbox, grid = self.createGrid(rnd)
+      windows = [grid.window(tile) for tile in range(grid.xcells * grid.ycells)]
+      self.assertAlmostEqual(min(window[0] for window in windows), bbox[0])
+      self.assertAlmostEqual(min(window[1] for window in windows), bbox[1])
+      self.assertTrue(max(window[2] for window in windows) >= bbox[2])
+      self.assertTrue(max(window[3] for window in windows) >= bbox[3])
+
+  def testOwnedPairs(self):
+    '''Simulates tiles that report the neighbours of all zones in their widened window, with spurious exterior
+    relations where the window cuts a zone off its neighbours, and expects the untiled relations back.'''
+    rnd = random.Random(29)
+    for i in range(FIXTURE_COUNT):
+      size = rnd.randint(2, 12)
+      spacing = 10.0
+      centroids = dict(((col, row), (col * spacing + rnd.uniform(-2, 2), row * spacing + rnd.uniform(-2, 2)))
+        for col in range(size) for row in range(size))
+      pairs = set()
+      for (col, row) in centroids:
+        if col in (0, size - 1) or row in (0, size - 1):
+          pairs.add(((col, row), EXTERIOR_ID))
+        pairs.add(((col, row), (col, row)))
+        for other in ((col + 1, row), (col - 1, row), (col, row + 1), (col, row - 1)):
+          if other in centroids:
+            pairs.add(((col, row), other))
+      bbox = (min(x for x, y in centroids.values()), min(y for x, y in centroids.values()),
+        max(x for x, y in centroids.values()), max(y for x, y in centroids.values()))
+      grid = spatial.TileGrid(bbox, rnd.uniform(5, 60))
+      owners = dict((id, grid.tileOf(centroid)) for id, centroid in centroids.items())
+      overlap = 2 * spacing
+      results = []
+      for tile in sorted(set(owners.values())):
+        xmin, ymin, xmax, ymax = grid.window(tile, overlap)
+        inside = set(id for id, (x, y) in centroids.items() if xmin <= x <= xmax and ymin <= y <= ymax)
+        tilePairs = []
+        for fromID, toID in pairs:
+          if fromID in inside:
+            if toID == EXTERIOR_ID or toID in inside:
+              tilePairs.append((fromID, toID))
+            else: # cut off by the tile border
+              tilePairs.append((fromID, EXTERIOR_ID))
+        results.append((tile, tilePairs))
+      self.assertEqual(spatial.TileGrid.ownedPairs(results, owners), pairs)
+      self.assertEqual(spatial.TileGrid.ownedPairs(results, owners, selfrel=False),
+        set(pair for pair in pairs if pair[0] != pair[1]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,114 @@
+'''Checks the shared edge dissolve against the union of grid cell zones. Needs arcpy (imported by common).'''
+import os, sys, math, random, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+  import topology
+except ImportError:
+  topology = None
+
+FIXTURE_COUNT = 400
+JITTER = 1e-9
+
+def cellPolygon(rnd, x, y, jitter=0):
+  '''Creates a unit cell multipolygon in a random orientation starting at a random corner.'''
+  corners = [(x, y), (x, y + 1), (x + 1, y + 1), (x + 1, y)]
+  if rnd.random() < 0.5:
+    corners.reverse()
+  start = rnd.randrange(4)
+  corners = corners[start:] + corners[:start]
+  ring = [[cx + rnd.uniform(-jitter, jitter), cy + rnd.uniform(-jitter, jitter)] for cx, cy in corners]
+  return [[ring + [list(ring[0])]]]
+
+def isInside(multipolygon, point):
+  '''Tells whether the point is inside the multipolygon by the even-odd rule over all its rings.'''
+  inside = False
+  for part in multipolygon:
+    for ring in part:
+      if topology.ringContains(ring, point):
+        inside = not inside
+  return inside
+
+
+@unittest.skipIf(topology is None, 'arcpy not available')
+class DissolveTest(unittest.TestCase):
+  def createCells(self, rnd):
+    width, height = rnd.randint(1, 9), rnd.randint(1, 9)
+    density = rnd.uniform(0.3, 1.0)
+    cells = set((x, y) for x in range(width) for y in range(height) if rnd.random() < density)
+    return cells or set([(0, 0)])
+
+  def check(self, cells, dissolved):
+    '''Compares the dissolved cells with their union: the same cells are covered,
+    every edge is a border between a covered and an uncovered cell and the orientation is that of ArcGIS.'''
+    xmax = max(x for x, y in cells) + 2
+    ymax = max(y for x, y in cells) + 2
+    for x in range(-1, xmax):
+      for y in range(-1, ymax):
+        self.assertEqual(isInside(dissolved, (x + 0.5, y + 0.5)), (x, y) in cells)
+    area = 0
+    for part in dissolved:
+      self.assertTrue(topology.signedArea(part[0]) < 0)
+      for hole in part[1:]:
+        self.assertTrue(topology.signedArea(hole) > 0)
+      for ring in part:
+        area -= topology.signedArea(ring)
+        for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+          dx, dy = x1 - x0, y1 - y0
+          self.assertAlmostEqual(abs(dx) + abs(dy), 1)
+          middle = ((x0 + x1) / 2.0, (y0 + y1) / 2.0)
+          left, right = [(int(math.floor(middle[0] + side * dy / 2.0)), int(math.floor(middle[1] - side * dx / 2.0))) for side in (-1, 1)]
+          self.assertNotEqual(left in cells, right in cells)
+    self.assertAlmostEqual(area, len(cells))
+    outers = [part[0] for part in dissolved]
+    for part in dissolved:
+      for hole in part[1:]: # belongs to the smallest enclosing outer ring
+        point = ((hole[0][0] + hole[1][0]) / 2.0, (hole[0][1] + hole[1][1]) / 2.0)
+        enclosing = [outer for outer in outers if topology.ringContains(outer, point)]
+        self.assertIs(max(enclosing, key=topology.signedArea), part[0])
+
+  def testSameAsUnion(self):
+    rnd = random.Random(32)
+    for i in range(FIXTURE_COUNT):
+      cells = self.createCells(rnd)
+      precise = rnd.random() < 0.5
+      polygons = [cellPolygon(rnd, x, y, 0 if precise else JITTER) for x, y in sorted(cells)]
+      rnd.shuffle(polygons)
+      self.check(cells, topology.dissolve(polygons, None if precise else 1e-6))
+
+  def testNestedIslands(self):
+    '''Dissolves frames nested in each other's holes, so holes must go to the smallest enclosing ring.'''
+    rnd = random.Random(232)
+    cells = set()
+    for size in (11, 7, 3):
+      low = (11 - size) // 2
+      high = low + size - 1
+      cells.update((x, y) for x in range(low, high + 1) for y in range(low, high + 1) if x in (low, high) or y in (low, high))
+    polygons = [cellPolygon(rnd, x, y) for x, y in sorted(cells)]
+    rnd.shuffle(polygons)
+    dissolved = topology.dissolve(polygons)
+    self.assertEqual(len(dissolved), 3)
+    self.check(cells, dissolved)
+
+  def testDissolveAll(self):
+    '''Dissolves several regions serially, some of them only merged as they do not touch.'''
+    rnd = random.Random(132)
+    regionCells = {}
+    for regID in range(20):
+      if regID % 4 == 0: # scattered cells merged without edge matching
+        regionCells[regID] = set((2 * x, 2 * y) for x, y in self.createCells(rnd))
+      else:
+        regionCells[regID] = self.createCells(rnd)
+    regionPolygons = {regID : [cellPolygon(rnd, x, y) for x, y in cells] for regID, cells in regionCells.items()}
+    touching = set(regID for regID in regionCells if regID % 4)
+    results = dict(topology.dissolveAll(regionPolygons, touching, workers=1))
+    self.assertEqual(sorted(results), sorted(regionCells))
+    for regID, dissolved in results.items():
+      if regID in touching:
+        self.check(regionCells[regID], dissolved)
+      else:
+        self.assertEqual(len(dissolved), len(regionCells[regID]))
+
+
+if __name__ == '__main__':
+  unittest.main()
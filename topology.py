@@ -0,0 +1,141 @@
+import common
+import collections
+
+def dissolve(polygons, precision=None):
+  '''Dissolves polygons given as multipolygon coordinate lists (as from loaders.arcpyToPolygon)
+  into a single multipolygon.
+
+  All rings are oriented consistently (outer counterclockwise, holes clockwise) and broken
+  into edges; an edge met in both directions is a shared border and cancels out. The remaining
+  edges are chained into rings and holes are assigned to the smallest enclosing outer ring.
+  Shared borders must have matching vertices in both polygons, as in a topologically clean zone layer;
+  precision snaps the coordinates to a grid of that size before matching.
+  The result uses the ArcGIS orientation (outer rings clockwise).'''
+  edges = collections.Counter()
+  for polygon in polygons:
+    for part in polygon:
+      for i, ring in enumerate(part):
+        ring = normalizeRing(ring, precision)
+        if len(ring) < 4:
+          continue
+        if (signedArea(ring) > 0) != (i == 0):
+          ring.reverse()
+        for start, end in zip(ring[:-1], ring[1:]):
+          if edges[(end, start)]: # shared border
+            edges[(end, start)] -= 1
+          else:
+            edges[(start, end)] += 1
+  return assembleRings(chainRings(edges))
+
+def normalizeRing(ring, precision=None):
+  '''Returns the ring as a closed list of coordinate tuples without repeated vertices.'''
+  if precision:
+    points = [(round(pt[0] / precision) * precision, round(pt[1] / precision) * precision) for pt in ring]
+  else:
+    points = [(pt[0], pt[1]) for pt in ring]
+  normal = []
+  for pt in points:
+    if not normal or normal[-1] != pt:
+      normal.append(pt)
+  if normal and normal[0] != normal[-1]:
+    normal.append(normal[0])
+  return normal
+
+def chainRings(edges):
+  '''Chains directed edges (a Counter of (start, end) pairs) into closed rings.
+  A walk that revisits a vertex cuts off the loop as a separate ring, so all rings are simple.'''
+  outgoing = collections.defaultdict(list)
+  for (start, end), count in edges.iteritems():
+    if count > 0:
+      outgoing[start].extend([end] * count)
+  rings = []
+  for origin in list(outgoing.iterkeys()):
+    while outgoing[origin]:
+      walk = [origin]
+      positions = {origin : 0}
+      while True:
+        ends = outgoing[walk[-1]]
+        if not ends: # unbalanced edges (overlapping input), drop the open chain
+          break
+        nextPt = ends.pop()
+        if nextPt in positions:
+          pos = positions[nextPt]
+          rings.append(walk[pos:] + [nextPt])
+          for pt in walk[pos+1:]:
+            del positions[pt]
+          del walk[pos+1:]
+          if pos == 0:
+            break
+        else:
+          positions[nextPt] = len(walk)
+          walk.append(nextPt)
+  return [ring for ring in rings if len(ring) >= 4]
+
+def assembleRings(rings):
+  '''Groups counterclockwise outer rings with the clockwise holes they contain into
+  a multipolygon in the ArcGIS orientation.'''
+  outers = []
+  holes = []
+  for ring in rings:
+    area = signedArea(ring)
+    if area > 0:
+      outers.append((area, ring))
+    elif area < 0:
+      holes.append(ring)
+  outers.sort()
+  parts = [[ring] for outerArea, ring in outers]
+  for hole in holes:
+    point = ((hole[0][0] + hole[1][0]) / 2.0, (hole[0][1] + hole[1][1]) / 2.0)
+    for part in parts: # smallest enclosing outer ring first
+      if ringContains(part[0], point):
+        part.append(hole)
+        break
+    else:
+      common.warning('dissolve produced a hole outside all outer rings, dropping it')
+  return [[ring[::-1] for ring in part] for part in parts]
+
+def signedArea(ring):
+  '''Returns the signed area of a closed ring, positive for counterclockwise rings.'''
+  return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:])) / 2.0
+
+def ringContains(ring, point):
+  '''Returns True if the point lies inside the closed ring (by ray casting).'''
+  x, y = point
+  inside = False
+  for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+    if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / float(y1 - y0):
+      inside = not inside
+  return inside
+
+def merge(polygons):
+  '''Joins polygons without shared borders into a multipolygon by concatenating their parts.'''
+  return [part for polygon in polygons for part in polygon]
+
+def dissolveTask(task):
+  '''Dissolves the zone polygons of a single region. Runs in a worker process.'''
+  regID, polygons, touching, precision = task
+  if touching:
+    return regID, dissolve(polygons, precision)
+  else:
+    return regID, merge(polygons)
+
+def dissolveAll(regionPolygons, touching=None, precision=None, workers=None, chunksize=64):
+  '''Dissolves zone polygons of all regions in a process pool.
+
+  regionPolygons is a dict of region IDs and lists of their zone polygons. If touching
+  (a set of region IDs whose zones share borders, such as derived from a neighbour table)
+  is given, the polygons of other regions are only merged into a multipolygon.
+  Yields region IDs with their dissolved multipolygons.'''
+  tasks = ((regID, polygons, (touching is None or regID in touching) and len(polygons) > 1, precision)
+    for regID, polygons in regionPolygons.iteritems())
+  if workers == 1:
+    for task in tasks:
+      yield dissolveTask(task)
+  else:
+    pool = common.processPool(workers)
+    try:
+      for result in pool.imap_unordered(dissolveTask, tasks, chunksize):
+        yield result
+    finally:
+      pool.close()
+      pool.join()